@@ -0,0 +1,58 @@
+import asyncio
+from collections import deque
+
+class AdmissionQueue:
+    """Bounded FIFO of requests waiting for a free backend slot.
+
+    A request that finds every backend at its in-flight limit waits here until a
+    slot is released or its timeout runs out. Waiters are woken in arrival order;
+    a woken waiter that loses the slot to a race waits again at the front. When
+    the queue already holds `max_size` requests, new ones are turned away at once
+    instead of piling up.
+    """
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.waiters = deque() # futures, oldest first
+
+    def __len__(self):
+        return len(self.waiters)
+
+    def is_full(self):
+        return len(self.waiters) >= self.max_size
+
+    async def wait(self, timeout, front=False):
+        """Waits until woken by `wake` or until `timeout` seconds have passed.
+
+        Args:
+            timeout (float): Longest time to wait, in seconds.
+            front (bool): Queue ahead of everyone else, for a waiter that was woken
+                but found no free slot.
+
+        Returns:
+            True if woken, False if the timeout ran out first.
+        """
+        future = asyncio.get_running_loop().create_future()
+        if front:
+            self.waiters.appendleft(future)
+        else:
+            self.waiters.append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            # still queued if it timed out or its request was cancelled
+            if not future.done() or future.cancelled():
+                try:
+                    self.waiters.remove(future)
+                except ValueError:
+                    pass
+
+    def wake(self, count=1):
+        """Wakes up to `count` of the longest-waiting requests."""
+        while count > 0 and self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                count -= 1
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from embedders import EmbeddingBatcher
+
+logger = logging.getLogger(__name__)
+
+CacheMatch = namedtuple("CacheMatch", ["value", "embedding", "similarity", "provisional"])
+
+class AsyncSemanticCache:
+    """Asyncio facade over a SemanticCache that keeps embedding work off the event loop.
+
+    Embeddings are computed by an EmbeddingBatcher, which groups concurrent lookups
+    and inserts into micro-batches on its own thread. Index lookups and inserts run
+    on a separate thread pool. At most `max_workers` index operations run at once
+    and at most `max_pending` lookups and inserts may be in flight. Past that limit the facade
+    sheds load instead of queueing: lookups report a miss and inserts are dropped,
+    so a burst of traffic can never stall the proxy or the heartbeat listeners.
+
+    While the embedding model is still loading, only the exact tier is consulted:
+    lookups that would need an embedding report a miss rather than wait. Inserts
+    go into the exact tier at once and join the semantic tier once the model has
+    embedded them.
+
+    If a MetricsRegistry is passed as `metrics`, embedding and lookup latencies are
+    recorded in it, along with the cache's size, bytes and hit ratio.
+    """
+    def __init__(self, cache, max_workers=1, max_pending=64, max_batch_size=16, max_wait_ms=5, CACHE_LOGS=True, metrics=None):
+        self.cache = cache
+        self.batcher = EmbeddingBatcher(cache.embedder, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="semantic-cache")
+        self.workers = asyncio.Semaphore(max_workers)
+        self.pending = 0
+        self.background_tasks = set()
+        self.logged_failures = set() # (stage, exception type) of insert failures already logged in full
+        self.CACHE_LOGS = CACHE_LOGS
+
+        self.embed_seconds = self.lookup_seconds = None
+        if metrics is not None:
+            self.embed_seconds = metrics.histogram("cache_embed_seconds", "Time to embed a message, batching included")
+            self.lookup_seconds = metrics.histogram("cache_lookup_seconds", "Time to search the cache index for an embedding")
+            metrics.gauge("cache_entries", "Entries in the semantic cache").set_function(lambda: len(cache))
+            metrics.gauge("cache_bytes", "Bytes of vectors and responses held by the semantic cache").set_function(lambda: int(cache.cache_bytes))
+            metrics.gauge("cache_hit_ratio", "Share of lookups answered by either cache tier").set_function(lambda: cache.hit_stats()["hit_ratio"])
+
+    async def get(self, msg):
+        """Looks up the given message in the cache without blocking the event loop.
+
+        Args:
+            msg (str): The message to be checked against the cache.
+
+        Returns:
+            The cached response, or None on a miss or when the cache is saturated.
+        """
+        value, _ = await self.get_with_embedding(msg)
+        return value
+
+    async def get_with_embedding(self, msg):
+        """Looks up the given message and also returns its embedding for reuse.
+
+        The embedding can be passed back to `add`, and used to match the message
+        against other in-flight requests, without embedding the message again.
+
+        Returns:
+            (cached response or None, embedding or None). The embedding is None on an
+            exact-tier hit, which needs no embedding, when the cache is saturated and
+            while the embedding model is loading.
+        """
+        match = await self.match(msg)
+        return match.value, match.embedding
+
+    async def match(self, msg, provisional_threshold=None):
+        """Looks up the given message, optionally accepting a near miss as a provisional answer.
+
+        Args:
+            msg (str): The message to be checked against the cache.
+            provisional_threshold (float): The lowest similarity at which the best
+                candidate of a semantic miss is returned as a provisional answer.
+
+        Returns:
+            A CacheMatch. Its embedding is None in the same cases as for
+            `get_with_embedding`, and its similarity is None when no index was searched.
+        """
+        value = self.cache.get_exact(msg)
+        if value is not None:
+            return CacheMatch(value, None, None, False)
+        if not self.cache.embedder.is_ready():
+            return CacheMatch(None, None, None, False)
+        if not self.admit():
+            if self.CACHE_LOGS:
+                logger.warning("Cache saturated - skipping lookup!")
+            return CacheMatch(None, None, None, False)
+        self.pending += 1
+        try:
+            started = time.perf_counter()
+            embedding = await self.batcher.embed(msg)
+            embedded = time.perf_counter()
+            value, similarity, provisional = await self.run(self.cache.match, embedding, provisional_threshold)
+            if self.embed_seconds is not None:
+                self.embed_seconds.observe(embedded - started)
+                self.lookup_seconds.observe(time.perf_counter() - embedded)
+            return CacheMatch(value, embedding, similarity, provisional)
+        finally:
+            self.pending -= 1
+
+    async def similarity(self, a, b):
+        """Returns the cosine similarity of two messages' embeddings.
+
+        Like a lookup, it counts against `max_pending` and does not wait for the
+        embedding model to load.
+
+        Returns:
+            The similarity, or None while the model is loading or the cache is saturated.
+        """
+        if not self.cache.embedder.is_ready():
+            return None
+        if not self.admit():
+            if self.CACHE_LOGS:
+                logger.warning("Cache saturated - skipping similarity check!")
+            return None
+        self.pending += 1
+        try:
+            embedding_a, embedding_b = await asyncio.gather(self.batcher.embed(a), self.batcher.embed(b))
+            return float(self.cache.cosine_similarity(embedding_a, embedding_b))
+        finally:
+            self.pending -= 1
+
+    async def add(self, msg, value, embedding=None, cost=1.0):
+        """Adds a response to the cache without blocking the event loop.
+
+        Without an embedding the response is stored in the exact tier first, so a
+        repeat of the message hits even while the model is loading, and is added to
+        the semantic tier once the message is embedded. If `max_pending` operations
+        are already in flight by then, it stays in the exact tier only. Failures are
+        logged rather than raised, since inserts usually run as background tasks.
+
+        Args:
+            msg (str): The request message used as the cache key.
+            value (str): The response to cache.
+            embedding (np.ndarray): The message's embedding, if already computed.
+            cost (float): The backend seconds it took to generate the response.
+        """
+        if not self.admit():
+            if self.CACHE_LOGS:
+                logger.warning("Cache saturated - dropping insert!")
+            return
+        self.pending += 1
+        try:
+            await self.run(self.cache.insert, embedding, value, msg, cost)
+        except Exception as error:
+            self.log_failure("insert", error)
+            return
+        finally:
+            self.pending -= 1
+        if embedding is not None:
+            return
+        if not self.admit():
+            if self.CACHE_LOGS:
+                logger.warning("Cache saturated - caching in the exact tier only!")
+            return
+        self.pending += 1
+        try:
+            embedding = await self.batcher.embed(msg)
+            await self.run(self.cache.add_embedding, msg, embedding)
+        except Exception as error:
+            self.log_failure("embedding" if embedding is None else "indexing", error)
+        finally:
+            self.pending -= 1
+
+    def log_failure(self, stage, error):
+        """Logs a failed insert stage, with a traceback only the first time it fails this way."""
+        mode = (stage, type(error))
+        if mode in self.logged_failures:
+            logger.debug("Cache %s failed again: %r", stage, error)
+            return
+        self.logged_failures.add(mode)
+        logger.error("Cache %s failed; further %s errors are logged at debug level",
+                     stage, type(error).__name__, exc_info=error)
+
+    def add_nowait(self, msg, value, embedding=None, cost=1.0):
+        """Schedules an insert in the background so the caller can keep forwarding."""
+        task = asyncio.create_task(self.add(msg, value, embedding, cost))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def start(self):
+        """Starts loading the embedding model in the background."""
+        self.cache.embedder.start_loading()
+
+    def clear(self):
+        self.cache.clear()
+
+    async def save_snapshot(self):
+        """Writes the cache's snapshot on the cache pool, so lookups are not held up."""
+        await self.run(self.cache.save_snapshot)
+
+    def hit_stats(self):
+        return self.cache.hit_stats()
+
+    def admit(self):
+        return self.pending < self.max_pending
+
+    async def run(self, func, *args):
+        """Calls func(*args) on the cache pool."""
+        async with self.workers:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    def close(self):
+        self.batcher.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
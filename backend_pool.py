@@ -0,0 +1,85 @@
+import asyncio
+import logging
+
+from framing import FrameReader, write_frame
+
+logger = logging.getLogger(__name__)
+
+class BackendConnection:
+    """A persistent connection to a backend server shared by many client requests.
+
+    Requests from any client can be written to the connection; responses are told
+    apart by request id, so any number of them can be in flight at once. If
+    `handshake` is given, that frame type is sent first, as when connecting to
+    another load balancer as a client.
+    """
+    def __init__(self, host, port, handshake=None):
+        self.host = host
+        self.port = port
+        self.handshake = handshake
+        self.reader = None
+        self.writer = None
+        self.frames = None
+        self.in_flight = 0
+        self.read_task = None
+
+    async def open(self, forward, timeout=None):
+        """Opens the connection and starts forwarding every frame it receives.
+
+        Args:
+            forward: Coroutine function called as forward(frames, connection) that
+                consumes the responses coming back on this connection.
+            timeout (float): Seconds to wait for the connection before raising
+                asyncio.TimeoutError, or None to wait as long as the OS does.
+        """
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout)
+        if self.handshake is not None:
+            write_frame(self.writer, self.handshake)
+        self.frames = FrameReader(self.reader)
+        self.read_task = asyncio.create_task(forward(self.frames, self))
+
+    def send(self, msg_type, request_id, payload, flags=0):
+        write_frame(self.writer, msg_type, request_id, payload, flags)
+        self.in_flight += 1
+
+    def is_open(self):
+        return self.writer is not None and not self.writer.is_closing() and not self.read_task.done()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+class BackendPool:
+    """Pool of persistent, multiplexed connections to one backend server.
+
+    Connections are opened lazily up to `size`, and each request goes out on the
+    open connection with the fewest requests in flight. Opening a connection fails
+    after `connect_timeout` seconds, so an unreachable backend is noticed quickly.
+    """
+    def __init__(self, host, port, forward, size=2, handshake=None, connect_timeout=2.0):
+        self.host = host
+        self.port = port
+        self.forward = forward
+        self.size = size
+        self.handshake = handshake
+        self.connect_timeout = connect_timeout
+        self.connections = []
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Returns an open connection to the backend, opening one if needed."""
+        async with self.lock:
+            self.connections = [conn for conn in self.connections if conn.is_open()]
+            idle = [conn for conn in self.connections if conn.in_flight == 0]
+            if not idle and len(self.connections) < self.size:
+                connection = BackendConnection(self.host, self.port, self.handshake)
+                await connection.open(self.forward, self.connect_timeout)
+                self.connections.append(connection)
+                logger.info("Load balancer connected to backend server on port %s", self.port)
+                return connection
+            return min(self.connections, key=lambda conn: conn.in_flight)
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.connections.clear()
@@ -0,0 +1,278 @@
+"""Load generator and benchmark for the load balancer.
+
+Replays a JSONL workload against a running load balancer and reports throughput,
+latency and time-to-first-byte percentiles, the cache hit rate and how requests
+were spread over the backends. Each workload line is a JSON object with a
+"prompt" and optionally an "at" arrival time in seconds from the start.
+
+    # generate 2000 prompts, 30% exact repeats and 20% paraphrases of earlier prompts
+    python bench.py --generate 2000 --repeat-ratio 0.3 --paraphrase-ratio 0.2 --save workload.jsonl
+
+    # open loop at a fixed 50 requests per second
+    python bench.py --workload workload.jsonl --qps 50
+
+    # closed loop with 16 requests always outstanding, streamed
+    python bench.py --workload workload.jsonl --concurrency 16 --stream
+
+    # accept provisional near-miss answers from the cache
+    python bench.py --workload workload.jsonl --concurrency 16 --provisional
+
+Without --qps or --concurrency the workload's own arrival times are replayed.
+For reproducible runs without a model, start the backends with
+`python server.py <port> --stub`.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import NamedTuple
+
+from framing import FrameReader, MessageType, write_frame, new_request_id, FLAG_CACHE_HIT, FLAG_STREAM, FLAG_PROVISIONAL
+
+LB_HOST = 'localhost'
+LB_PORT = 1234
+
+OPENINGS = ["Once upon a time", "Long ago", "In a distant land", "One stormy night", "At the edge of the world"]
+CHARACTERS = ["a young knight", "an old wizard", "a curious fox", "a lonely robot", "a clever princess", "a tired sailor"]
+ACTIONS = ["found a map", "lost a key", "heard a song", "built a tower", "met a dragon", "opened a door"]
+PLACES = ["in the forest", "by the sea", "under the mountain", "in the city", "on the moon", "near the river"]
+
+# word swaps and fillers that keep a prompt's meaning, to exercise the semantic tier
+SYNONYMS = {
+    "young": "youthful", "old": "elderly", "curious": "inquisitive", "lonely": "solitary",
+    "clever": "smart", "tired": "weary", "found": "discovered", "lost": "misplaced",
+    "built": "constructed", "met": "encountered", "opened": "unlocked", "city": "town",
+    "sea": "ocean", "forest": "woods", "river": "stream", "Long ago": "A long time ago",
+}
+FILLERS = ["Please tell me a story:", "Story:", "Continue this:"]
+
+class Result(NamedTuple):
+    latency: float # seconds from sending the request to its last byte
+    ttfb: float # seconds from sending the request to its first byte
+    cache_hit: bool
+    error: bool
+    overloaded: bool # shed by the load balancer's admission control
+    provisional: bool = False # a near-miss cached answer, verified in the background
+
+def generate_workload(count, repeat_ratio=0.0, paraphrase_ratio=0.0, qps=10.0, seed=0):
+    """Builds a synthetic workload of story prompts with Poisson arrivals at `qps`.
+
+    Args:
+        count (int): Number of requests.
+        repeat_ratio (float): Share of requests that repeat an earlier prompt exactly.
+        paraphrase_ratio (float): Share of requests that reword an earlier prompt.
+        qps (float): Mean arrival rate used for the "at" timestamps.
+        seed (int): Seed for the random generator, so workloads are reproducible.
+    """
+    rng = random.Random(seed)
+    workload, seen = [], []
+    at = 0.0
+    for _ in range(count):
+        draw = rng.random()
+        if seen and draw < repeat_ratio:
+            prompt = rng.choice(seen)
+        elif seen and draw < repeat_ratio + paraphrase_ratio:
+            prompt = paraphrase(rng.choice(seen), rng)
+        else:
+            prompt = f"{rng.choice(OPENINGS)}, {rng.choice(CHARACTERS)} {rng.choice(ACTIONS)} {rng.choice(PLACES)}"
+            prompt += f" (#{len(seen)})"
+            seen.append(prompt)
+        workload.append({"prompt": prompt, "at": round(at, 6)})
+        at += rng.expovariate(qps)
+    return workload
+
+def paraphrase(prompt, rng):
+    """Rewords a prompt while keeping its meaning: synonyms, a filler prefix or different casing."""
+    choice = rng.randrange(3)
+    if choice == 0:
+        swaps = [(word, synonym) for word, synonym in SYNONYMS.items() if word in prompt]
+        if swaps:
+            word, synonym = rng.choice(swaps)
+            return prompt.replace(word, synonym)
+    if choice == 1:
+        return f"{rng.choice(FILLERS)} {prompt}"
+    return "  ".join(prompt.upper().split())
+
+def load_workload(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def save_workload(path, workload):
+    with open(path, "w") as f:
+        for entry in workload:
+            f.write(json.dumps(entry) + "\n")
+
+class BenchClient:
+    """Pipelines requests over a few connections to the load balancer and times each one."""
+    def __init__(self, host, port, connections=8):
+        self.host = host
+        self.port = port
+        self.num_connections = connections
+        self.writers = []
+        self.readers = []
+        self.waiting = {} # request id -> [sent_at, first_byte_at, future]
+        self.next_connection = 0
+
+    async def connect(self):
+        for _ in range(self.num_connections):
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            write_frame(writer, MessageType.HELLO)
+            await writer.drain()
+            self.writers.append(writer)
+            self.readers.append(asyncio.create_task(self.read_responses(FrameReader(reader))))
+
+    async def read_responses(self, frames):
+        async for frame in frames:
+            entry = self.waiting.get(frame.request_id)
+            if entry is None:
+                continue
+            now = time.perf_counter()
+            if entry[1] is None:
+                entry[1] = now
+            if frame.msg_type == MessageType.CHUNK:
+                continue
+            del self.waiting[frame.request_id]
+            if frame.msg_type == MessageType.STATS:
+                entry[2].set_result(json.loads(frame.text()))
+            else:
+                entry[2].set_result(Result(
+                    latency=now - entry[0],
+                    ttfb=entry[1] - entry[0],
+                    cache_hit=bool(frame.flags & FLAG_CACHE_HIT),
+                    error=frame.msg_type in (MessageType.ERROR, MessageType.OVERLOAD),
+                    overloaded=frame.msg_type == MessageType.OVERLOAD,
+                    provisional=bool(frame.flags & FLAG_PROVISIONAL),
+                ))
+        # the load balancer closed the connection: fail whatever was still waiting on it
+        for request_id, entry in list(self.waiting.items()):
+            if not entry[2].done():
+                entry[2].set_exception(ConnectionError("load balancer closed the connection"))
+
+    async def send(self, msg_type, payload=b'', flags=0):
+        request_id = new_request_id()
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request_id] = [time.perf_counter(), None, future]
+        writer = self.writers[self.next_connection]
+        self.next_connection = (self.next_connection + 1) % len(self.writers)
+        write_frame(writer, msg_type, request_id, payload, flags)
+        await writer.drain()
+        return await future
+
+    async def request(self, prompt, stream=False, provisional=False):
+        try:
+            return await self.send(MessageType.REQUEST, prompt, (FLAG_STREAM if stream else 0) | (FLAG_PROVISIONAL if provisional else 0))
+        except ConnectionError:
+            return Result(latency=0.0, ttfb=0.0, cache_hit=False, error=True, overloaded=False)
+
+    async def stats(self):
+        return await self.send(MessageType.STATS)
+
+    async def close(self):
+        for task in self.readers:
+            task.cancel()
+        for writer in self.writers:
+            writer.close()
+
+async def run_open_loop(client, workload, stream, provisional=False):
+    """Sends every request at its "at" time, regardless of how many are still outstanding."""
+    start = time.perf_counter()
+    tasks = []
+    for entry in workload:
+        delay = start + entry.get("at", 0.0) - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(client.request(entry["prompt"], stream, provisional)))
+    return await asyncio.gather(*tasks)
+
+async def run_closed_loop(client, workload, concurrency, stream, provisional=False):
+    """Keeps `concurrency` requests outstanding until the workload is exhausted."""
+    prompts = iter(entry["prompt"] for entry in workload)
+    results = []
+
+    async def worker():
+        for prompt in prompts:
+            results.append(await client.request(prompt, stream, provisional))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+def report(results, elapsed, stats_before, stats_after):
+    ok = [result for result in results if not result.error]
+    latencies = [result.latency * 1000 for result in ok]
+    ttfbs = [result.ttfb * 1000 for result in ok]
+    hits = sum(result.cache_hit for result in ok)
+    overloaded = sum(result.overloaded for result in results)
+
+    print(f"requests:    {len(results)} ({len(results) - len(ok)} errors, {overloaded} overloaded) in {elapsed:.2f} s")
+    print(f"throughput:  {len(ok) / elapsed:.1f} req/s")
+    print("latency ms:  p50 {:.1f}  p95 {:.1f}  p99 {:.1f}".format(*(percentile(latencies, p) for p in (50, 95, 99))))
+    print("ttfb ms:     p50 {:.1f}  p95 {:.1f}  p99 {:.1f}".format(*(percentile(ttfbs, p) for p in (50, 95, 99))))
+    print(f"cache hits:  {hits} ({hits / len(ok) if ok else 0.0:.1%})")
+    provisional = sum(result.provisional for result in ok)
+    if provisional:
+        tuner = stats_after.get("threshold_tuner", {})
+        print(f"provisional: {provisional} ({provisional / len(ok):.1%}), "
+              f"{tuner.get('agreed', 0)} of {tuner.get('verified', 0)} verified answers agreed, threshold {tuner.get('threshold', 0.0):.4f}")
+
+    routed = Counter(stats_after["routed"])
+    routed.subtract(stats_before["routed"])
+    total = sum(routed.values())
+    print(f"backends:    {total} requests generated")
+    for backend, count in sorted(routed.items()):
+        print(f"  {backend:<22} {count:>7} ({count / total if total else 0.0:.1%})")
+
+async def bench(args):
+    if args.generate:
+        workload = generate_workload(args.generate, args.repeat_ratio, args.paraphrase_ratio, args.qps or 10.0, args.seed)
+        if args.save:
+            save_workload(args.save, workload)
+            print(f"Saved {len(workload)} requests to {args.save}")
+    else:
+        workload = load_workload(args.workload)
+    if args.qps and not args.generate:
+        workload = [dict(entry, at=i / args.qps) for i, entry in enumerate(workload)]
+
+    client = BenchClient(args.host, args.port, args.connections)
+    await client.connect()
+    try:
+        stats_before = await client.stats()
+        start = time.perf_counter()
+        if args.concurrency:
+            results = await run_closed_loop(client, workload, args.concurrency, args.stream, args.provisional)
+        else:
+            results = await run_open_loop(client, workload, args.stream, args.provisional)
+        elapsed = time.perf_counter() - start
+        stats_after = await client.stats()
+    finally:
+        await client.close()
+    report(results, elapsed, stats_before, stats_after)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the load balancer with a replayed or generated workload.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--workload", help="JSONL file with one {\"prompt\", \"at\"} object per line")
+    source.add_argument("--generate", type=int, metavar="N", help="generate a workload of N requests")
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="share of generated requests that repeat a prompt")
+    parser.add_argument("--paraphrase-ratio", type=float, default=0.2, help="share of generated requests that reword a prompt")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the generated workload to this JSONL file")
+    rate = parser.add_mutually_exclusive_group()
+    rate.add_argument("--qps", type=float, help="open loop: send requests at this fixed rate")
+    rate.add_argument("--concurrency", type=int, help="closed loop: keep this many requests outstanding")
+    parser.add_argument("--stream", action="store_true", help="ask for streamed responses")
+    parser.add_argument("--provisional", action="store_true", help="accept provisional near-miss answers from the cache")
+    parser.add_argument("--connections", type=int, default=8, help="client connections to spread requests over")
+    parser.add_argument("--host", default=LB_HOST)
+    parser.add_argument("--port", type=int, default=LB_PORT)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    asyncio.run(bench(parse_args()))
@@ -0,0 +1,158 @@
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+SNAPSHOT_VERSION = 2
+RECORD_HEADER = struct.Struct('!16sI') # exact key, value length
+
+class CacheSnapshot:
+    """On-disk snapshot of a SemanticCache's entries.
+
+    The snapshot directory holds one row per cached entry, in eviction order (next
+    victim first), so its size follows the entries rather than the cache's capacity:
+
+        embeddings.npy  (entries, dim) float32 matrix of normalized embeddings
+        keys.npy        (entries, 16) uint8, exact-tier key of each entry (all zero if none)
+        offsets.npy     (entries,) int64, offset of each entry's record in values.log
+        costs.npy       (entries,) float64, generation cost of each entry in seconds
+        expires.npy     (entries,) float64, wall-clock expiry time of each entry (inf if none)
+        values.log      append-only log of (key, value) records
+        manifest.json   entries, dim and version
+
+    The embedding matrix is opened as a copy-on-write memory map, so loading is
+    instant, pages are only read on first use, and several processes loading the
+    same snapshot share its pages until they write to them. Values are read from
+    the log lazily, the first time their entry is hit.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.log = None # read-only mmap of values.log
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def exists(self):
+        return os.path.exists(self.path("manifest.json"))
+
+    def load(self):
+        """Opens the snapshot without reading the embedding matrix.
+
+        Version 1 snapshots, which stored a row for every slot of the cache whether
+        it was occupied or not, are converted to one row per entry on load.
+
+        Returns:
+            dict with the manifest fields and the memory-mapped and loaded per-entry arrays.
+        """
+        with open(self.path("manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest["version"] not in (1, SNAPSHOT_VERSION):
+            raise ValueError(f"unsupported cache snapshot version {manifest['version']}")
+        # an empty array cannot be memory-mapped
+        matrix = np.load(self.path("embeddings.npy"), mmap_mode='c' if manifest.get("entries", 1) else None)
+        keys = np.load(self.path("keys.npy"))
+        offsets = np.load(self.path("offsets.npy"))
+        if manifest["version"] == 1:
+            rows = np.load(self.path("order.npy"))
+            capacity = manifest["capacity"]
+            # snapshots written before cost-aware eviction have no costs or expiry times
+            costs = self.load_optional("costs.npy", np.ones(capacity))[rows]
+            expires_at = self.load_optional("expires.npy", np.full(capacity, np.inf))[rows]
+            matrix, keys, offsets = np.asarray(matrix[rows]), keys[rows], offsets[rows]
+        else:
+            costs = np.load(self.path("costs.npy"))
+            expires_at = np.load(self.path("expires.npy"))
+        manifest.update(matrix=matrix, keys=keys, offsets=offsets, costs=costs, expires_at=expires_at)
+        self.open_log()
+        return manifest
+
+    def load_optional(self, name, default):
+        return np.load(self.path(name)) if os.path.exists(self.path(name)) else default
+
+    def open_log(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+        if self.log_size() > 0:
+            with open(self.path("values.log"), "rb") as f:
+                self.log = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_value(self, offset):
+        """Reads the value stored at the given offset of the value log."""
+        _, length = RECORD_HEADER.unpack_from(self.log, offset)
+        start = offset + RECORD_HEADER.size
+        return self.log[start:start + length].decode()
+
+    def value_size(self, offset):
+        """Returns the encoded length of the value stored at the given offset."""
+        _, length = RECORD_HEADER.unpack_from(self.log, offset)
+        return length
+
+    def save(self, matrix, keys, offsets, new_records, costs, expires_at, compact_ratio=4):
+        """Writes a snapshot, appending only the values that are not logged yet.
+
+        Every argument array has one row per entry, in eviction order. Array files
+        are written to temporary names and swapped in atomically, so a process that
+        has the previous snapshot mapped keeps a consistent view.
+
+        Args:
+            matrix (np.ndarray): (entries, dim) normalized embeddings.
+            keys (np.ndarray): (entries, 16) exact-tier keys.
+            offsets (np.ndarray): Log offset of each entry, -1 for values not logged yet.
+            new_records (list): (row, key bytes, value str) for every entry with offset -1.
+            costs (np.ndarray): Generation cost of each entry in seconds.
+            expires_at (np.ndarray): Wall-clock expiry time of each entry.
+            compact_ratio (float): Rewrite the log with only the live values once it is
+                larger than this many times their size.
+
+        Returns:
+            The updated offsets array. The caller reopens the log with `open_log` once
+            it has switched to the new offsets.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        offsets = offsets.copy()
+        log_path = self.path("values.log")
+        logged = np.flatnonzero(offsets >= 0)
+
+        live_bytes = sum(RECORD_HEADER.size + len(value.encode()) for _, _, value in new_records)
+        live_bytes += sum(RECORD_HEADER.size + self.value_size(offsets[row]) for row in logged)
+        if self.log_size() > compact_ratio * live_bytes:
+            live = [(row, bytes(keys[row]), self.read_value(offsets[row])) for row in logged]
+            self.append_records(log_path + ".tmp", live + new_records, offsets, mode="wb")
+            os.replace(log_path + ".tmp", log_path)
+        else:
+            self.append_records(log_path, new_records, offsets, mode="ab")
+
+        entries, dim = matrix.shape
+        self.write_array("embeddings.npy", matrix.astype(np.float32, copy=False))
+        self.write_array("keys.npy", keys)
+        self.write_array("offsets.npy", offsets)
+        self.write_array("costs.npy", costs)
+        self.write_array("expires.npy", expires_at)
+
+        manifest = {"version": SNAPSHOT_VERSION, "entries": entries, "dim": dim}
+        with open(self.path("manifest.json.tmp"), "w") as f:
+            json.dump(manifest, f)
+        os.replace(self.path("manifest.json.tmp"), self.path("manifest.json"))
+        return offsets
+
+    def append_records(self, log_path, records, offsets, mode):
+        with open(log_path, mode) as f:
+            position = f.tell()
+            for row, key, value in records:
+                data = value.encode()
+                f.write(RECORD_HEADER.pack(key, len(data)))
+                f.write(data)
+                offsets[row] = position
+                position += RECORD_HEADER.size + len(data)
+
+    def log_size(self):
+        path = self.path("values.log")
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def write_array(self, name, array):
+        tmp = self.path(name + ".tmp.npy")
+        np.save(tmp, array)
+        os.replace(tmp, self.path(name))
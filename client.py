@@ -1,12 +1,15 @@
 import asyncio
 import sys
 
+from framing import FrameReader, MessageType, write_frame, new_request_id, FLAG_CACHE_HIT, FLAG_STREAM
+
 CLIENT_HOST = 'localhost'
 
 async def client_program():
     """Client program that connects to the server and sends messages.
     
     The client reads messages from the user and sends them to the server.
+    Responses are streamed and printed piece by piece as they are generated.
     The keyword '.' is used to terminate the connection.
     """
     if(len(sys.argv) != 3):
@@ -17,8 +20,9 @@ async def client_program():
     server_ip = sys.argv[1]
     
     client_reader, client_writer = await asyncio.open_connection(server_ip, port)
+    client_frames = FrameReader(client_reader)
 
-    client_writer.write("CLIENT|ADD".encode())
+    write_frame(client_writer, MessageType.HELLO)
     await client_writer.drain()
 
     message = input(" -> ")
@@ -26,19 +30,48 @@ async def client_program():
         if message.strip() == '':
             continue
         
-        client_writer.write(message.encode())
+        request_id = new_request_id()
+        write_frame(client_writer, MessageType.REQUEST, request_id, message, FLAG_STREAM)
         await client_writer.drain()
         
-        data = await client_reader.read(1024)
-        data = data.decode()
-        
-        print("GPT2 Response:\n", str(data))
+        if not await print_response(client_frames, request_id):
+            print("Load balancer closed the connection")
+            break
         message = input(" -> ")
     
     print("Closing client connection")
     client_writer.close()
     await client_writer.wait_closed()
 
+async def print_response(client_frames, request_id):
+    """Prints the response to the given request as it streams in.
+
+    Returns:
+        False if the connection closed before the response was complete.
+    """
+    started = False
+    async for frame in client_frames:
+        if frame.request_id != request_id:
+            continue
+        if frame.msg_type == MessageType.ERROR:
+            print("Error:\n", frame.text())
+            return True
+        if frame.msg_type == MessageType.OVERLOAD:
+            print("Overloaded:\n", frame.text())
+            return True
+        if frame.msg_type == MessageType.RESPONSE:
+            print("GPT2 Response:\n", frame.text())
+            return True
+        if frame.msg_type == MessageType.CHUNK:
+            if not started:
+                print("GPT2 Response (cached):" if frame.flags & FLAG_CACHE_HIT else "GPT2 Response:")
+                started = True
+            print(frame.text(), end='', flush=True)
+        elif frame.msg_type == MessageType.END:
+            print()
+            return True
+    return False
+
 if __name__ == '__main__':
     asyncio.run(client_program())
 
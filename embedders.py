@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class Embedder(ABC):
+    """Turns a batch of strings into a (batch, dim) float32 embedding matrix."""
+    dim = None
+
+    @abstractmethod
+    def embed(self, texts):
+        """
+        Embeds a batch of texts in one model call.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            np.ndarray of shape (len(texts), dim) and dtype float32.
+        """
+        pass
+
+    def start_loading(self):
+        """Starts loading the embedder's model in the background, if it has one."""
+        pass
+
+    def is_ready(self):
+        """Whether `embed` can run without first waiting for a model to load."""
+        return True
+
+def select_device():
+    """Returns the best available torch device: CUDA, then Apple MPS, then the CPU."""
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+class TransformerEmbedder(Embedder):
+    """Embeds text with a HuggingFace encoder using attention-masked mean pooling.
+
+    Padding and special tokens ([CLS]/[SEP]) are excluded from the mean, so a
+    prompt embeds the same way whether it is alone or padded inside a batch.
+
+    The model is loaded lazily: `start_loading` loads it on a background thread,
+    and `embed` waits for it (or loads it) on first use. With `device=None` the
+    device is picked from what is available.
+    """
+    def __init__(self, model_name="distilbert-base-uncased", device=None, max_length=256):
+        self.model_name = model_name
+        self.device = device
+        self.max_length = max_length
+        self.torch = None
+        self.tokenizer = None
+        self.model = None
+        self.load_lock = threading.Lock()
+        self.loaded = threading.Event()
+
+    @property
+    def dim(self):
+        self.load()
+        return self.model.config.hidden_size
+
+    def start_loading(self):
+        threading.Thread(target=self.load_in_background, name="embedder-load", daemon=True).start()
+
+    def load_in_background(self):
+        try:
+            self.load()
+        except Exception as e:
+            logger.error("Failed to load embedding model %s: %s", self.model_name, e)
+
+    def is_ready(self):
+        return self.loaded.is_set()
+
+    def load(self):
+        """Loads the tokenizer and model, once; other callers wait for the first."""
+        if self.loaded.is_set():
+            return
+        with self.load_lock:
+            if self.loaded.is_set():
+                return
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+
+            self.device = self.device or select_device()
+            logger.info("Loading embedding model %s on %s...", self.model_name, self.device)
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self.model = AutoModel.from_pretrained(self.model_name).to(self.device).eval()
+            self.torch = torch
+            self.loaded.set()
+            logger.info("Embedding model loaded.")
+
+    def embed(self, texts):
+        self.load()
+        encoded = self.tokenizer(
+            list(texts),
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_special_tokens_mask=True,
+            return_tensors="pt",
+        )
+        special_tokens_mask = encoded.pop("special_tokens_mask")
+        encoded = encoded.to(self.device)
+
+        with self.torch.inference_mode():
+            hidden = self.model(**encoded).last_hidden_state # (batch, num_tokens, dim)
+
+        mask = encoded["attention_mask"].bool() & ~special_tokens_mask.bool().to(self.device)
+        mask = mask.unsqueeze(-1).to(hidden.dtype)
+        summed = (hidden * mask).sum(dim=1)
+        counts = mask.sum(dim=1).clamp(min=1)
+        return (summed / counts).float().cpu().numpy()
+
+class HashingEmbedder(Embedder):
+    """Deterministic bag-of-words embedder for tests and offline runs.
+
+    Words and character trigrams are hashed into a fixed number of signed buckets,
+    so identical texts always embed identically and texts that share most of their
+    words score a high cosine similarity. Needs no model download.
+    """
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                sign = 1.0 if value & 1 else -1.0
+                vectors[row, (value >> 1) % self.dim] += sign
+        return vectors
+
+    def features(self, text):
+        words = re.findall(r"\w+", text.lower())
+        for word in words:
+            yield word
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3]
+
+def make_embedder(name):
+    """Builds an embedder by name: 'transformer' (distilbert-base-uncased) or 'hashing'."""
+    if name == 'transformer':
+        return TransformerEmbedder("distilbert-base-uncased")
+    elif name == 'hashing':
+        return HashingEmbedder()
+    raise ValueError(f"unknown embedder: {name}")
+
+class EmbeddingBatcher:
+    """Collects concurrent embedding requests into micro-batches.
+
+    Requests are queued until either `max_batch_size` are waiting or the oldest one
+    has waited `max_wait_ms`, then the whole batch goes through a single
+    `embedder.embed` call on a dedicated worker thread. Each caller awaits its own
+    future and receives its own row of the result.
+    """
+    def __init__(self, embedder, max_batch_size=16, max_wait_ms=5, max_concurrent_batches=1):
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="embedding")
+        self.queue = [] # list of (text, future)
+        self.timer = None
+        self.batch_tasks = set()
+
+    async def embed(self, text):
+        """Returns the embedding of a single text, computed as part of a batch."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.queue.append((text, future))
+
+        if len(self.queue) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        """Dispatches everything currently queued as one batch."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.queue:
+            return
+        batch, self.queue = self.queue[:self.max_batch_size], self.queue[self.max_batch_size:]
+        if self.queue:
+            self.timer = asyncio.get_running_loop().call_later(self.max_wait, self.flush)
+
+        task = asyncio.create_task(self.run_batch(batch))
+        self.batch_tasks.add(task)
+        task.add_done_callback(self.batch_tasks.discard)
+
+    async def run_batch(self, batch):
+        texts = [text for text, _ in batch]
+        loop = asyncio.get_running_loop()
+        try:
+            vectors = await loop.run_in_executor(self.executor, self.embedder.embed, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
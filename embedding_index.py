@@ -0,0 +1,509 @@
+import tempfile
+
+import numpy as np
+
+MIN_GROWTH_ROWS = 1024 # rows a growing array gets on its first allocation
+
+class FlatIndex:
+    """Exact nearest-neighbour index over a float32 embedding matrix.
+
+    Every vector is L2-normalized on insert, so the cosine similarity against all
+    cached entries is a single matrix-vector product. Rows are addressed by slot
+    number, which the owning cache hands out and recycles. The matrix grows with
+    the highest slot written, up to `capacity` rows (without limit if None), so an
+    index only takes memory for the entries it holds.
+
+    An existing matrix of normalized rows for slots 0..n-1 can be passed in, such
+    as a copy-on-write memory map of a cache snapshot, and is used in place until
+    the index grows past it.
+    """
+    def __init__(self, dim, capacity, matrix=None):
+        self.dim = dim
+        self.capacity = capacity
+        self.matrix = np.zeros((0, dim), dtype=np.float32) if matrix is None else matrix
+        self.occupied = np.ones(len(self.matrix), dtype=bool)
+        self.high_water = len(self.matrix) # rows past this mark have never been written
+        self.size = len(self.matrix)
+
+    @property
+    def bytes_per_vector(self):
+        """Process memory taken by one stored vector."""
+        return self.matrix.itemsize * self.dim
+
+    def add(self, slot, vector):
+        """Stores a normalized vector in the given slot.
+
+        Args:
+            slot (int): The row to write, in range [0, capacity).
+            vector (np.ndarray): The embedding to store.
+        """
+        self.matrix = grow(self.matrix, slot + 1, self.capacity)
+        self.occupied = grow(self.occupied, slot + 1, self.capacity)
+        self.matrix[slot] = normalize(vector)
+        if not self.occupied[slot]:
+            self.occupied[slot] = True
+            self.size += 1
+        self.high_water = max(self.high_water, slot + 1)
+
+    def remove(self, slot):
+        """Clears the given slot so it no longer matches any query."""
+        if self.occupied[slot]:
+            self.matrix[slot] = 0.0
+            self.occupied[slot] = False
+            self.size -= 1
+
+    def search(self, query):
+        """Returns the (slot, similarity) of the closest stored vector.
+
+        Args:
+            query (np.ndarray): The query embedding, normalized or not.
+
+        Returns:
+            (None, -1.0) when the index is empty.
+        """
+        if self.size == 0:
+            return None, -1.0
+        scores = self.matrix[:self.high_water] @ normalize(query)
+        best = int(np.argmax(scores))
+        if not self.occupied[best]:
+            # empty rows are zero vectors, so this only happens when every
+            # stored entry has a non-positive similarity
+            scores[~self.occupied[:self.high_water]] = -np.inf
+            best = int(np.argmax(scores))
+        return best, float(scores[best])
+
+    def clear(self):
+        self.matrix[:self.high_water] = 0.0
+        self.occupied[:] = False
+        self.high_water = 0
+        self.size = 0
+
+    def export(self, slots):
+        """Returns a (len(slots), dim) float32 copy of the normalized rows of the given occupied slots."""
+        return np.array(self.matrix[slots], dtype=np.float32)
+
+class IVFIndex:
+    """Approximate nearest-neighbour index using an inverted file of k-means cells.
+
+    Until `train_size` vectors have been added everything lives in a single cell,
+    which behaves like a flat scan. After that the vectors are clustered into
+    `nlist` cells and a query only scans the `nprobe` cells whose centroids are
+    closest to it. Each cell keeps its vectors contiguous, so probing a cell is
+    one matrix-vector product with no gather.
+    """
+    def __init__(self, dim, capacity, nlist=256, nprobe=8, train_size=None, kmeans_iters=10):
+        self.dim = dim
+        self.capacity = capacity
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size or nlist * 16
+        self.kmeans_iters = kmeans_iters
+
+        self.centroids = None
+        self.cell_of = np.full(0, -1, dtype=np.int32) # slot -> cell, grown with the highest slot added
+        self.pos_of = np.full(0, -1, dtype=np.int32) # slot -> row inside the cell
+        self.cells = [_Cell(dim)]
+        self.size = 0
+
+    @property
+    def bytes_per_vector(self):
+        """Process memory taken by one stored vector, including its cell bookkeeping."""
+        return 4 * self.dim + 12
+
+    def add(self, slot, vector):
+        self.cell_of = grow(self.cell_of, slot + 1, self.capacity, fill=-1)
+        self.pos_of = grow(self.pos_of, slot + 1, self.capacity, fill=-1)
+        if self.cell_of[slot] >= 0:
+            self.remove(slot)
+        vector = normalize(vector)
+        cell = 0 if self.centroids is None else int(np.argmax(self.centroids @ vector))
+        self._place(slot, vector, cell)
+        self.size += 1
+
+        if self.centroids is None and self.size >= self.train_size:
+            self.train()
+
+    def remove(self, slot):
+        cell = self.cell_of[slot]
+        if cell < 0:
+            return
+        moved = self.cells[cell].remove(self.pos_of[slot])
+        if moved is not None:
+            self.pos_of[moved] = self.pos_of[slot]
+        self.cell_of[slot] = -1
+        self.pos_of[slot] = -1
+        self.size -= 1
+
+    def search(self, query):
+        if self.size == 0:
+            return None, -1.0
+        query = normalize(query)
+        if self.centroids is None:
+            probe = [0]
+        else:
+            centroid_scores = self.centroids @ query
+            nprobe = min(self.nprobe, len(self.cells))
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        best_slot, best_score = None, -1.0
+        for cell_id in probe:
+            cell = self.cells[cell_id]
+            if cell.count == 0:
+                continue
+            scores = cell.vectors[:cell.count] @ query
+            pos = int(np.argmax(scores))
+            if best_slot is None or scores[pos] > best_score:
+                best_slot, best_score = int(cell.slots[pos]), float(scores[pos])
+        return best_slot, best_score
+
+    def cell(self, vector):
+        """Returns the id of the cell a vector falls in, or None before the index is trained."""
+        if self.centroids is None:
+            return None
+        return int(np.argmax(self.centroids @ normalize(vector)))
+
+    def train(self):
+        """Clusters the current vectors into `nlist` cells and redistributes them."""
+        slots, vectors = self._collect()
+        if len(slots) == 0:
+            return
+        nlist = min(self.nlist, len(slots))
+        self.centroids = kmeans(vectors, nlist, self.kmeans_iters)
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+
+        self.cells = [_Cell(self.dim) for _ in range(nlist)]
+        for slot, vector, cell in zip(slots, vectors, assignment):
+            self._place(int(slot), vector, int(cell))
+
+    def export(self, slots):
+        """Returns a (len(slots), dim) float32 copy of the normalized rows of the given occupied slots."""
+        stored, vectors = self._collect()
+        rows = np.empty(len(self.cell_of), dtype=np.int64)
+        rows[stored] = np.arange(len(stored))
+        return vectors[rows[slots]]
+
+    def clear(self):
+        self.centroids = None
+        self.cell_of[:] = -1
+        self.pos_of[:] = -1
+        self.cells = [_Cell(self.dim)]
+        self.size = 0
+
+    def _place(self, slot, vector, cell):
+        self.pos_of[slot] = self.cells[cell].append(slot, vector)
+        self.cell_of[slot] = cell
+
+    def _collect(self):
+        slots = np.concatenate([cell.slots[:cell.count] for cell in self.cells])
+        vectors = np.concatenate([cell.vectors[:cell.count] for cell in self.cells])
+        return slots, vectors
+
+class QuantizedIndex:
+    """Nearest-neighbour index that keeps its vectors quantized to int8 or float16.
+
+    An int8 row stores each normalized vector divided by a per-vector scale, so it
+    takes a quarter of the float32 memory (plus 4 bytes of scale); a float16 row
+    takes half. A query first scores rows at reduced precision, then re-ranks the
+    `rerank_k` best candidates against their full-precision vectors, so the
+    returned slot and similarity match a float32 index except in the rare case
+    that the true best row falls outside the quantized top-k.
+
+    Without `nlist` every row is scored, which saves memory but is no faster than
+    a flat index. With `nlist`, once `train_size` vectors are stored they are
+    clustered into `nlist` k-means cells like an IVFIndex, and a query only
+    scores the codes of the `nprobe` cells closest to it, so lookups stay
+    sublinear as the cache grows.
+
+    The full-precision copies live in a memory map over a temporary file
+    (rerank='memmap'), where they cost page cache rather than process memory and
+    only the re-ranked rows are read back. rerank='memory' keeps them in RAM and
+    rerank=None skips re-ranking and returns the quantized scores. The codes and
+    the full-precision store grow with the highest slot written, up to `capacity`
+    rows (without limit if None). An existing matrix of normalized rows for slots 0..n-1, such as the
+    memory map of a cache snapshot, can be passed as `full`; its rows are
+    quantized and it is used as the full-precision store in place.
+    """
+    def __init__(self, dim, capacity, dtype='int8', rerank_k=8, rerank='memmap', chunk_size=256, full=None,
+                 nlist=None, nprobe=8, train_size=None, kmeans_iters=10):
+        if dtype not in ('int8', 'float16'):
+            raise ValueError(f"unsupported quantized dtype: {dtype}")
+        self.dim = dim
+        self.capacity = capacity
+        self.dtype = dtype
+        self.rerank_k = rerank_k
+        self.chunk_size = chunk_size # rows converted to float32 at a time while scoring
+        self.buffer = np.empty((chunk_size, dim), dtype=np.float32)
+
+        self.codes = np.zeros((0, dim), dtype=np.int8 if dtype == 'int8' else np.float16)
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.occupied = np.zeros(0, dtype=bool)
+        self.high_water = 0
+        self.size = 0
+
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size or (nlist or 0) * 16
+        self.kmeans_iters = kmeans_iters
+        self.centroids = None
+        if nlist:
+            self.cell_of = np.full(0, -1, dtype=np.int32) # slot -> cell
+            self.pos_of = np.full(0, -1, dtype=np.int32) # slot -> position in the cell's member list
+            self.cells = []
+
+        self.rerank = rerank
+        if full is not None:
+            self.full = full
+        elif rerank in ('memmap', 'memory'):
+            self.full = np.zeros((0, dim), dtype=np.float32)
+        elif rerank is None:
+            self.full = None
+        else:
+            raise ValueError(f"unknown rerank store: {rerank}")
+
+        if full is not None and len(full):
+            rows = len(full)
+            self.reserve(rows)
+            for start in range(0, rows, chunk_size):
+                end = min(start + chunk_size, rows)
+                self.quantize(slice(start, end), np.asarray(full[start:end], dtype=np.float32))
+            self.occupied[:rows] = True
+            self.size = self.high_water = rows
+            if self.nlist and self.size >= self.train_size:
+                self.train()
+
+    @property
+    def bytes_per_vector(self):
+        """Memory taken by one stored vector, including its cell bookkeeping and its
+        full-precision re-rank row, which is counted even when it is memory-mapped."""
+        rerank_bytes = self.full.itemsize * self.dim if self.full is not None else 0
+        return self.codes.itemsize * self.dim + self.scales.itemsize + (8 if self.nlist else 0) + rerank_bytes
+
+    def reserve(self, rows):
+        """Grows the codes and the per-slot arrays to hold at least `rows` slots."""
+        self.codes = grow(self.codes, rows, self.capacity)
+        self.scales = grow(self.scales, rows, self.capacity)
+        self.occupied = grow(self.occupied, rows, self.capacity)
+        if self.nlist:
+            self.cell_of = grow(self.cell_of, rows, self.capacity, fill=-1)
+            self.pos_of = grow(self.pos_of, rows, self.capacity, fill=-1)
+
+    def add(self, slot, vector):
+        vector = normalize(vector)
+        self.reserve(slot + 1)
+        self.quantize([slot], vector[None, :])
+        if self.full is not None:
+            self.full = grow(self.full, slot + 1, self.capacity, memmap=self.rerank == 'memmap')
+            self.full[slot] = vector
+        if not self.occupied[slot]:
+            self.occupied[slot] = True
+            self.size += 1
+        self.high_water = max(self.high_water, slot + 1)
+
+        if self.centroids is not None:
+            self.unassign(slot)
+            self.assign(slot, int(np.argmax(self.centroids @ vector)))
+        elif self.nlist and self.size >= self.train_size:
+            self.train()
+
+    def quantize(self, slots, vectors):
+        """Stores the quantized codes and scales of normalized vectors in the given slots."""
+        if self.dtype == 'int8':
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self.codes[slots] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self.scales[slots] = scales
+        else:
+            self.codes[slots] = vectors
+            self.scales[slots] = 1.0
+
+    def remove(self, slot):
+        if self.occupied[slot]:
+            self.codes[slot] = 0
+            self.scales[slot] = 0.0
+            self.occupied[slot] = False
+            self.size -= 1
+            if self.centroids is not None:
+                self.unassign(slot)
+
+    def search(self, query):
+        if self.size == 0:
+            return None, -1.0
+        query = normalize(query)
+        if self.centroids is not None:
+            return self.search_cells(query)
+        scores = np.empty(self.high_water, dtype=np.float32)
+        for start in range(0, self.high_water, self.chunk_size):
+            end = min(start + self.chunk_size, self.high_water)
+            # convert into a small reused buffer that stays in cache, then score it with BLAS
+            chunk = self.buffer[:end - start]
+            np.copyto(chunk, self.codes[start:end], casting='unsafe')
+            scores[start:end] = chunk @ query
+        scores *= self.scales[:self.high_water]
+        scores[~self.occupied[:self.high_water]] = -np.inf
+
+        return self.rerank_candidates(np.arange(self.high_water), scores, query)
+
+    def search_cells(self, query):
+        """Scores only the codes of the `nprobe` cells closest to the query."""
+        nprobe = min(self.nprobe, len(self.cells))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        slots = np.concatenate([self.cells[cell].slots[:self.cells[cell].count] for cell in probe])
+        if len(slots) == 0:
+            return None, -1.0
+        scores = (self.codes[slots].astype(np.float32) @ query) * self.scales[slots]
+        return self.rerank_candidates(slots, scores, query)
+
+    def rerank_candidates(self, slots, scores, query):
+        """Returns the best (slot, similarity) among scored slots, re-ranked at full precision."""
+        if self.full is None:
+            best = int(np.argmax(scores))
+            return int(slots[best]), float(scores[best])
+
+        k = min(self.rerank_k, self.size, len(slots))
+        candidates = slots[np.argpartition(-scores, k - 1)[:k]]
+        exact = self.full[candidates] @ query
+        best = int(np.argmax(exact))
+        return int(candidates[best]), float(exact[best])
+
+    def cell(self, vector):
+        """Returns the id of the cell a vector falls in, or None while the index has no cells."""
+        if self.centroids is None:
+            return None
+        return int(np.argmax(self.centroids @ normalize(vector)))
+
+    def train(self):
+        """Clusters the stored vectors into `nlist` cells and assigns every slot to one."""
+        slots = np.flatnonzero(self.occupied[:self.high_water])
+        vectors = self.export(slots)
+        nlist = min(self.nlist, len(slots))
+        # a sample of train_size vectors places the centroids about as well as all of them
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), size=min(len(vectors), self.train_size), replace=False)]
+        self.centroids = kmeans(sample, nlist, self.kmeans_iters)
+        self.cells = [_Cell() for _ in range(nlist)]
+        for slot, cell in zip(slots, np.argmax(vectors @ self.centroids.T, axis=1)):
+            self.assign(int(slot), int(cell))
+
+    def assign(self, slot, cell):
+        self.pos_of[slot] = self.cells[cell].append(slot)
+        self.cell_of[slot] = cell
+
+    def unassign(self, slot):
+        cell = self.cell_of[slot]
+        if cell < 0:
+            return
+        moved = self.cells[cell].remove(self.pos_of[slot])
+        if moved is not None:
+            self.pos_of[moved] = self.pos_of[slot]
+        self.cell_of[slot] = -1
+        self.pos_of[slot] = -1
+
+    def export(self, slots):
+        """Returns a (len(slots), dim) float32 copy of the rows of the given occupied slots."""
+        if self.full is not None:
+            return np.array(self.full[slots], dtype=np.float32)
+        return self.codes[slots].astype(np.float32) * self.scales[slots, None]
+
+    def clear(self):
+        self.codes[:self.high_water] = 0
+        self.scales[:] = 0.0
+        self.occupied[:] = False
+        self.high_water = 0
+        self.size = 0
+        if self.nlist:
+            self.centroids = None
+            self.cell_of[:] = -1
+            self.pos_of[:] = -1
+            self.cells = []
+
+class _Cell:
+    """Growable, contiguous block of vectors belonging to one IVF cell.
+
+    Without a `dim` the cell only tracks its slots, for indexes that keep the
+    vectors themselves.
+    """
+    def __init__(self, dim=None, capacity=16):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32) if dim is not None else None
+        self.slots = np.zeros(capacity, dtype=np.int32)
+        self.count = 0
+
+    def append(self, slot, vector=None):
+        if self.count == len(self.slots):
+            if self.vectors is not None:
+                self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+            self.slots = np.concatenate([self.slots, np.zeros_like(self.slots)])
+        pos = self.count
+        if self.vectors is not None:
+            self.vectors[pos] = vector
+        self.slots[pos] = slot
+        self.count += 1
+        return pos
+
+    def remove(self, pos):
+        """Removes the row at `pos` by swapping in the last row.
+
+        Returns:
+            The slot that was moved into `pos`, or None if nothing moved.
+        """
+        last = self.count - 1
+        moved = None
+        if pos != last:
+            if self.vectors is not None:
+                self.vectors[pos] = self.vectors[last]
+            self.slots[pos] = self.slots[last]
+            moved = int(self.slots[pos])
+        self.count -= 1
+        return moved
+
+def grow(array, rows, capacity, memmap=False, fill=0):
+    """Returns `array` with at least `rows` rows, reallocated with doubled size (up to `capacity`) if needed.
+
+    A `capacity` of None puts no limit on the size. New rows are set to `fill`.
+    With `memmap` the reallocated array is a memory map over a temporary file, whose
+    new rows are always zero.
+    """
+    if rows <= len(array):
+        return array
+    size = max(rows, 2 * len(array), MIN_GROWTH_ROWS)
+    if capacity is not None:
+        size = min(capacity, size)
+    shape = (size,) + array.shape[1:]
+    if memmap:
+        grown = np.memmap(tempfile.TemporaryFile(), dtype=array.dtype, mode='w+', shape=shape)
+    else:
+        grown = np.full(shape, fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+def normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return vector
+    return vector / norm
+
+def kmeans(vectors, k, iterations):
+    """Spherical k-means on normalized vectors, returning normalized centroids."""
+    rng = np.random.default_rng(0)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=k)
+        empty = counts == 0
+        # reseed empty clusters with random points so every cell stays usable
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+def make_index(kind, dim, capacity, **kwargs):
+    """Builds an embedding index by name ('flat', 'ivf' or 'quantized')."""
+    if kind == 'flat':
+        return FlatIndex(dim, capacity)
+    elif kind == 'ivf':
+        return IVFIndex(dim, capacity, **kwargs)
+    elif kind == 'quantized':
+        return QuantizedIndex(dim, capacity, **kwargs)
+    raise ValueError(f"unknown index type: {kind}")
@@ -0,0 +1,203 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import numpy as np
+
+from lb_algorithms.indexed_heap import IndexedHeap
+
+class EvictionPolicy(ABC):
+    """Decides which SemanticCache slot to evict when the cache is full.
+
+    The cache reports every insert, hit and removal to the policy, and asks it for
+    a victim when it needs room. Policies only see slot numbers plus the entry's
+    exact key, cost and size; the cache owns the entries themselves.
+    """
+    @abstractmethod
+    def insert(self, slot, key=None, cost=1.0, size=1):
+        """
+        Starts tracking a newly cached entry.
+
+        Args:
+            slot: The slot the entry was stored in.
+            key: The entry's exact-tier key, or None.
+            cost: What it cost to produce the entry, e.g. its generation latency in seconds.
+            size: The entry's size in bytes.
+        """
+        pass
+
+    @abstractmethod
+    def touch(self, slot):
+        """Records a cache hit on the given slot."""
+        pass
+
+    @abstractmethod
+    def remove(self, slot):
+        """Stops tracking a slot that the cache has evicted."""
+        pass
+
+    @abstractmethod
+    def victim(self):
+        """Returns the slot that should be evicted next, without removing it."""
+        pass
+
+    @abstractmethod
+    def __iter__(self):
+        """Iterates over the tracked slots, from the next victim to the most valuable."""
+        pass
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+    def record(self, key):
+        """Records a lookup of the given exact key, whether it hit or not."""
+        pass
+
+    def admit(self, key):
+        """Returns whether an entry with the given key should replace the current victim."""
+        return True
+
+class LRUPolicy(EvictionPolicy):
+    """Evicts the least recently used entry, with O(1) updates on an OrderedDict."""
+    def __init__(self):
+        self.ordering = OrderedDict() # slot -> None, least recently used first
+
+    def insert(self, slot, key=None, cost=1.0, size=1):
+        self.ordering[slot] = None
+        self.ordering.move_to_end(slot)
+
+    def touch(self, slot):
+        self.ordering.move_to_end(slot)
+
+    def remove(self, slot):
+        self.ordering.pop(slot, None)
+
+    def victim(self):
+        return next(iter(self.ordering))
+
+    def __iter__(self):
+        return iter(list(self.ordering))
+
+    def __len__(self):
+        return len(self.ordering)
+
+    def clear(self):
+        self.ordering.clear()
+
+class TinyLFUPolicy(LRUPolicy):
+    """LRU eviction behind a TinyLFU admission filter.
+
+    Every lookup is counted in a count-min sketch. When the cache is full, a new
+    entry only gets in if its prompt has been asked for more often than the entry
+    it would evict, so a burst of one-off prompts cannot flush the popular ones.
+    Counters are halved every `sample_size` lookups so old popularity fades.
+    """
+    def __init__(self, capacity, depth=4):
+        super().__init__()
+        self.width = 1 << max(4, int(capacity - 1).bit_length())
+        self.sketch = np.zeros((depth, self.width), dtype=np.uint8)
+        self.sample_size = 10 * capacity
+        self.samples = 0
+        self.keys = {} # slot -> exact key
+
+    def insert(self, slot, key=None, cost=1.0, size=1):
+        super().insert(slot, key, cost, size)
+        if key is not None:
+            self.keys[slot] = key
+
+    def remove(self, slot):
+        super().remove(slot)
+        self.keys.pop(slot, None)
+
+    def record(self, key):
+        rows = np.arange(len(self.sketch))
+        columns = self.columns(key)
+        counts = self.sketch[rows, columns]
+        self.sketch[rows, columns] = np.minimum(counts + 1, 255)
+        self.samples += 1
+        if self.samples >= self.sample_size:
+            self.sketch >>= 1
+            self.samples //= 2
+
+    def frequency(self, key):
+        return int(self.sketch[np.arange(len(self.sketch)), self.columns(key)].min())
+
+    def admit(self, key):
+        if key is None or not self.ordering:
+            return True
+        victim_key = self.keys.get(self.victim())
+        if victim_key is None:
+            return True
+        return self.frequency(key) > self.frequency(victim_key)
+
+    def columns(self, key):
+        # exact keys are already uniform hashes, so each row takes its own 4 bytes of the key
+        return [int.from_bytes(key[4 * row:4 * row + 4], 'little') % self.width for row in range(len(self.sketch))]
+
+    def clear(self):
+        super().clear()
+        self.keys.clear()
+        self.sketch[:] = 0
+        self.samples = 0
+
+class GreedyDualPolicy(EvictionPolicy):
+    """Cost-aware GreedyDual-Size-Frequency eviction.
+
+    Each entry's priority is L + cost * hits / size, where cost is what it took to
+    generate the response (its backend latency), and L is the priority of the last
+    evicted entry. The entry with the lowest priority is evicted, so responses
+    that were slow to generate and are hit often stay longest, and entries that are
+    never hit again age out as L rises.
+    """
+    def __init__(self):
+        self.heap = IndexedHeap() # slot -> [cost, size, hits]
+        self.inflation = 0.0 # L
+
+    def priority(self, entry):
+        cost, size, hits = entry
+        return self.inflation + cost * hits / max(size, 1)
+
+    def insert(self, slot, key=None, cost=1.0, size=1):
+        if slot in self.heap:
+            self.heap.remove(slot)
+        entry = [cost, size, 1]
+        self.heap.push(slot, entry, self.priority(entry))
+
+    def touch(self, slot):
+        entry = self.heap.get(slot)
+        entry[2] += 1
+        self.heap.update(slot, self.priority(entry))
+
+    def remove(self, slot):
+        if slot not in self.heap:
+            return
+        if self.heap.peek() is self.heap.get(slot):
+            self.inflation = self.heap.heap[0][0]
+        self.heap.remove(slot)
+
+    def victim(self):
+        return self.heap.heap[0][1]
+
+    def __iter__(self):
+        return iter([slot for _, slot, _ in sorted(self.heap.heap, key=lambda entry: entry[0])])
+
+    def __len__(self):
+        return len(self.heap)
+
+    def clear(self):
+        self.heap = IndexedHeap()
+        self.inflation = 0.0
+
+def make_policy(name, capacity):
+    """Builds an eviction policy by name ('lru', 'tinylfu' or 'greedydual')."""
+    if name == 'lru':
+        return LRUPolicy()
+    elif name == 'tinylfu':
+        return TinyLFUPolicy(capacity)
+    elif name == 'greedydual':
+        return GreedyDualPolicy()
+    raise ValueError(f"unknown eviction policy: {name}")
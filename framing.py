@@ -0,0 +1,140 @@
+"""Length-prefixed binary framing shared by the client, load balancer, servers and frontend.
+
+Every message on the wire is a fixed 22-byte header followed by the payload:
+
+    payload length (uint32) | message type (uint8) | flags (uint8) | request id (16 bytes)
+
+Request ids are raw 16-byte UUIDs, so several requests can be in flight on one
+connection and their responses can come back in any order. Payloads are opaque
+bytes; nothing in the payload (including '|') can corrupt the framing.
+"""
+import struct
+import uuid
+from enum import IntEnum
+from typing import NamedTuple
+
+HEADER = struct.Struct('!IBB16s')
+HEADER_SIZE = HEADER.size
+MAX_PAYLOAD_SIZE = 16 * 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+NO_REQUEST_ID = bytes(16)
+
+# flags
+FLAG_CACHE_HIT = 0x01
+FLAG_STREAM = 0x02 # on a REQUEST: answer with CHUNK frames followed by END
+FLAG_FORWARDED = 0x04 # on a REQUEST: sent by a peer load balancer, serve it here
+FLAG_PROVISIONAL = 0x08 # on a REQUEST: a near-miss cached answer is acceptable; on a RESPONSE: this is one
+
+class MessageType(IntEnum):
+    HELLO = 1 # client handshake
+    REGISTER = 2 # server handshake, payload "<host>|<port>", plus "|warming" while its model loads and "|workers=<n>" for a pre-forked server
+    REGISTERED = 3
+    HEARTBEAT = 4
+    REQUEST = 5
+    RESPONSE = 6
+    ERROR = 7
+    CHUNK = 8 # one piece of a streamed response
+    END = 9 # marks the end of a streamed response
+    STATS = 10 # client asks for load balancer statistics; answered with a JSON payload
+    OVERLOAD = 11 # the request was shed because every backend is busy; safe to retry later
+    PING = 12 # load balancer health check on a server's registration connection
+    PONG = 13 # server's answer to a PING
+    READY = 14 # a server that registered as warming has loaded its model and takes requests from now on
+
+class FrameError(Exception):
+    """Raised when the peer sends bytes that are not a valid frame."""
+    pass
+
+class Frame(NamedTuple):
+    msg_type: MessageType
+    flags: int
+    request_id: bytes
+    payload: memoryview
+
+    def text(self):
+        """Decodes the payload as UTF-8."""
+        return str(self.payload, 'utf-8')
+
+def new_request_id():
+    return uuid.uuid4().bytes
+
+def format_request_id(request_id):
+    return str(uuid.UUID(bytes=request_id))
+
+def encode_header(msg_type, request_id, payload_size, flags=0):
+    if payload_size > MAX_PAYLOAD_SIZE:
+        raise FrameError(f"payload of {payload_size} bytes exceeds the {MAX_PAYLOAD_SIZE} byte limit")
+    return HEADER.pack(payload_size, msg_type, flags, request_id)
+
+def write_frame(writer, msg_type, request_id=NO_REQUEST_ID, payload=b'', flags=0):
+    """Writes one frame to a StreamWriter without copying the payload.
+
+    Args:
+        writer: StreamWriter object to write to.
+        msg_type (MessageType): The type of the message.
+        request_id (bytes): The 16-byte id of the request this frame belongs to.
+        payload (bytes | memoryview | str): The message body. Strings are UTF-8 encoded.
+        flags (int): Bitwise OR of the FLAG_* constants.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    writer.write(encode_header(msg_type, request_id, len(payload), flags))
+    if len(payload):
+        writer.write(payload)
+
+class FrameReader:
+    """Reads frames from a StreamReader.
+
+    Data is read in large chunks and frames are sliced out of each chunk as
+    memoryviews, so several small frames arriving in one read cost no copies. Only
+    a frame that straddles two reads is copied once to join its halves.
+    """
+    def __init__(self, reader, chunk_size=READ_CHUNK_SIZE):
+        self.reader = reader
+        self.chunk_size = chunk_size
+        self.buffer = memoryview(b'')
+
+    async def read_frame(self):
+        """Returns the next frame, or None if the peer closed the connection cleanly."""
+        while True:
+            if len(self.buffer) >= HEADER_SIZE:
+                payload_size = HEADER.unpack_from(self.buffer)[0]
+                if payload_size > MAX_PAYLOAD_SIZE:
+                    raise FrameError(f"payload of {payload_size} bytes exceeds the {MAX_PAYLOAD_SIZE} byte limit")
+                frame_size = HEADER_SIZE + payload_size
+                if len(self.buffer) < frame_size and frame_size - len(self.buffer) > self.chunk_size:
+                    # large payload: fetch the remainder in one go instead of chunk by chunk
+                    rest = await self.reader.readexactly(frame_size - len(self.buffer))
+                    self.buffer = memoryview(bytes(self.buffer) + rest)
+                if len(self.buffer) >= frame_size:
+                    return self.take(frame_size)
+
+            chunk = await self.reader.read(self.chunk_size)
+            if not chunk:
+                if len(self.buffer):
+                    raise FrameError("connection closed in the middle of a frame")
+                return None
+            if len(self.buffer):
+                self.buffer = memoryview(bytes(self.buffer) + chunk)
+            else:
+                self.buffer = memoryview(chunk)
+
+    def take(self, frame_size):
+        payload_size, msg_type, flags, request_id = HEADER.unpack_from(self.buffer)
+        try:
+            msg_type = MessageType(msg_type)
+        except ValueError:
+            raise FrameError(f"unknown message type {msg_type}")
+        payload = self.buffer[HEADER_SIZE:frame_size]
+        self.buffer = self.buffer[frame_size:]
+        return Frame(msg_type, flags, request_id, payload)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        frame = await self.read_frame()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
@@ -4,8 +4,13 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
 import asyncio
+import json
+import os
+import sys
 
-import socket
+# the framing module lives in the repository root, one level up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from framing import FrameReader, MessageType, write_frame, new_request_id, format_request_id, FLAG_STREAM
 
 app = FastAPI()
 
@@ -29,16 +34,18 @@ async def websocket_endpoint(websocket: WebSocket):
     reader, writer = await asyncio.open_connection('localhost', 1234)
 
     # Send initial handshake
-    writer.write(b"CLIENT|ADD")
+    write_frame(writer, MessageType.HELLO)
     await writer.drain()
 
     async def tcp_to_ws():
         try:
-            while True:
-                data = await reader.read(1024)
-                if not data:
-                    break
-                await websocket.send_text(data.decode())
+            async for frame in FrameReader(reader):
+                # the browser gets {"id", "type", "text"} so it can grow one bubble per request
+                await websocket.send_text(json.dumps({
+                    "id": format_request_id(frame.request_id),
+                    "type": frame.msg_type.name.lower(),
+                    "text": frame.text(),
+                }))
         except Exception:
             pass
         finally:
@@ -48,7 +55,7 @@ async def websocket_endpoint(websocket: WebSocket):
         try:
             while True:
                 data = await websocket.receive_text()
-                writer.write(data.encode())
+                write_frame(writer, MessageType.REQUEST, new_request_id(), data, FLAG_STREAM)
                 await writer.drain()
         except Exception:
             pass
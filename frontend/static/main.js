@@ -1,11 +1,24 @@
 const log = document.getElementById("log");
 const socket = new WebSocket(`ws://${location.host}/ws`);
 
+// one response bubble per request id, grown as streamed chunks arrive
+const bubbles = {};
+
 socket.onmessage = (event) => {
-  const msg = document.createElement("div");
-  msg.className = "bg-white text-blue-800 p-2 rounded-xl max-w-xs shadow self-start";
-  msg.textContent = event.data;
-  log.appendChild(msg);
+  const data = JSON.parse(event.data);
+  if (data.type === "end") {
+    delete bubbles[data.id];
+    return;
+  }
+
+  let msg = bubbles[data.id];
+  if (!msg) {
+    msg = document.createElement("div");
+    msg.className = "bg-white text-blue-800 p-2 rounded-xl max-w-xs shadow self-start";
+    log.appendChild(msg);
+    if (data.type === "chunk") bubbles[data.id] = msg;
+  }
+  msg.textContent += data.text;
   log.scrollTop = log.scrollHeight;
 };
 
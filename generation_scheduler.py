@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class GenerationScheduler:
+    """Groups queued prompts into batches and generates them off the event loop.
+
+    Requests are submitted with their request_id and wait on a future keyed by that
+    id. A single background task takes the first queued prompt, keeps collecting
+    until `max_batch_size` prompts are queued or `max_queue_delay_ms` has passed,
+    and hands the batch to `generate_batch` on a dedicated worker thread. While a
+    batch is generating, new prompts queue up to form the next one, and the event
+    loop stays free to serve heartbeats.
+
+    Streamed requests are not batched: each one runs `generate_stream` on a
+    separate pool of `max_concurrent_streams` threads, so streams neither wait for
+    batches nor for each other up to that bound, and pieces are handed back to the
+    event loop as soon as they are produced.
+
+    With `max_concurrent_batches` above 1, that many batches are generated at once
+    on as many threads, for generation functions backed by several workers such
+    as a GenerationWorkerPool.
+
+    If a MetricsRegistry is passed as `metrics`, the scheduler records batch sizes,
+    batch generation times and the queue depth in it.
+    """
+    def __init__(self, generate_batch, generate_stream=None, max_batch_size=8, max_queue_delay_ms=20, SCHEDULER_LOGS=True, metrics=None, max_concurrent_batches=1, max_concurrent_streams=4):
+        self.generate_batch = generate_batch
+        self.generate_stream = generate_stream
+        self.max_batch_size = max_batch_size
+        self.max_queue_delay = max_queue_delay_ms / 1000
+        self.queue = asyncio.Queue()
+        self.waiting = {} # request_id -> future
+        self.max_concurrent_batches = max_concurrent_batches
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="generation")
+        self.stream_executor = ThreadPoolExecutor(max_workers=max_concurrent_streams, thread_name_prefix="generation-stream")
+        self.batch_tasks = set()
+        self.SCHEDULER_LOGS = SCHEDULER_LOGS
+
+        self.batch_sizes = self.batch_seconds = None
+        if metrics is not None:
+            self.batch_sizes = metrics.histogram(
+                "generation_batch_size", "Prompts per generated batch",
+                buckets=[size for size in (1, 2, 4, 8, 16, 32, 64) if size < max_batch_size] + [max_batch_size])
+            self.batch_seconds = metrics.histogram("generation_batch_seconds", "Time to generate one batch")
+            metrics.gauge("generation_queue_depth", "Prompts waiting to be batched").set_function(self.queue.qsize)
+
+    async def submit(self, request_id, prompt):
+        """Queues a prompt for generation and returns its response.
+
+        Args:
+            request_id (str): The id used to route the response back to the caller.
+            prompt (str): The input prompt for the LLM model.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request_id] = future
+        await self.queue.put((request_id, prompt))
+        try:
+            return await future
+        finally:
+            self.waiting.pop(request_id, None)
+
+    async def submit_stream(self, request_id, prompt):
+        """Generates a response for a prompt, yielding it piece by piece.
+
+        Args:
+            request_id (str): The id of the request, used for logging.
+            prompt (str): The input prompt for the LLM model.
+        """
+        loop = asyncio.get_running_loop()
+        pieces = asyncio.Queue()
+        done = object()
+        stopped = threading.Event() # set when the caller stops listening
+
+        def produce():
+            try:
+                for piece in self.generate_stream(prompt):
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(pieces.put_nowait, piece)
+            except Exception as e:
+                loop.call_soon_threadsafe(pieces.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(pieces.put_nowait, done)
+
+        if self.SCHEDULER_LOGS:
+            logger.debug("Streaming request %s", request_id)
+        loop.run_in_executor(self.stream_executor, produce)
+        try:
+            while True:
+                piece = await pieces.get()
+                if piece is done:
+                    break
+                if isinstance(piece, Exception):
+                    raise piece
+                yield piece
+        finally:
+            stopped.set()
+
+    async def run(self):
+        """Forms and generates batches forever. Run as a background task."""
+        slots = asyncio.Semaphore(self.max_concurrent_batches)
+        while True:
+            # the next batch keeps filling until a generation slot is free
+            await slots.acquire()
+            batch = await self.next_batch()
+            task = asyncio.create_task(self.generate(batch))
+            self.batch_tasks.add(task)
+            task.add_done_callback(self.batch_tasks.discard)
+            task.add_done_callback(lambda task: slots.release())
+
+    async def generate(self, batch):
+        """Generates one batch on the worker threads and resolves its requests' futures."""
+        loop = asyncio.get_running_loop()
+        request_ids = [request_id for request_id, _ in batch]
+        prompts = [prompt for _, prompt in batch]
+        if self.SCHEDULER_LOGS:
+            logger.debug("Generating batch of %d requests", len(batch))
+
+        started = time.perf_counter()
+        try:
+            responses = await loop.run_in_executor(self.executor, self.generate_batch, prompts)
+        except Exception as e:
+            for request_id in request_ids:
+                future = self.waiting.get(request_id)
+                if future and not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            if self.batch_sizes is not None:
+                self.batch_sizes.observe(len(batch))
+                self.batch_seconds.observe(time.perf_counter() - started)
+
+        for request_id, response in zip(request_ids, responses):
+            future = self.waiting.get(request_id)
+            if future and not future.done():
+                future.set_result(response)
+
+    async def next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_queue_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.stream_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,207 @@
+"""Pre-forked generation workers that share one loaded model.
+
+A server started with SERVER_WORKERS=N spawns a loader process, which loads the
+model once and then forks N worker processes. Fork shares the loader's memory
+copy-on-write, and model weights are only ever read, so the workers share a
+single copy of them and a host gets N times the CPU throughput for roughly the
+RAM of one model. The server registers with the load balancer as one backend
+with N workers, and the GenerationWorkerPool hands each batch or stream to
+whichever worker is idle.
+
+The workers are not forked from the server itself: by the time the server has a
+model it also has an event loop, executor threads and sockets, and forking a
+process with threads can leave a child holding locks no thread will release. The
+loader is a fresh interpreter that inherits none of them. Loading a model can
+start threads too, such as torch's OpenMP pool, whose state a forked child
+inherits without the threads; `configure_loader` runs before the model loads to
+keep the loader from starting them (llm_module.configure_loader loads
+single-threaded), and each worker sizes its own pool after the fork.
+"""
+import gc
+import logging
+import multiprocessing
+import queue
+import threading
+
+from logs import configure_logging
+
+logger = logging.getLogger(__name__)
+
+class GenerationError(Exception):
+    """Raised in the server when a worker's generation call failed."""
+    pass
+
+def run_loader(load_model, generate_batch, generate_stream, configure_loader, configure_worker, worker_connections, control):
+    """Loads the model and forks a worker for each of `worker_connections`.
+
+    Reports ("ready", None) or ("error", message) over `control`, then waits for
+    the server to close it; its daemonic workers are stopped when it exits.
+    """
+    configure_logging()
+    try:
+        if configure_loader is not None:
+            configure_loader(len(worker_connections))
+        load_model()
+    except Exception as e:
+        control.send(("error", f"{type(e).__name__}: {e}"))
+        return
+
+    # objects that exist now are never collected in the workers, so the
+    # collector does not write to (and copy) the pages they share
+    gc.freeze()
+    context = multiprocessing.get_context("fork")
+    for worker_id, connection in enumerate(worker_connections):
+        inherited = [other for other in worker_connections if other is not connection] + [control]
+        process = context.Process(
+            target=run_worker,
+            args=(worker_id, connection, inherited, generate_batch, generate_stream, configure_worker, len(worker_connections)),
+            name=f"generation-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        connection.close()
+    gc.unfreeze()
+
+    control.send(("ready", None))
+    try:
+        control.recv()
+    except (EOFError, OSError):
+        pass
+
+def run_worker(worker_id, connection, inherited, generate_batch, generate_stream, configure_worker, num_workers):
+    """Serves generation jobs sent over `connection` until the server closes it."""
+    # the other workers' pipes and the loader's control pipe came with the fork;
+    # without closing them a worker would keep its siblings' pipes open
+    for other in inherited:
+        other.close()
+    if configure_worker is not None:
+        configure_worker(num_workers)
+    while True:
+        try:
+            kind, payload = connection.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            if kind == "batch":
+                connection.send(("result", generate_batch(payload)))
+            else:
+                for piece in generate_stream(payload):
+                    connection.send(("piece", piece))
+                connection.send(("end", None))
+        except Exception as e:
+            # exceptions do not always pickle; their message does
+            connection.send(("error", f"{type(e).__name__}: {e}"))
+
+class GenerationWorkerPool:
+    """Runs generation calls on N worker processes, one call per worker at a time.
+
+    `generate_batch` and `generate_stream` have the signatures of the wrapped
+    functions and block the calling thread until a worker is idle and has
+    finished, so a GenerationScheduler running N batches at once keeps every
+    worker busy. A stream the caller stops reading is still drained before its
+    worker takes another job. A worker that dies is dropped from the pool.
+
+    Creating the pool blocks until the loader has loaded the model and forked the
+    workers, and `close` must be called before the server exits. All the functions are sent to the spawned loader, so they must be
+    importable module-level functions, not lambdas. The model has to load on the
+    CPU: CUDA does not survive a fork.
+
+    Args:
+        generate_batch: Generates a list of prompts in the loaded model.
+        generate_stream: Yields the pieces of one prompt's response.
+        num_workers (int): Processes to fork.
+        load_model: Loads the model in the loader process, before the fork.
+        configure_worker: Called in each worker with `num_workers` right after the
+            fork, e.g. to give it its share of the CPU threads.
+        configure_loader: Called in the loader with `num_workers` before the model
+            loads, e.g. to keep loading from starting threads the fork would lose.
+
+    Raises:
+        GenerationError: If the loader could not load the model.
+    """
+    def __init__(self, generate_batch, generate_stream, num_workers, load_model, configure_worker=None, configure_loader=None):
+        self.num_workers = num_workers
+        self.idle = queue.Queue() # connections of workers waiting for a job
+        self.alive = num_workers
+        self.lock = threading.Lock()
+
+        context = multiprocessing.get_context("spawn")
+        connections, worker_connections = zip(*(context.Pipe() for _ in range(num_workers)))
+        self.control, loader_control = context.Pipe()
+        self.loader = context.Process(
+            target=run_loader,
+            args=(load_model, generate_batch, generate_stream, configure_loader, configure_worker, list(worker_connections), loader_control),
+            name="generation-loader", # not a daemon: daemonic processes may not fork
+        )
+        self.loader.start()
+        for connection in worker_connections:
+            connection.close()
+        loader_control.close()
+
+        try:
+            kind, value = self.control.recv()
+        except (EOFError, OSError):
+            kind, value = "error", f"the loader exited with code {self.loader.exitcode}"
+        if kind == "error":
+            self.close()
+            raise GenerationError(f"generation workers failed to start: {value}")
+        for connection in connections:
+            self.idle.put(connection)
+        logger.info("Started %d generation workers", num_workers)
+
+    def acquire(self):
+        while True:
+            if self.alive == 0:
+                raise GenerationError("no generation workers left")
+            try:
+                return self.idle.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    def release(self, connection, finished=True):
+        """Returns a worker to the pool, once it has finished its current job."""
+        try:
+            while not finished:
+                kind, _ = connection.recv()
+                finished = kind != "piece"
+            self.idle.put(connection)
+        except (EOFError, OSError):
+            with self.lock:
+                self.alive -= 1
+            logger.error("A generation worker died; %d of %d left", self.alive, self.num_workers)
+
+    def generate_batch(self, prompts):
+        connection = self.acquire()
+        finished = False
+        try:
+            connection.send(("batch", prompts))
+            kind, value = connection.recv()
+            finished = True
+        finally:
+            self.release(connection, finished)
+        if kind == "error":
+            raise GenerationError(value)
+        return value
+
+    def generate_stream(self, prompt):
+        connection = self.acquire()
+        finished = False
+        try:
+            connection.send(("stream", prompt))
+            while not finished:
+                kind, value = connection.recv()
+                if kind == "piece":
+                    yield value
+                    continue
+                finished = True
+                if kind == "error":
+                    raise GenerationError(value)
+        finally:
+            self.release(connection, finished)
+
+    def close(self):
+        """Stops the workers: the loader exits once its control pipe closes, taking them with it."""
+        self.control.close()
+        self.loader.join(timeout=5)
+        if self.loader.is_alive():
+            self.loader.terminate()
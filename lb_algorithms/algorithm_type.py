@@ -1,19 +1,63 @@
 from enum import Enum
 
+from .ewma import EWMA
+from .circuit_breaker import CircuitBreaker
+
 class AlgorithmType(Enum):
     ROUND_ROBIN = 1
     LEAST_CONNECTIONS = 2
+    LEAST_OUTSTANDING_TOKENS = 3
+    POWER_OF_TWO_CHOICES = 4
+    PEAK_EWMA = 5
+    CONSISTENT_HASH = 6
 
 class BackendServer:
-    def __init__(self, host, port):
+    def __init__(self, host, port, capacity=1):
         self.host = host
         self.port = port
-        self.connection_count = 0
+        self.capacity = capacity # generation workers behind the server; its limits and load scale by this
+        self.connection_count = 0 # requests in flight
+        self.outstanding_tokens = 0 # estimated tokens still to be served for those requests
+
+        # the same counts summed over the other workers of a multi-process load balancer
+        self.remote_connections = 0
+        self.remote_tokens = 0
+
+        # observed response times in seconds
+        self.ttfb = EWMA() # time to first byte
+        self.latency = EWMA() # time to the complete response
+        self.peak_latency = EWMA(peak=True)
+
+        # ejects the server on failures and readmits it with a slow start
+        self.breaker = CircuitBreaker()
+
+    def observe_latency(self, ttfb=None, latency=None):
+        """Records the time to first byte and/or completion latency of a request."""
+        if ttfb is not None:
+            self.ttfb.observe(ttfb)
+        if latency is not None:
+            self.latency.observe(latency)
+            self.peak_latency.observe(latency)
         
+    @property
+    def total_connections(self):
+        """Requests in flight on this server across all load balancer workers."""
+        return self.connection_count + self.remote_connections
+
+    @property
+    def total_tokens(self):
+        """Outstanding tokens on this server across all load balancer workers."""
+        return self.outstanding_tokens + self.remote_tokens
+
+    @property
+    def utilization(self):
+        """Requests in flight per generation worker."""
+        return self.total_connections / self.capacity
+
     def __lt__(self, other):
         if not isinstance(other, BackendServer):
             return NotImplemented
-        return self.connection_count < other.connection_count
+        return self.total_connections < other.total_connections
     
 
 
@@ -0,0 +1,83 @@
+import time
+
+class CircuitBreaker:
+    """Ejects a failing backend and readmits it gradually once it recovers.
+
+    While closed the backend gets its full share of traffic. `trip` opens the
+    breaker: the backend gets no new requests for at least `open_seconds`, doubled
+    on every consecutive trip up to `max_open_seconds`. Once it has answered a
+    health check after that, `recover` starts a slow start in which its share ramps
+    linearly from `min_share` to 1 over `slow_start_seconds`, so a backend that just
+    came back is not flooded with a full queue's worth of requests. `share` only
+    reads the state; `tick` ends a slow start that has run its course, which also
+    resets the trip count.
+    """
+    def __init__(self, open_seconds=1.0, max_open_seconds=30.0, slow_start_seconds=10.0, min_share=0.1):
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.slow_start_seconds = slow_start_seconds
+        self.min_share = min_share
+        self.open_until = None # monotonic time the breaker may close again, None while closed
+        self.slow_start_since = None # monotonic time the slow start began, None at full share
+        self.trips = 0 # consecutive trips without a completed slow start
+
+    @property
+    def is_open(self):
+        return self.open_until is not None
+
+    def trip(self, now=None):
+        """Opens the breaker.
+
+        Returns:
+            True if it was closed before.
+        """
+        if self.is_open:
+            return False
+        now = time.monotonic() if now is None else now
+        self.open_until = now + min(self.max_open_seconds, self.open_seconds * 2 ** self.trips)
+        self.slow_start_since = None
+        self.trips += 1
+        return True
+
+    def recover(self, now=None):
+        """Closes an open breaker whose open period has passed and begins the slow start.
+
+        Returns:
+            True if the breaker closed.
+        """
+        now = time.monotonic() if now is None else now
+        if not self.is_open or now < self.open_until:
+            return False
+        self.open_until = None
+        self.start_slow_start(now)
+        return True
+
+    def start_slow_start(self, now=None):
+        self.slow_start_since = time.monotonic() if now is None else now
+
+    def tick(self, now=None):
+        """Ends the slow start once it is over.
+
+        Returns:
+            True if a slow start ended.
+        """
+        if self.is_open or self.slow_start_since is None:
+            return False
+        now = time.monotonic() if now is None else now
+        if now - self.slow_start_since < self.slow_start_seconds:
+            return False
+        self.slow_start_since = None
+        self.trips = 0
+        return True
+
+    def share(self, now=None):
+        """Returns the fraction of its normal request limit the backend may take now."""
+        if self.is_open:
+            return 0.0
+        if self.slow_start_since is None:
+            return 1.0
+        now = time.monotonic() if now is None else now
+        progress = (now - self.slow_start_since) / self.slow_start_seconds
+        if progress >= 1:
+            return 1.0
+        return self.min_share + (1 - self.min_share) * progress
@@ -0,0 +1,166 @@
+import bisect
+import hashlib
+import logging
+import math
+
+from .lb_algorithm import LBAlgorithm
+from .algorithm_type import BackendServer
+
+logger = logging.getLogger(__name__)
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes.
+
+    Every node is placed on the ring at `vnodes` pseudo-random points and a key
+    belongs to the first node clockwise from the key's own hash. Adding or removing
+    one of n nodes only moves the keys between its points and their neighbours,
+    about 1/n of the keyspace, and the virtual nodes keep each node's share even.
+    """
+    def __init__(self, vnodes=100):
+        self.vnodes = vnodes
+        self.points = [] # sorted hashes of every virtual node
+        self.owners = [] # node at each point
+        self.nodes = set()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    @staticmethod
+    def hash(key):
+        if not isinstance(key, bytes):
+            key = str(key).encode()
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big')
+
+    def add(self, node, weight=1):
+        """Places a node on the ring with `weight` times the usual number of virtual nodes."""
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.vnodes * weight):
+            point = self.hash(f"{node}#{i}")
+            position = bisect.bisect(self.points, point)
+            self.points.insert(position, point)
+            self.owners.insert(position, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        keep = [i for i, owner in enumerate(self.owners) if owner != node]
+        self.points = [self.points[i] for i in keep]
+        self.owners = [self.owners[i] for i in keep]
+
+    def lookup(self, key):
+        """Returns the node that owns `key`, or None if the ring is empty."""
+        if not self.points:
+            return None
+        position = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+        return self.owners[position]
+
+    def walk(self, key):
+        """Yields every node once, in ring order starting from the owner of `key`."""
+        if not self.points:
+            return
+        start = bisect.bisect(self.points, self.hash(key))
+        seen = set()
+        for offset in range(len(self.points)):
+            node = self.owners[(start + offset) % len(self.points)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+class ConsistentHash(LBAlgorithm):
+    """Routes requests with the same key to the same server, with bounded load.
+
+    Servers are placed on a HashRing and a request goes to the owner of its key
+    (such as a hash of the prompt's prefix), so repeated and related prompts reuse
+    that server's warm state, such as its prefix cache. To keep a popular key from
+    overloading its owner, no server may take more than `load_factor` times the
+    average number of requests in flight (per generation worker, with servers
+    placed on the ring in proportion to their workers); a request whose owner is
+    at that bound moves on to the next server clockwise. Requests without a key go to the least
+    busy server.
+
+    The totals behind the average are kept up to date as requests are charged and
+    released, so finding the owner does not sum over every server.
+    """
+    def __init__(self, vnodes=100, load_factor=1.25):
+        super().__init__()
+        self.ring = HashRing(vnodes)
+        self.load_factor = load_factor
+        self.index = {} # (host, port) -> BackendServer
+        self.in_flight = 0 # total_connections summed over the servers on the ring
+        self.workers = 0 # capacity summed over the servers on the ring
+
+    def make_server_holder(self):
+        return []
+
+    def remove_server(self, host, port):
+        server = self.index.pop((host, port), None)
+        if server is None:
+            logger.warning("Server %s:%s not found in load balancer", host, port)
+            return
+        self.servers.remove(server)
+        self.ring.remove((host, port))
+        self.in_flight -= server.total_connections
+        self.workers -= server.capacity
+        logger.info("Server %s:%s removed from load balancer", host, port)
+
+    def get_server(self, cost=1, key=None):
+        if not self.servers:
+            raise IndexError("no servers to choose from")
+        if key is None:
+            server = min(self.servers, key=lambda candidate: candidate.total_connections)
+        else:
+            server = self.owner(key)
+        self.acquire(server, cost)
+        logger.debug("Server %s:%s selected for request", server.host, server.port)
+        return server
+
+    def owner(self, key):
+        """Returns the first server clockwise from `key` that is under the load bound."""
+        bound = self.load_factor * (self.in_flight + 1) / self.workers
+        first = None
+        for node in self.ring.walk(key):
+            server = self.index[node]
+            if first is None:
+                first = server
+            if server.total_connections < math.ceil(bound * server.capacity) and self.has_capacity(server):
+                return server
+        return first
+
+    def is_member(self, server):
+        # the server may have been removed, or removed and re-registered, since it was selected
+        return self.index.get((server.host, server.port)) is server
+
+    def acquire(self, server, cost=1):
+        super().acquire(server, cost)
+        if self.is_member(server):
+            self.in_flight += 1
+
+    def release(self, server, cost=1):
+        super().release(server, cost)
+        if self.is_member(server):
+            self.in_flight -= 1
+
+    def observe_remote_load(self, server, connections, tokens):
+        if self.is_member(server):
+            self.in_flight += connections - server.remote_connections
+        super().observe_remote_load(server, connections, tokens)
+
+    def add_server(self, host, port, capacity=1):
+        if (host, port) in self.index:
+            logger.warning("Server %s:%s is already in load balancer", host, port)
+            return self.index[(host, port)]
+        backend_server = BackendServer(host, port, capacity)
+        self.index[(host, port)] = backend_server
+        self.servers.append(backend_server)
+        self.ring.add((host, port), capacity)
+        self.workers += capacity
+        logger.info("Added server on port %s", port)
+        return backend_server
@@ -0,0 +1,34 @@
+import math
+import time
+
+class EWMA:
+    """Time-decayed exponentially weighted moving average of observed latencies.
+
+    Each sample is weighted by how long it has been since the previous one, so the
+    average tracks the last `decay_time` seconds regardless of request rate. With
+    peak=True the average jumps straight up to any sample above it and only decays
+    back down gradually, which reacts to a slowdown immediately.
+    """
+    def __init__(self, decay_time=10.0, peak=False):
+        self.decay_time = decay_time
+        self.peak = peak
+        self.value = None
+        self.last_update = None
+
+    def observe(self, sample, now=None):
+        """
+        Folds a new latency sample (in seconds) into the average.
+        """
+        now = time.monotonic() if now is None else now
+        if self.value is None or (self.peak and sample > self.value):
+            self.value = sample
+        else:
+            weight = math.exp(-(now - self.last_update) / self.decay_time)
+            self.value = self.value * weight + sample * (1 - weight)
+        self.last_update = now
+
+    def get(self, default=None):
+        """
+        Returns the current average, or `default` if nothing has been observed yet.
+        """
+        return default if self.value is None else self.value
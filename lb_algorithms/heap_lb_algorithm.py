@@ -0,0 +1,71 @@
+import logging
+from abc import abstractmethod
+
+from .lb_algorithm import LBAlgorithm
+from .algorithm_type import BackendServer
+from .indexed_heap import IndexedHeap
+
+logger = logging.getLogger(__name__)
+
+class HeapLBAlgorithm(LBAlgorithm):
+    """Routes each request to the server at the front of an indexed heap, ordered by `priority`.
+
+    Servers sit in an indexed priority queue keyed by (host, port), so selecting a
+    server, releasing a finished request and removing a server are all O(log n).
+    Subclasses define `priority`, whose first element must be whether the server
+    lacks room, so servers that are ejected or at their limit sort after all the
+    others and the front of the queue is a server with room whenever there is one.
+    """
+    def make_server_holder(self):
+        return IndexedHeap()
+
+    @abstractmethod
+    def priority(self, server):
+        """
+        Returns the server's place in the heap, lowest first.
+
+        Returns:
+            A tuple starting with `not self.has_capacity(server)`.
+        """
+        pass
+
+    def remove_server(self, host, port):
+        if (host, port) in self.servers:
+            self.servers.remove((host, port))
+            logger.info("Server %s:%s removed from load balancer", host, port)
+        else:
+            logger.warning("Server %s:%s not found in load balancer", host, port)
+
+    def get_server(self, cost=1, key=None):
+        server = self.servers.peek()
+        self.acquire(server, cost)
+        self.servers.update((server.host, server.port), self.priority(server))
+        logger.debug("Server %s:%s selected for request", server.host, server.port)
+        return server
+
+    def refresh(self, server):
+        key = (server.host, server.port)
+        # the server may have been removed, or removed and re-registered, since it was selected
+        if key in self.servers and self.servers.get(key) is server:
+            self.servers.update(key, self.priority(server))
+
+    def add_server(self, host, port, capacity=1):
+        if (host, port) in self.servers:
+            logger.warning("Server %s:%s is already in load balancer", host, port)
+            return self.servers.get((host, port))
+        backend_server = BackendServer(host, port, capacity)
+        self.servers.push((host, port), backend_server, self.priority(backend_server))
+        logger.info("Added server on port %s", port)
+        return backend_server
+
+    def least_busy_available(self):
+        # the front only lacks room if it filled up or was ejected since it was last sorted
+        while self.servers:
+            server = self.servers.peek()
+            if self.has_capacity(server):
+                return server
+            key = (server.host, server.port)
+            if self.servers.get_priority(key)[0]:
+                return None # every server is already sorted as full
+            self.servers.update(key, self.priority(server))
+        return None
@@ -0,0 +1,86 @@
+class IndexedHeap:
+    """Binary min-heap whose items can be looked up, re-prioritized and removed by key.
+
+    Each item's position is tracked in a dict, so changing an item's priority or
+    removing it is O(log n) instead of a linear search plus a full heapify.
+    """
+    def __init__(self):
+        self.heap = [] # list of [priority, key, item]
+        self.position = {} # key -> index in self.heap
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.position
+
+    def __iter__(self):
+        return (entry[2] for entry in self.heap)
+
+    def push(self, key, item, priority):
+        if key in self.position:
+            raise KeyError(f"{key} is already in the heap")
+        self.heap.append([priority, key, item])
+        self.position[key] = len(self.heap) - 1
+        self._sift_up(len(self.heap) - 1)
+
+    def peek(self):
+        """Returns the item with the lowest priority without removing it."""
+        if not self.heap:
+            raise IndexError("peek from an empty heap")
+        return self.heap[0][2]
+
+    def get(self, key):
+        return self.heap[self.position[key]][2]
+
+    def get_priority(self, key):
+        return self.heap[self.position[key]][0]
+
+    def update(self, key, priority):
+        """Changes the priority of an item, moving it up or down as needed."""
+        index = self.position[key]
+        old_priority = self.heap[index][0]
+        self.heap[index][0] = priority
+        if priority < old_priority:
+            self._sift_up(index)
+        else:
+            self._sift_down(index)
+
+    def remove(self, key):
+        """Removes and returns the item stored under the given key."""
+        index = self.position.pop(key)
+        last = self.heap.pop()
+        if index == len(self.heap):
+            return last[2]
+        removed = self.heap[index]
+        self.heap[index] = last
+        self.position[last[1]] = index
+        self._sift_up(index)
+        self._sift_down(self.position[last[1]])
+        return removed[2]
+
+    def _swap(self, i, j):
+        self.heap[i], self.heap[j] = self.heap[j], self.heap[i]
+        self.position[self.heap[i][1]] = i
+        self.position[self.heap[j][1]] = j
+
+    def _sift_up(self, index):
+        while index > 0:
+            parent = (index - 1) // 2
+            if self.heap[index][0] < self.heap[parent][0]:
+                self._swap(index, parent)
+                index = parent
+            else:
+                break
+
+    def _sift_down(self, index):
+        size = len(self.heap)
+        while True:
+            smallest = index
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < size and self.heap[child][0] < self.heap[smallest][0]:
+                    smallest = child
+            if smallest == index:
+                break
+            self._swap(index, smallest)
+            index = smallest
@@ -1,9 +1,11 @@
+import math
 from abc import ABC, abstractmethod
 
 class LBAlgorithm(ABC):
     def __init__(self):
         self.servers = self.make_server_holder()
-        
+        self.max_in_flight = None # per-server limit on requests in flight, None for no limit
+
     @abstractmethod
     def make_server_holder(self):
         """
@@ -13,7 +15,7 @@ class LBAlgorithm(ABC):
             A data structure to hold the servers.
         """
         pass
-    
+
     @abstractmethod
     def remove_server(self, host, port):
         """
@@ -25,25 +27,143 @@ class LBAlgorithm(ABC):
             port: The port of the server to be removed.
         """
         pass
-        
+
     @abstractmethod
-    def get_server(self):
+    def get_server(self, cost=1, key=None):
         """
-        Removes a server from the load balancer.
+        Selects the server that should handle the next request and charges the request to it.
 
         Args:
-            index: The index of the server to be removed.
-            host: The host of the server to be removed.
-            port: The port of the server to be removed.
+            cost: The estimated number of tokens the request will take to serve.
+            key: The request's routing key, used by algorithms with key affinity.
+
+        Returns:
+            The selected BackendServer.
         """
         pass
-    
+
     @abstractmethod
-    def add_server(self, host, port):
+    def add_server(self, host, port, capacity=1):
         """
         Adds a new server to the load balancer.
 
         Args:
             port: The port number on which the new server will run.
+            capacity: How many generation workers the server runs; it gets that
+                many times the load of a single-worker server.
+
+        Returns:
+            The server's BackendServer, or the existing one if it was already added.
+        """
+        pass
+
+    def get_available_server(self, cost=1, key=None):
+        """
+        Selects a server like get_server, but never one already at its limit.
+
+        If the algorithm's choice is full or ejected, the request goes to the least
+        busy server that still has room instead.
+
+        Args:
+            cost: The estimated number of tokens the request will take to serve.
+            key: The request's routing key, used by algorithms with key affinity.
+
+        Returns:
+            The selected BackendServer, or None if every server is full.
+        """
+        server = self.get_server(cost, key)
+        limit = self.server_limit(server)
+        if limit is None or server.total_connections <= limit:
+            return server
+        self.release(server, cost)
+        server = self.least_busy_available()
+        if server is not None:
+            self.acquire(server, cost)
+            self.refresh(server)
+        return server
+
+    def least_busy_available(self):
+        """
+        Returns the server with the fewest requests in flight per generation worker
+        that still has room, or None if every server is full.
+        """
+        return min((candidate for candidate in self.servers if self.has_capacity(candidate)),
+                   key=lambda candidate: candidate.utilization, default=None)
+
+    def server_limit(self, server):
+        """
+        Returns how many requests the server may have in flight, or None for no limit.
+
+        The limit is max_in_flight per generation worker, scaled by the share its
+        circuit breaker allows, so an ejected server gets 0 and a recovering one
+        ramps back up.
         """
-        pass
\ No newline at end of file
+        share = server.breaker.share()
+        if share <= 0:
+            return 0
+        if self.max_in_flight is None:
+            return None
+        return max(1, math.ceil(self.max_in_flight * server.capacity * share))
+
+    def has_capacity(self, server):
+        """
+        Returns whether the server can take another request under its limit.
+        """
+        limit = self.server_limit(server)
+        return limit is None or server.total_connections < limit
+
+    def free_slots(self):
+        """
+        Returns how many more requests the servers can take before all are at their limits.
+        """
+        slots = 0
+        for server in self.servers:
+            limit = self.server_limit(server)
+            slots += 1 if limit is None else max(0, limit - server.total_connections)
+        return slots
+
+    def acquire(self, server, cost=1):
+        """
+        Charges a newly routed request to the given server.
+
+        Args:
+            server: The BackendServer the request was routed to.
+            cost: The estimated number of tokens the request will take to serve.
+        """
+        server.connection_count += 1
+        server.outstanding_tokens += cost
+
+    def release(self, server, cost=1):
+        """
+        Marks a request on the given server as finished.
+
+        Args:
+            server: The BackendServer that handled the request.
+            cost: The cost the request was charged with in get_server.
+        """
+        server.connection_count -= 1
+        server.outstanding_tokens -= cost
+        self.refresh(server)
+
+    def observe_remote_load(self, server, connections, tokens):
+        """
+        Records the load that the other workers of a multi-process load balancer put on a server.
+
+        Args:
+            server: The BackendServer to update.
+            connections: Requests the other workers have in flight on it.
+            tokens: Outstanding tokens the other workers have on it.
+        """
+        if server.remote_connections != connections or server.remote_tokens != tokens:
+            server.remote_connections = connections
+            server.remote_tokens = tokens
+            self.refresh(server)
+
+    def refresh(self, server):
+        """
+        Re-sorts a server after its load or circuit breaker changed outside of get_server.
+
+        Args:
+            server: The BackendServer whose counts or breaker changed.
+        """
+        pass
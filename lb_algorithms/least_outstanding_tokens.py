@@ -0,0 +1,13 @@
+from .heap_lb_algorithm import HeapLBAlgorithm
+
+class LeastOutstandingTokens(HeapLBAlgorithm):
+    """Routes each request to the server with the fewest estimated tokens still to serve.
+
+    Servers are ordered by (outstanding tokens, requests in flight), both per
+    generation worker, so charging a request's cost moves its server back in the heap.
+    """
+    def load(self, server):
+        return (server.total_tokens / server.capacity, server.utilization)
+
+    def priority(self, server):
+        return (not self.has_capacity(server),) + self.load(server)
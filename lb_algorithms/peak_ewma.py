@@ -0,0 +1,17 @@
+from .power_of_two_choices import PowerOfTwoChoices
+
+class PeakEWMA(PowerOfTwoChoices):
+    """Routes by peak-EWMA completion latency multiplied by requests in flight.
+
+    Two servers are sampled at random, as in PowerOfTwoChoices, and the one with
+    the lower expected wait wins. A server on slower hardware, or one that starts
+    throttling, sees its latency estimate jump and automatically gets less traffic.
+    Servers with no observed latency yet are assumed to take `default_latency`.
+    """
+    def __init__(self, default_latency=1.0):
+        super().__init__()
+        self.default_latency = default_latency
+
+    def load(self, server):
+        latency = server.peak_latency.get(self.default_latency)
+        return latency * (server.utilization + 1)
@@ -0,0 +1,56 @@
+import logging
+import random
+
+from .lb_algorithm import LBAlgorithm
+from .algorithm_type import BackendServer
+
+logger = logging.getLogger(__name__)
+
+class PowerOfTwoChoices(LBAlgorithm):
+    """Samples two servers at random and routes to the less loaded one.
+
+    Load is measured in estimated outstanding tokens per generation worker, with
+    requests in flight per worker as the tie-breaker. Servers are kept in a list plus a (host, port) -> index map, so
+    selection, add and remove are all O(1).
+    """
+    def __init__(self):
+        super().__init__()
+        self.index = {} # (host, port) -> position in self.servers
+
+    def make_server_holder(self):
+        return []
+
+    def remove_server(self, host, port):
+        position = self.index.pop((host, port), None)
+        if position is None:
+            logger.warning("Server %s:%s not found in load balancer", host, port)
+            return
+        # swap the last server into the hole so removal stays O(1)
+        last = self.servers.pop()
+        if position < len(self.servers):
+            self.servers[position] = last
+            self.index[(last.host, last.port)] = position
+        logger.info("Server %s:%s removed from load balancer", host, port)
+
+    def get_server(self, cost=1, key=None):
+        if len(self.servers) == 1:
+            server = self.servers[0]
+        else:
+            first, second = random.sample(self.servers, 2)
+            server = first if self.load(first) <= self.load(second) else second
+        self.acquire(server, cost)
+        logger.debug("Server %s:%s selected for request", server.host, server.port)
+        return server
+
+    def add_server(self, host, port, capacity=1):
+        if (host, port) in self.index:
+            logger.warning("Server %s:%s is already in load balancer", host, port)
+            return self.servers[self.index[(host, port)]]
+        backend_server = BackendServer(host, port, capacity)
+        self.index[(host, port)] = len(self.servers)
+        self.servers.append(backend_server)
+        logger.info("Added server on port %s", port)
+        return backend_server
+
+    def load(self, server):
+        return (server.total_tokens / server.capacity, server.utilization)
@@ -1,30 +1,50 @@
+import logging
 from collections import deque
 
 from .lb_algorithm import LBAlgorithm  
 from .algorithm_type import BackendServer
 
+logger = logging.getLogger(__name__)
+
 class RoundRobin(LBAlgorithm):
-    
+    """Routes requests to the servers in turn, giving each as many consecutive
+    requests as it has generation workers.
+    """
+    def __init__(self):
+        super().__init__()
+        self.turns = 0 # requests the server at the front has taken in its current turn
+        self.index = {} # (host, port) -> BackendServer
+
     def make_server_holder(self):
         return deque()
     
     def remove_server(self, host, port):
-        for server in self.servers:
-            if server.host == host and server.port == port:
-                self.servers.remove(server)
-                print(f"Server {host}:{port} removed from load balancer")
-                break
-        print(f"Server {host}:{port} not found in load balancer")
+        server = self.index.pop((host, port), None)
+        if server is None:
+            logger.warning("Server %s:%s not found in load balancer", host, port)
+            return
+        self.servers.remove(server)
+        self.turns = 0
+        logger.info("Server %s:%s removed from load balancer", host, port)
         
-    def get_server(self):
-        server = self.servers.popleft()
+    def get_server(self, cost=1, key=None):
+        server = self.servers[0]
         server_port = server.port
         server_host = server.host
-        self.servers.append(server)
-        print(f"Server {server_host}:{server_port} selected for request")
+        self.turns += 1
+        if self.turns >= server.capacity:
+            self.servers.rotate(-1)
+            self.turns = 0
+        self.acquire(server, cost)
+        logger.debug("Server %s:%s selected for request", server_host, server_port)
         return server
     
-    def add_server(self, host, port):
-        backend_server = BackendServer(host, port)
+    def add_server(self, host, port, capacity=1):
+        if (host, port) in self.index:
+            logger.warning("Server %s:%s is already in load balancer", host, port)
+            return self.index[(host, port)]
+        backend_server = BackendServer(host, port, capacity)
+        self.index[(host, port)] = backend_server
         self.servers.append(backend_server)
-        print(f"Added server on port {port}")
\ No newline at end of file
+        logger.info("Added server on port %s", port)
+        return backend_server
\ No newline at end of file
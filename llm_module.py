@@ -1,26 +1,178 @@
+import logging
 import os 
+import queue
+import threading
+from threading import Thread
 from huggingface_hub import login
-from transformers import pipeline
+from transformers import pipeline, TextIteratorStreamer, DynamicCache, StoppingCriteria, StoppingCriteriaList
 import torch
 
+from embedders import select_device
+from prefix_cache import PrefixCache
+
+logger = logging.getLogger(__name__)
+
 MAX_RESPONSE = 50
+# seconds a streamed response waits for its next piece before giving up on the generation
+STREAM_TIMEOUT = float(os.environ.get('LLM_STREAM_TIMEOUT', 60))
+
+# past key values of recently seen prompt prefixes, reused so a shared prefix
+# (a system prompt, "Once upon a time,") is only prefilled once
+PREFIX_CACHE_BYTES = int(os.environ.get('LLM_PREFIX_CACHE_BYTES', 256 * 1024 * 1024))
+PREFIX_BLOCK_TOKENS = 16
+
+# a hub id, or a local directory such as a small GPT-2 config for running offline
+model_ID = os.environ.get('LLM_MODEL', 'gpt2')
+# 'cuda', 'mps' or 'cpu'; picked from what is available when unset
+device = os.environ.get('LLM_DEVICE')
+
+# the model is loaded by the first call to load_model, not on import
+generator = None
+load_lock = threading.Lock()
+
+prefix_cache = PrefixCache(PREFIX_CACHE_BYTES, PREFIX_BLOCK_TOKENS)
+
+def load_model():
+    """Loads the LLM model, once; concurrent callers wait for the first to finish.
+
+    Servers call this on a worker thread while they register with the load
+    balancer, and the generation functions call it in case nobody has.
+    """
+    global generator, device
+    if generator is not None:
+        return
+    with load_lock:
+        if generator is not None:
+            return
+        if os.environ.get('HF_TOKEN'):
+            logger.info("Logging into HuggingFace Hub...")
+            #login(token='your_token') # Replace 'your_token' with your actual token
+            login(token=os.environ.get('HF_TOKEN'))
+
+        device = device or select_device()
+        logger.info("Loading LLM model %s on %s...", model_ID, device)
+        pipe = pipeline(
+            'text-generation',
+            model=model_ID,
+            device=device,
+            torch_dtype=torch.bfloat16 if device == 'cuda' else torch.float32
+        )
+        # batched generation pads prompts on the left so every sequence ends at the same position
+        pipe.tokenizer.pad_token = pipe.tokenizer.eos_token
+        pipe.tokenizer.padding_side = 'left'
+        generator = pipe
+        logger.info("Model loaded successfully.")
+
+def configure_loader(num_workers):
+    """Prepares torch's threading in the loader process, before it loads the model and forks.
+
+    Loading runs single-threaded, so torch starts no OpenMP threads: a worker forked
+    from a process whose OpenMP threads have run hangs on its first parallel op. The
+    inter-op pool can only be sized before it is first used, so it is sized here for
+    one worker's share of the cores, and the workers inherit the setting.
+
+    Args:
+        num_workers (int): How many workers share the model and the cores.
+    """
+    torch.set_num_threads(1)
+    torch.set_num_interop_threads(max(1, (os.cpu_count() or 1) // num_workers))
+
+def configure_worker(num_workers):
+    """Gives a pre-forked generation worker its share of the CPU cores.
+
+    Args:
+        num_workers (int): How many workers share the model and the cores.
+    """
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // num_workers))
+
+def cache_layers(cache):
+    """Returns past key values as a tuple of (key, value) tensors per layer."""
+    if hasattr(cache, 'layers'):
+        return tuple((layer.keys, layer.values) for layer in cache.layers)
+    if hasattr(cache, 'to_legacy_cache'):
+        return cache.to_legacy_cache()
+    return cache
+
+def resume_cache(value, length, rows):
+    """Builds a DynamicCache holding the first `length` positions of a cached prefix, once per row."""
+    cache = DynamicCache()
+    for layer_idx, (key, val) in enumerate(value):
+        cache.update(key[:, :, :length].repeat(rows, 1, 1, 1), val[:, :, :length].repeat(rows, 1, 1, 1), layer_idx)
+    return cache
 
-print("Logging into HuggingFace Hub...")
-#login(token='your_token') # Replace 'your_token' with your actual token
-login(token=os.environ.get('HF_TOKEN'))
+class StopOnEvent(StoppingCriteria):
+    """Stops a generation once `event` is set, e.g. when nobody reads its stream anymore."""
+    def __init__(self, event):
+        self.event = event
 
-print("Loading LLM model...")
-model_ID= 'gpt2'
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
 
-generator = pipeline(
-    'text-generation',
-    model=model_ID,
-    device=0,  # use GPU
-    torch_dtype=torch.bfloat16
-)
+def generate(prompts: list[str], streamer=None, stop=None) -> list[str]:
+    """Generates the responses to a batch of prompts, reusing cached prompt prefixes.
 
-print("Model loaded successfully.")
-print("Clients may now connect to the server.")
+    Each prompt is looked up in the prefix cache and the prompts are generated in
+    groups that resume from the same cached prefix (or from none). Within a group
+    the rows are laid out as [cached prefix][padding][rest of the prompt], with the
+    padding masked out, so the prefix is shared and only the rest is prefilled.
+    Afterwards the block-aligned prefix of every prompt is added to the cache.
+
+    Args:
+        prompts (list[str]): The input prompts for the LLM model.
+        streamer: Optional TextIteratorStreamer; only for a single prompt.
+        stop (threading.Event): Optional event that ends the generation early once set.
+
+    Returns:
+        The generated texts, each starting with its prompt.
+    """
+    load_model()
+    tokenizer, model = generator.tokenizer, generator.model
+    prompt_ids = [tokenizer(prompt, truncation=True)['input_ids'] for prompt in prompts]
+    groups = {} # (id of the cached value, prefix length) -> (cached value, [prompt index])
+    for i, ids in enumerate(prompt_ids):
+        value, length = prefix_cache.lookup(ids)
+        groups.setdefault((id(value), length), (value, []))[1].append(i)
+
+    responses = [None] * len(prompts)
+    for (_, length), (value, indexes) in groups.items():
+        rows = [prompt_ids[i] for i in indexes]
+        longest = max(len(ids) for ids in rows)
+        pads = [longest - len(ids) for ids in rows]
+        input_ids = torch.tensor([
+            ids[:length] + [tokenizer.pad_token_id] * pad + ids[length:] for ids, pad in zip(rows, pads)
+        ], device=model.device)
+        attention_mask = torch.tensor([
+            [1] * length + [0] * pad + [1] * (len(ids) - length) for ids, pad in zip(rows, pads)
+        ], device=model.device)
+        past_key_values = resume_cache(value, length, len(rows)) if value is not None else None
+
+        output = model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            max_new_tokens=max(1, MAX_RESPONSE - longest),
+            do_sample=True,
+            pad_token_id=tokenizer.eos_token_id,
+            return_dict_in_generate=True,
+            streamer=streamer,
+            stopping_criteria=StoppingCriteriaList([StopOnEvent(stop)]) if stop is not None else None
+        )
+
+        layers = cache_layers(output.past_key_values)
+        for row, (i, ids, pad) in enumerate(zip(indexes, rows, pads)):
+            responses[i] = prompts[i] + tokenizer.decode(output.sequences[row, longest:], skip_special_tokens=True)
+            # keys and values of the prompt's own tokens, without the padding
+            cached = len(ids) // PREFIX_BLOCK_TOKENS * PREFIX_BLOCK_TOKENS
+            if cached <= length:
+                continue
+            prefix = tuple(
+                tuple(torch.cat((tensor[row:row + 1, :, :length], tensor[row:row + 1, :, length + pad:pad + cached]), dim=2)
+                      for tensor in layer)
+                for layer in layers
+            )
+            size = sum(tensor.numel() * tensor.element_size() for layer in prefix for tensor in layer)
+            prefix_cache.insert(ids[:cached], prefix, size)
+    return responses
 
 def get_llm_response(prompt: str) -> str:
     """Returns the response from the LLM model for the given prompt.
@@ -28,13 +180,57 @@ def get_llm_response(prompt: str) -> str:
     Args:
         prompt (str): The input prompt for the LLM model.
     """
-    print("Generating response...")
-    response = generator(
-        prompt,
-        max_length=MAX_RESPONSE,
-        truncation=True,
-        num_return_sequences=1,
-        do_sample=True
-    )
-    generated_text = response[0]['generated_text']
-    return generated_text
\ No newline at end of file
+    logger.debug("Generating response...")
+    return generate([prompt])[0]
+
+def get_llm_responses(prompts: list[str]) -> list[str]:
+    """Returns the responses from the LLM model for a batch of prompts.
+
+    The prompts are padded into a batch per cached prefix they resume from, and
+    each batch is run through one generate call.
+
+    Args:
+        prompts (list[str]): The input prompts for the LLM model.
+    """
+    logger.debug("Generating %d responses...", len(prompts))
+    return generate(prompts)
+
+
+def stream_llm_response(prompt: str):
+    """Yields the response from the LLM model piece by piece as tokens are generated.
+
+    Like get_llm_response, the streamed text starts with the prompt itself. The
+    generation runs on its own thread; an exception there is raised here, and
+    TimeoutError is raised if no piece arrives for STREAM_TIMEOUT seconds. If the
+    caller stops early, the generation is stopped at the next token.
+
+    Args:
+        prompt (str): The input prompt for the LLM model.
+    """
+    logger.debug("Streaming response...")
+    load_model()
+    streamer = TextIteratorStreamer(generator.tokenizer, skip_special_tokens=True, timeout=STREAM_TIMEOUT)
+    stop = threading.Event()
+
+    def run():
+        try:
+            generate([prompt], streamer=streamer, stop=stop)
+        except Exception as e:
+            # the error goes to the consumer, followed by the end of the stream
+            streamer.text_queue.put(e)
+            streamer.text_queue.put(streamer.stop_signal)
+
+    generation = Thread(target=run, daemon=True)
+    generation.start()
+    try:
+        for text in streamer:
+            if isinstance(text, Exception):
+                raise text
+            if text:
+                yield text
+    except queue.Empty:
+        raise TimeoutError(f"no tokens streamed for {STREAM_TIMEOUT} seconds") from None
+    finally:
+        # also reached when the caller closes the generator early
+        stop.set()
+        generation.join()
@@ -1,14 +1,34 @@
+import multiprocessing
+import os
+import signal
 import subprocess
 import sys
 import time
 import asyncio
-import uuid
-import heapq
+import json
+import logging
 
 from lb_algorithms.least_connections import LeastConnections  # Import from the folder
 from lb_algorithms.round_robin import RoundRobin
+from lb_algorithms.least_outstanding_tokens import LeastOutstandingTokens
+from lb_algorithms.power_of_two_choices import PowerOfTwoChoices
+from lb_algorithms.peak_ewma import PeakEWMA
+from lb_algorithms.consistent_hash import ConsistentHash, HashRing
 from lb_algorithms.algorithm_type import AlgorithmType
-from semantic_cache import SemanticCache
+from semantic_cache import SemanticCache, normalize_prompt
+from async_semantic_cache import AsyncSemanticCache
+from embedders import make_embedder
+from framing import Frame, FrameReader, MessageType, write_frame, new_request_id, format_request_id, NO_REQUEST_ID, FLAG_CACHE_HIT, FLAG_STREAM, FLAG_FORWARDED, FLAG_PROVISIONAL
+from backend_pool import BackendPool
+from pending_request import PendingRequest, PeerRequest, Waiter
+from request_coalescer import RequestCoalescer
+from threshold_tuner import ThresholdTuner
+from admission_queue import AdmissionQueue
+from shared_backends import SharedBackendTable
+from logs import configure_logging
+from metrics import MetricsRegistry, serve_metrics
+
+logger = logging.getLogger(__name__)
 
 class LoadBalancer:
     """
@@ -16,34 +36,205 @@ class LoadBalancer:
     """
     def __init__(self):
         self.LB_HOST = 'localhost'  
-        self.LB_PORT = 1234
+        self.LB_PORT = int(os.environ.get("LB_PORT", "1234"))
+
+        # admission control: each backend takes at most MAX_IN_FLIGHT_PER_BACKEND requests
+        # (a batch generating and a batch queued); past that, requests wait in a bounded
+        # queue for at most MAX_QUEUE_WAIT seconds and are shed with an OVERLOAD frame
+        # if the wait would be longer. Backend requests with no reply for
+        # REQUEST_TIMEOUT seconds are failed and reaped
+        self.MAX_IN_FLIGHT_PER_BACKEND = 16
+        self.MAX_QUEUE_SIZE = 256
+        self.MAX_QUEUE_WAIT = 10 # seconds
+        self.DEFAULT_SERVICE_TIME = 1.0 # seconds per request until a backend's latency is observed
+        self.REQUEST_TIMEOUT = 60 # seconds
+        self.admission_queue = AdmissionQueue(self.MAX_QUEUE_SIZE)
+
+        # health checking: backends are PINGed on their registration connection and
+        # ejected (their circuit breaker opens) when nothing comes back for
+        # HEALTH_CHECK_MISSES periods of HEALTH_CHECK_TIMEOUT seconds in a row or a
+        # connection to them fails; they are readmitted with a slow start once they
+        # answer again, and removed after BACKEND_REMOVE_TIMEOUT. An ejected backend
+        # keeps the requests it holds; only requests whose connection is lost are
+        # retried elsewhere, up to MAX_ATTEMPTS backends in total, as long as no part
+        # of the response has reached a client, so a slow backend's work is not duplicated
+        self.HEALTH_CHECK_INTERVAL = 0.2 # seconds
+        self.HEALTH_CHECK_TIMEOUT = 0.6 # seconds
+        self.HEALTH_CHECK_MISSES = 3
+        self.BACKEND_REMOVE_TIMEOUT = 10 # seconds
+        self.MAX_ATTEMPTS = 3
+        self.background_tasks = set()
+
+        # routing key for algorithms with key affinity (-k): 'prefix' hashes the first
+        # ROUTING_PREFIX_CHARS of the normalized prompt, so prompts sharing a prefix reuse
+        # one backend's prefix cache; 'cluster' uses the prompt's cluster in the cache
+        # index (the default clustered quantized index, or LB_CACHE_INDEX=ivf), so
+        # semantically similar prompts stay together, and falls back to the prefix
+        # before the index has clusters
+        self.ROUTING_KEY = os.environ.get("LB_ROUTING_KEY", "prefix")
+        self.ROUTING_PREFIX_CHARS = 64
 
         # Load balancing algorithm
         self.load_lb_algorithm()
         self.lock = asyncio.Lock()
 
-        self.MAX_DATA_SIZE = 1024
-        
         # managing servers
         self.active_connections = 0
+        self.backend_pools = {} # (host, port) -> BackendPool
+        self.backend_servers = {} # (host, port) -> BackendServer
+        self.last_heartbeats = {} # (host, port) -> monotonic time of the last heartbeat
+        self.warming_backends = {} # (host, port) -> capacity of backends registered but still loading their model
+        self.backend_added = asyncio.Event()
+        self.BACKEND_POOL_SIZE = 2
+        self.BACKEND_CONNECT_TIMEOUT = 2 # seconds
+
+        # metrics, served as GET /metrics on METRICS_PORT + worker_id
+        self.METRICS_PORT = int(os.environ.get("LB_METRICS_PORT", "9100"))
+        self.metrics = MetricsRegistry()
+
+        # multi-process mode: every worker accepts on LB_PORT and they share the
+        # backend registry and in-flight counts through a SharedBackendTable
+        self.worker_id = 0
+        self.shared_backends = None
+        self.shared_rows = {} # (host, port) -> row in the shared table
+        self.shared_version = -1 # table version last synced from
+        self.SHARED_SYNC_INTERVAL = 0.05
+
+        # request cost estimates for load-aware routing
+        self.CHARS_PER_TOKEN = 4
+        self.MAX_RESPONSE_TOKENS = 50
 
         # caching
-        self.semantic_cache = SemanticCache()
-        self.pending_requests = {}
+        # embeddings run on a worker thread so they never stall the event loop
+        # with a snapshot directory the cache warm-starts from disk and is saved back
+        # every SNAPSHOT_INTERVAL seconds; LBs sharing a host can map one snapshot
+        # read-only by setting LB_CACHE_SNAPSHOT_READONLY
+        self.SNAPSHOT_DIR = os.environ.get("LB_CACHE_SNAPSHOT_DIR")
+        self.SNAPSHOT_READONLY = bool(os.environ.get("LB_CACHE_SNAPSHOT_READONLY"))
+        self.SNAPSHOT_INTERVAL = 60
+        # entries are stored as int8 vectors, re-ranked at full precision, under a memory budget
+        self.CACHE_MEMORY_BUDGET = 256 * 1024 * 1024 # bytes of vectors, re-rank rows and responses
+        # eviction policy ('lru', 'tinylfu' or 'greedydual') and optional ttl in seconds;
+        # greedydual weighs entries by their measured generation latency
+        self.CACHE_EVICTION_POLICY = os.environ.get("LB_CACHE_POLICY", "lru")
+        self.CACHE_TTL = float(os.environ["LB_CACHE_TTL"]) if os.environ.get("LB_CACHE_TTL") else None
+        self.CACHE_INDEX = os.environ.get("LB_CACHE_INDEX", "quantized")
+        # quantized entries are clustered into CACHE_NLIST cells once each cell would hold
+        # 16 of them, and lookups only score the closest cells; 0 scores every entry
+        self.CACHE_NLIST = int(os.environ.get("LB_CACHE_NLIST", "256"))
+        # prompts are embedded by an encoder model ('transformer'), or with EMBEDDER=hashing by
+        # the deterministic HashingEmbedder, which needs no download, for tests and offline runs
+        self.EMBEDDER = os.environ.get("EMBEDDER", "transformer")
+        self.semantic_cache = AsyncSemanticCache(SemanticCache(
+            index=self.CACHE_INDEX,
+            index_options={"nlist": self.CACHE_NLIST} if self.CACHE_INDEX == "quantized" and self.CACHE_NLIST else None,
+            max_cache_bytes=self.CACHE_MEMORY_BUDGET,
+            snapshot_dir=self.SNAPSHOT_DIR,
+            eviction_policy=self.CACHE_EVICTION_POLICY,
+            ttl=self.CACHE_TTL,
+            embedder=make_embedder(self.EMBEDDER),
+        ), metrics=self.metrics)
+        self.pending_requests = {} # backend request id -> PendingRequest
+        self.leaders = {} # coalescer id -> PendingRequest that matching requests attach to, from arrival until answered
+        self.coalescer = RequestCoalescer(self.semantic_cache.cache.similarity_threshold)
         self.CACHING_LOGS = True
+
+        # speculative answers: a request flagged FLAG_PROVISIONAL whose best cache candidate
+        # misses the similarity threshold by at most PROVISIONAL_BAND is answered with that
+        # candidate at once, flagged provisional. The real response is still generated in the
+        # background and cached, and whether the two agreed (their embeddings are as similar
+        # as a cache hit must be) is fed to a ThresholdTuner, which lowers the cache's
+        # threshold through the similarity bands that reliably agree. A sample of the hits
+        # in those bands keeps being verified, so the threshold rises again if they stop
+        # agreeing; 0 disables
+        self.PROVISIONAL_BAND = float(os.environ.get("LB_PROVISIONAL_BAND", "0.05"))
+        self.threshold_tuner = ThresholdTuner(self.semantic_cache.cache.similarity_threshold, self.PROVISIONAL_BAND)
+
+        # cache sharding: with LB_CACHE_PEERS set to the "host:port" of every load balancer
+        # sharing the cache (this one included), the prompt prefix keys are placed on a
+        # HashRing of the peers and each prompt is cached and generated only by its owner;
+        # requests for another peer's shard are forwarded to it, so n load balancers hold
+        # n times as many distinct entries. This load balancer is LB_CACHE_SELF on the ring
+        self.CACHE_PEERS = [peer for peer in os.environ.get("LB_CACHE_PEERS", "").split(",") if peer]
+        self.CACHE_SELF = os.environ.get("LB_CACHE_SELF", f"{self.LB_HOST}:{self.LB_PORT}")
+        self.cache_ring = None
+        self.peer_pools = {} # "host:port" -> BackendPool to that peer load balancer
+        self.peer_requests = {} # peer request id -> PeerRequest
+        self.peer_down_until = {} # "host:port" -> monotonic time to try an unreachable peer again
+        self.PEER_RETRY_INTERVAL = 5
+        if self.CACHE_PEERS:
+            self.cache_ring = HashRing()
+            for peer in self.CACHE_PEERS:
+                self.cache_ring.add(peer)
+                if peer != self.CACHE_SELF:
+                    host, port = peer.rsplit(":", 1)
+                    self.peer_pools[peer] = BackendPool(host, int(port), self.peer_to_cli_forward, self.BACKEND_POOL_SIZE, MessageType.HELLO,
+                                                        self.BACKEND_CONNECT_TIMEOUT)
+        self.register_metrics()
         
+        # backends started by the load balancer itself, e.g. LB_SERVER_PORTS=1235,1236 and
+        # LB_SERVER_ARGS=--stub; they are launched together and load their models in parallel
+        self.SERVER_PORTS = [int(port) for port in os.environ.get("LB_SERVER_PORTS", "").split(",") if port]
+        self.SERVER_ARGS = os.environ.get("LB_SERVER_ARGS", "").split()
+        self.SERVER_START_TIMEOUT = 300 # seconds
         self.server_processes = [] 
 
-    def start_servers(self):
+    def register_metrics(self):
         """
-        Starts the servers on the specified ports
+        Creates the load balancer's metrics. Hot-path values are updated as requests
+        pass through; the rest are read from the load balancer's state at scrape time.
+        """
+        metrics = self.metrics
+        self.selections = metrics.counter("lb_backend_selections_total", "Requests routed to each backend", ("backend",))
+        self.requests_total = metrics.counter("lb_requests_total", "Client requests answered, by outcome", ("outcome",))
+        self.request_seconds = metrics.histogram("lb_request_seconds", "Time from receiving a client request to answering it", ("outcome",))
+        metrics.gauge("lb_backend_in_flight", "Requests this worker has in flight on each backend", ("backend",)).set_function(
+            lambda: {(f"{host}:{port}",): server.connection_count for (host, port), server in self.backend_servers.items()})
+        metrics.gauge("lb_backend_outstanding_tokens", "Estimated tokens this worker has outstanding on each backend", ("backend",)).set_function(
+            lambda: {(f"{host}:{port}",): server.outstanding_tokens for (host, port), server in self.backend_servers.items()})
+        metrics.gauge("lb_heartbeat_lag_seconds", "Seconds since each backend's last heartbeat", ("backend",)).set_function(
+            lambda: {(f"{host}:{port}",): time.monotonic() - at for (host, port), at in self.last_heartbeats.items()})
+        metrics.gauge("lb_warming_backends", "Backends registered and still loading their model").set_function(lambda: len(self.warming_backends))
+        metrics.gauge("lb_pending_requests", "Requests sent to a backend and not yet answered").set_function(lambda: len(self.pending_requests))
+        metrics.gauge("lb_active_connections", "Connected clients").set_function(lambda: self.active_connections)
+        metrics.gauge("lb_queued_requests", "Requests waiting for a free backend slot").set_function(lambda: len(self.admission_queue))
+        self.ejections = metrics.counter("lb_backend_ejections_total", "Times each backend was ejected by its circuit breaker", ("backend",))
+        self.retries = metrics.counter("lb_request_retries_total", "Backend requests retried on another backend after a failure")
+        self.verifications = metrics.counter("lb_provisional_verifications_total", "Provisional answers checked against the real response, by result", ("result",))
+        metrics.gauge("cache_similarity_threshold", "Similarity a semantic cache hit needs, as tuned by verified provisional answers").set_function(
+            lambda: self.semantic_cache.cache.similarity_threshold)
+        metrics.gauge("lb_backend_admission_share", "Share of its request limit each backend may take (0 while ejected)", ("backend",)).set_function(
+            lambda: {(f"{host}:{port}",): server.breaker.share() for (host, port), server in self.backend_servers.items()})
+
+    async def start_servers(self):
         """
-        ports = []
-        for port in ports:
-            print("Starting server on port:", port)
-            proc = subprocess.Popen([sys.executable, './server.py', str(port)])
+        Starts the servers on SERVER_PORTS at once and waits until they are ready.
+
+        The servers register as warming while their models load, and are ready once
+        they send READY, or SERVER_START_TIMEOUT passes.
+        """
+        if not self.SERVER_PORTS:
+            return
+        for port in self.SERVER_PORTS:
+            logger.info("Starting server on port: %s", port)
+            proc = subprocess.Popen([sys.executable, './server.py', str(port), *self.SERVER_ARGS],
+                                    env={**os.environ, "LB_PORT": str(self.LB_PORT)})
             self.server_processes.append(proc)
-            time.sleep(10)  # Give the servers time to start
+
+        starting = {(self.LB_HOST, port) for port in self.SERVER_PORTS}
+        deadline = time.monotonic() + self.SERVER_START_TIMEOUT
+        while not starting <= self.backend_servers.keys():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning("Servers not ready after %s seconds: %s", self.SERVER_START_TIMEOUT,
+                               sorted(port for _, port in starting - self.backend_servers.keys()))
+                return
+            self.backend_added.clear()
+            try:
+                await asyncio.wait_for(self.backend_added.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        logger.info("All %d servers ready", len(self.SERVER_PORTS))
 
     def stop_servers(self):
         """
@@ -62,122 +253,814 @@ class LoadBalancer:
             sys.exit()
         
         if sys.argv[1] == "-r":
-            print("Using Round Robin algorithm")
+            logger.info("Using Round Robin algorithm")
             self.LB_algorithm = RoundRobin()
             self.algorithm_type = AlgorithmType.ROUND_ROBIN
         elif sys.argv[1] == "-c":
-            print("Using Least Connections algorithm")
+            logger.info("Using Least Connections algorithm")
             self.LB_algorithm = LeastConnections()
             self.algorithm_type = AlgorithmType.LEAST_CONNECTIONS
+        elif sys.argv[1] == "-t":
+            logger.info("Using Least Outstanding Tokens algorithm")
+            self.LB_algorithm = LeastOutstandingTokens()
+            self.algorithm_type = AlgorithmType.LEAST_OUTSTANDING_TOKENS
+        elif sys.argv[1] == "-p":
+            logger.info("Using Power of Two Choices algorithm")
+            self.LB_algorithm = PowerOfTwoChoices()
+            self.algorithm_type = AlgorithmType.POWER_OF_TWO_CHOICES
+        elif sys.argv[1] == "-e":
+            logger.info("Using Peak EWMA algorithm")
+            self.LB_algorithm = PeakEWMA()
+            self.algorithm_type = AlgorithmType.PEAK_EWMA
+        elif sys.argv[1] == "-k":
+            logger.info("Using Consistent Hashing algorithm")
+            self.LB_algorithm = ConsistentHash()
+            self.algorithm_type = AlgorithmType.CONSISTENT_HASH
         else:
             print("unknown algorithm type")
             sys.exit()
+        self.LB_algorithm.max_in_flight = self.MAX_IN_FLIGHT_PER_BACKEND
         
-    async def check_heartbeat(self, server_writer, server_reader, host, port):
+    async def check_heartbeat(self, server_writer, server_frames, host, port):
         """
-        Periodically checks the heartbeats of the backend servers.
-        If a server is not responding, it will be removed from the load balancer.
+        Health-checks a registered backend over its registration connection.
+
+        The backend is PINGed every HEALTH_CHECK_INTERVAL and its PONGs and heartbeats
+        count as signs of life. After HEALTH_CHECK_MISSES periods of HEALTH_CHECK_TIMEOUT
+        in a row without any, it is ejected;
+        it is readmitted with a slow start once it answers again. If the connection
+        closes, or the backend stays silent for BACKEND_REMOVE_TIMEOUT, it is removed.
+        A backend that registered as warming is added to the rotation on its READY.
         """
-        print(f"Started heartbeat listener for {host}:{port}")
+        logger.info("Started heartbeat listener for %s:%s", host, port)
+        self.last_heartbeats[(host, port)] = time.monotonic()
+        pinger = asyncio.create_task(self.ping_backend(server_writer))
+        misses = 0 # health check periods in a row without a sign of life
         try:
             while True:
                 try: 
-                    data = await asyncio.wait_for(server_reader.read(self.MAX_DATA_SIZE), timeout=10)
+                    frame = await asyncio.wait_for(server_frames.read_frame(), timeout=self.HEALTH_CHECK_TIMEOUT)
                 except asyncio.TimeoutError:
-                    print(f"Timeout waiting for heartbeat from {host}:{port}.")
-                    self.LB_algorithm.remove_server(host, port)
+                    silent_for = time.monotonic() - self.last_heartbeats.get((host, port), 0)
+                    if silent_for > self.BACKEND_REMOVE_TIMEOUT:
+                        logger.warning("Timeout waiting for heartbeat from %s:%s.", host, port)
+                        self.remove_backend(host, port)
+                        break
+                    misses += 1
+                    if misses >= self.HEALTH_CHECK_MISSES:
+                        self.eject_backend(host, port, "missed health checks")
+                    continue
+                misses = 0
+                if frame is None:
+                    logger.warning("Server connection %s:%s has been closed", host, port)
+                    self.remove_backend(host, port)
                     break
-                if not data:
-                    print(f"Server connection {host}:{port} has been closed")
-                    self.LB_algorithm.remove_server(host, port)
-                    break
-                message = data.decode().strip()
-                print(f"Received heartbeat from {host}:{port}: {message}")
+                if frame.msg_type == MessageType.HEARTBEAT:
+                    logger.debug("Received heartbeat from %s:%s: %s", host, port, frame.text())
+                elif frame.msg_type == MessageType.READY and (host, port) in self.warming_backends:
+                    self.add_backend(host, port, self.warming_backends.pop((host, port)))
+                    logger.info("Server ready: %s:%s", host, port)
+                self.last_heartbeats[(host, port)] = time.monotonic()
+                self.readmit_backend(host, port)
+                if (host, port) in self.shared_rows:
+                    self.shared_backends.heartbeat(self.shared_rows[(host, port)])
         except Exception as e:
-            print(f"Heartbeat error from {host}:{port}: {e}")
-            self.LB_algorithm.remove_server(host, port)
+            logger.warning("Heartbeat error from %s:%s: %s", host, port, e)
+            self.remove_backend(host, port)
+        finally:
+            pinger.cancel()
+
+    async def ping_backend(self, server_writer):
+        """
+        Sends a PING on a backend's registration connection every HEALTH_CHECK_INTERVAL.
+        """
+        try:
+            while True:
+                write_frame(server_writer, MessageType.PING)
+                await server_writer.drain()
+                await asyncio.sleep(self.HEALTH_CHECK_INTERVAL)
+        except ConnectionError:
+            pass
+
+    def eject_backend(self, host, port, reason):
+        """
+        Opens a backend's circuit breaker so it gets no new requests.
+
+        The requests it already holds stay with it: a backend that is only slow to
+        answer health checks may still be generating them, and retrying them elsewhere
+        would run them twice. They are retried once their connection is lost, and
+        failed if they time out.
+        """
+        server = self.backend_servers.get((host, port))
+        if server is None or not server.breaker.trip():
+            return
+        self.LB_algorithm.refresh(server)
+        logger.warning("Ejected backend %s:%s: %s", host, port, reason)
+        self.ejections.inc(backend=f"{host}:{port}")
+
+    def readmit_backend(self, host, port):
+        """
+        Closes an ejected backend's circuit breaker once its open period is over,
+        and ends its slow start once that is over.
+        """
+        server = self.backend_servers.get((host, port))
+        if server is None:
+            return
+        if server.breaker.recover():
+            self.LB_algorithm.refresh(server)
+            logger.info("Readmitting backend %s:%s with slow start", host, port)
+            self.wake_queued_requests()
+        elif server.breaker.tick():
+            self.LB_algorithm.refresh(server)
+            logger.info("Backend %s:%s is back at its full share", host, port)
 
-    async def cli_to_srv_forward(self, client_reader, server_writer, client_writer):
+    def add_backend(self, host, port, capacity=1, share=True):
         """
-        Forwards data from the client to the server.
+        Adds a registered backend to the load balancing algorithm and gives it a connection pool.
+
+        A backend joining others that already carry traffic starts with a slow start.
 
         Args:
-            client_reader: StreamReader object that reads data from the client.
-            server_writer: StreamWriter object that writes data to the server
+            capacity: The number of generation workers the backend runs.
+            share: Also register it in the shared table, so the other workers route to it.
+        """
+        joining = bool(self.backend_servers) and (host, port) not in self.backend_servers
+        server = self.backend_servers[(host, port)] = self.LB_algorithm.add_server(host, port, capacity)
+        if joining:
+            server.breaker.start_slow_start()
+            self.LB_algorithm.refresh(server)
+        if (host, port) not in self.backend_pools:
+            self.backend_pools[(host, port)] = BackendPool(host, port, self.srv_to_cli_forward, self.BACKEND_POOL_SIZE,
+                                                           connect_timeout=self.BACKEND_CONNECT_TIMEOUT)
+        if share and self.shared_backends is not None:
+            self.shared_rows[(host, port)] = self.shared_backends.register(host, port, capacity)
+        self.backend_added.set()
+        self.wake_queued_requests()
+
+    def remove_backend(self, host, port, share=True):
+        """
+        Removes a backend from the load balancing algorithm and closes its pooled connections.
+
+        Args:
+            share: Also remove it from the shared table, so the other workers stop routing to it.
+        """
+        if (host, port) in self.warming_backends:
+            del self.warming_backends[(host, port)]
+            self.last_heartbeats.pop((host, port), None)
+            return
+        self.LB_algorithm.remove_server(host, port)
+        self.backend_servers.pop((host, port), None)
+        self.last_heartbeats.pop((host, port), None)
+        pool = self.backend_pools.pop((host, port), None)
+        if pool:
+            pool.close()
+        if share and self.shared_backends is not None:
+            self.shared_backends.unregister(host, port)
+            self.shared_rows.pop((host, port), None)
+
+    async def sync_shared_backends(self):
+        """
+        Keeps this worker in step with the shared backend table.
+
+        Backends registered or removed by other workers are added or removed here,
+        this worker's in-flight counts are published, and the other workers' counts
+        are fed to the load balancing algorithm so it routes on the total load.
+        """
+        table = self.shared_backends
+        while True:
+            if table.version.value != self.shared_version:
+                self.shared_version = table.version.value
+                self.shared_rows = table.backends()
+                for host, port in self.shared_rows.keys() - self.backend_servers.keys():
+                    capacity = int(table.capacities[self.shared_rows[(host, port)]])
+                    self.add_backend(host, port, capacity, share=False)
+                for host, port in self.backend_servers.keys() - self.shared_rows.keys():
+                    self.remove_backend(host, port, share=False)
+
+            for key, row in self.shared_rows.items():
+                server = self.backend_servers.get(key)
+                if server is not None:
+                    table.publish(self.worker_id, row, server.connection_count, server.outstanding_tokens)
+            connections, tokens = table.remote_load(self.worker_id)
+            now = time.time()
+            for key, row in self.shared_rows.items():
+                server = self.backend_servers.get(key)
+                if server is not None:
+                    self.LB_algorithm.observe_remote_load(server, int(connections[row]), int(tokens[row]))
+                    # the worker holding the backend's registration records each answered health check
+                    if now - table.heartbeats[row] > self.HEALTH_CHECK_TIMEOUT * self.HEALTH_CHECK_MISSES:
+                        self.eject_backend(*key, "missed health checks")
+                    else:
+                        self.readmit_backend(*key)
+            # other workers finishing requests frees slots here too
+            self.wake_queued_requests()
+
+            await asyncio.sleep(self.SHARED_SYNC_INTERVAL)
+
+    def record_latency(self, pending, frame):
+        """
+        Feeds the time to first byte and completion time of a request into its server's EWMAs.
+        """
+        if frame.msg_type == MessageType.ERROR:
+            return
+        now = time.monotonic()
+        ttfb = None
+        if pending.first_byte_at is None:
+            pending.first_byte_at = now
+            ttfb = now - pending.sent_at
+        latency = now - pending.sent_at if frame.msg_type != MessageType.CHUNK else None
+        pending.server.observe_latency(ttfb, latency)
+
+    async def snapshot_cache(self):
+        """Periodically saves the semantic cache to its snapshot directory."""
+        while True:
+            await asyncio.sleep(self.SNAPSHOT_INTERVAL)
+            try:
+                await self.semantic_cache.save_snapshot()
+            except OSError as e:
+                logger.error("Failed to save the cache snapshot: %s", e)
+
+    def estimate_cost(self, request_msg):
+        """
+        Estimates how many tokens a request will take to serve: its prompt plus the generated text.
+        """
+        prompt_tokens = len(request_msg) // self.CHARS_PER_TOKEN + 1
+        return prompt_tokens + self.MAX_RESPONSE_TOKENS
+
+    async def cli_to_srv_forward(self, client_frames, client_writer):
+        """
+        Forwards requests from the client to the backend servers.
+
+        Every request is routed on its own, so one client session can be spread over
+        several backends, and requests are handled concurrently so a client can
+        pipeline many of them on one connection.
+
+        Args:
+            client_frames: FrameReader object that reads frames from the client.
             client_writer: StreamWriter object that writes data to the client.
         """
+        tasks = set()
         try:
-            while True:
-                data = await client_reader.read(1024)
-                if not data:
-                    break
-                data = data.decode()
-                
-                # caching - need to ensure its only one way caching
-                cache_response = self.semantic_cache.get(str(data))
-                
-                if cache_response is not None:
-                    cache_response = cache_response.encode()
-                    
-                    if self.CACHING_LOGS:
-                        print("Cache hit!")
-                        print("Got cache_response of: ", cache_response)
-                        
-                    client_writer.write(cache_response)
+            async for frame in client_frames:
+                if frame.msg_type == MessageType.STATS:
+                    write_frame(client_writer, MessageType.STATS, frame.request_id, json.dumps(self.stats()))
                     await client_writer.drain()
-                else:
-                    # adding id to pending requests to ensure we will cache the response when it comes
-                    request_id = str(uuid.uuid4())
-                    self.pending_requests[request_id] = str(data)
-                    
-                    # appending unique ID to the data sent.
-                    payload = f"{request_id}|{data}"
-                    
-                    if self.CACHING_LOGS:
-                        print("Cache miss!")
-                        print("Sending off payload: ", payload)
-                        
-                    server_writer.write(payload.encode())
-                    await server_writer.drain()
+                    continue
+                if frame.msg_type != MessageType.REQUEST:
+                    continue
+                task = asyncio.create_task(self.forward_request(frame, client_writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
         except Exception as e:
-            print(f"Exception occurred: {e}")
+            logger.warning("Exception occurred: %s", e)
         finally:
-            server_writer.close()
-            await server_writer.wait_closed()
-            
-    async def srv_to_cli_forward(self, server_reader, client_writer):
+            for task in tasks:
+                task.cancel()
+
+    async def forward_request(self, frame, client_writer):
         """
-        Forwards data from the server back to the client.
+        Answers one request from the cache, attaches it to a matching in-flight request,
+        or routes it to a backend server.
+
+        Payloads are passed through as memoryviews; they are only decoded for the cache lookup.
 
         Args:
-            server_reader: StreamReader object that reads data from the server.
+            frame: The REQUEST frame received from the client.
             client_writer: StreamWriter object that writes data to the client.
         """
+        request_msg = frame.text()
+        stream = bool(frame.flags & FLAG_STREAM)
+        waiter = Waiter(client_writer, frame.request_id, stream)
+
+        # another load balancer owns this prompt's cache shard; requests forwarded by a peer are always served here
+        if self.cache_ring is not None and not frame.flags & FLAG_FORWARDED:
+            owner = self.cache_ring.lookup(self.prefix_key(request_msg))
+            if owner != self.CACHE_SELF and time.monotonic() >= self.peer_down_until.get(owner, 0):
+                await self.forward_to_peer(owner, frame, waiter)
+                return
+
+        # an identical prompt is already being looked up or generated - no need to embed it
+        if self.attach_to_inflight(request_msg, None, waiter):
+            return
+
+        # identical prompts that arrive from now on attach to this request, during its
+        # cache lookup as well as once it is sent to a backend
+        pending = PendingRequest(waiter, request_msg, frame.payload, stream, self.estimate_cost(request_msg))
+        self.lead(pending)
+
+        # caching - need to ensure its only one way caching
+        provisional_threshold = self.threshold_tuner.floor if frame.flags & FLAG_PROVISIONAL and self.PROVISIONAL_BAND > 0 else None
         try:
-            while True:
-                # Read data from the server
-                data = await server_reader.read(self.MAX_DATA_SIZE)
-                if not data:
-                    break
-                data = data.decode()
-                
-                request_id, response_payload = data.split('|', 1)
-                request_msg = self.pending_requests.pop(request_id, None)
-                
-                # Cache the response
-                if request_msg:
-                    if self.CACHING_LOGS:
-                        print("Adding to cache: ", response_payload)
-                    self.semantic_cache.add(request_msg, response_payload)
-                    
-                # Write the response back to the client
-                client_writer.write(response_payload.encode())
+            match = await self.semantic_cache.match(request_msg, provisional_threshold)
+        except Exception as e:
+            logger.warning("Cache lookup failed: %s", e)
+            self.deliver(pending, Frame(MessageType.ERROR, 0, NO_REQUEST_ID, memoryview(b"Cache lookup failed")))
+            return
+        cache_response, embedding = match.value, match.embedding
+        
+        if cache_response is not None:
+            if self.CACHING_LOGS:
+                logger.debug("Provisional cache hit!" if match.provisional else "Cache hit!")
+                logger.debug("Got cache_response of: %s", cache_response)
+            self.answer_from_cache(pending, cache_response, match.provisional)
+            if not match.provisional and not self.threshold_tuner.should_verify(match.similarity):
+                self.unlead(pending)
                 await client_writer.drain()
+                return
+            # the real response is generated in the background to verify the answer (or a
+            # sampled hit that only the tuned threshold let through) and cache it, and goes
+            # to any request that attaches from now on
+            pending.provisional = (cache_response, match.similarity)
+            await client_writer.drain()
+        elif self.CACHING_LOGS:
+            logger.debug("Cache miss!")
+
+        # a similar request may have been sent while we were embedding; a request answered
+        # provisionally is not handed over, since only its own response verifies the answer
+        leader_id = None
+        if embedding is not None and pending.provisional is None:
+            leader_id = self.coalescer.find_similar(embedding)
+        if leader_id in self.leaders:
+            for waiter in pending.waiters:
+                self.attach(self.leaders[leader_id], waiter)
+            self.unlead(pending)
+            return
+
+        pending.embedding, pending.key = embedding, self.routing_key(request_msg, embedding)
+        self.coalescer.set_embedding(pending.leader_id, embedding)
+        if pending.provisional is not None:
+            self.run_in_background(self.dispatch(pending))
+            return
+        await self.dispatch(pending)
+
+    def prefix_key(self, request_msg):
+        """
+        Returns a routing key shared by every prompt with the same normalized prefix.
+        """
+        return normalize_prompt(request_msg)[:self.ROUTING_PREFIX_CHARS]
+
+    def routing_key(self, request_msg, embedding=None):
+        """
+        Returns the key that algorithms with key affinity route a request by.
+        """
+        if self.ROUTING_KEY == "cluster" and embedding is not None:
+            cluster = self.semantic_cache.cache.cluster_id(embedding)
+            if cluster is not None:
+                return f"cluster:{cluster}"
+        return self.prefix_key(request_msg)
+
+    async def forward_to_peer(self, peer, frame, waiter):
+        """
+        Sends a request to the peer load balancer that owns its cache shard.
+
+        The peer's response frames are relayed to the client by peer_to_cli_forward.
+        If the peer cannot be reached, the request is served here instead, and so is the
+        peer's shard for the next PEER_RETRY_INTERVAL seconds.
+        """
+        try:
+            connection = await self.peer_pools[peer].acquire()
+        except Exception as e:
+            logger.warning("Cache peer %s unavailable, serving its shard locally: %r", peer, e)
+            self.peer_down_until[peer] = time.monotonic() + self.PEER_RETRY_INTERVAL
+            await self.forward_request(frame._replace(flags=frame.flags | FLAG_FORWARDED), waiter.client_writer)
+            return
+        request_id = new_request_id()
+        self.peer_requests[request_id] = PeerRequest(waiter, frame, connection)
+        connection.send(MessageType.REQUEST, request_id, frame.payload, (frame.flags & (FLAG_STREAM | FLAG_PROVISIONAL)) | FLAG_FORWARDED)
+        await connection.writer.drain()
+
+    async def peer_to_cli_forward(self, peer_frames, connection):
+        """
+        Relays the responses of a peer load balancer back to the clients that asked for them.
+
+        Requests stranded by a lost peer connection are served here if none of their
+        response has reached the client yet, and fail otherwise.
+        """
+        try:
+            async for frame in peer_frames:
+                peer_request = self.peer_requests.get(frame.request_id)
+                if peer_request is None:
+                    continue
+                waiter = peer_request.waiter
+                peer_request.answered = True
+                peer_request.updated_at = time.monotonic()
+                if not waiter.client_writer.is_closing():
+                    write_frame(waiter.client_writer, frame.msg_type, waiter.client_request_id, frame.payload, frame.flags)
+                if frame.msg_type != MessageType.CHUNK:
+                    self.finish_peer_request(frame.request_id)
+                    self.observe_request(waiter, "peer")
         except Exception as e:
-            print(f"Exception occurred: {e}")
+            logger.warning("Exception occurred: %s", e)
         finally:
-            client_writer.close()
-            await client_writer.wait_closed()
+            connection.close()
+            for request_id, peer_request in list(self.peer_requests.items()):
+                if peer_request.connection is not connection:
+                    continue
+                self.finish_peer_request(request_id)
+                waiter = peer_request.waiter
+                if peer_request.answered:
+                    if not waiter.client_writer.is_closing():
+                        write_frame(waiter.client_writer, MessageType.ERROR, waiter.client_request_id, "Cache peer connection lost")
+                    self.observe_request(waiter, "error")
+                else:
+                    frame = peer_request.frame
+                    self.run_in_background(self.forward_request(frame._replace(flags=frame.flags | FLAG_FORWARDED), waiter.client_writer))
+
+    def finish_peer_request(self, request_id):
+        """
+        Removes a forwarded request that will get no further frames and frees its slot on the peer connection.
+
+        Returns:
+            The PeerRequest, or None if it was not pending.
+        """
+        peer_request = self.peer_requests.pop(request_id, None)
+        if peer_request is not None:
+            peer_request.connection.in_flight -= 1
+        return peer_request
+
+    def run_in_background(self, coroutine):
+        """
+        Runs a coroutine as a task that is kept alive until it finishes.
+        """
+        task = asyncio.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def dispatch(self, pending):
+        """
+        Sends a request to a backend with a free slot.
+
+        A backend that cannot be connected to, or whose connection fails while the
+        request is written to it, is ejected and the request tries the next one, up
+        to MAX_ATTEMPTS backends in total. If the request is shed, its clients get an
+        OVERLOAD frame; if no backend can take it, an ERROR frame.
+
+        Args:
+            pending: The PendingRequest to send, not yet in pending_requests.
+        """
+        while True:
+            server = None
+            request_id = None
+            try:
+                server = await self.reserve_server(pending.cost, pending.key)
+                if server is None:
+                    self.deliver(pending, Frame(MessageType.OVERLOAD, 0, NO_REQUEST_ID, memoryview(b"All backends are busy, try again later")))
+                    return
+                connection = await self.backend_pools[(server.host, server.port)].acquire()
+                self.selections.inc(backend=f"{server.host}:{server.port}")
+
+                # tagging the request with a unique ID so the response can be routed back and cached when it comes
+                request_id = new_request_id()
+                pending.dispatch(server, connection)
+                self.pending_requests[request_id] = pending
+
+                if self.CACHING_LOGS:
+                    logger.debug("Sending off request %s to port %s: %s", format_request_id(request_id), server.port, pending.request_msg)
+
+                connection.send(MessageType.REQUEST, request_id, pending.payload, FLAG_STREAM if pending.stream else 0)
+                await connection.writer.drain()
+                return
+            except Exception as e:
+                logger.warning("Error connecting to backend server: %r", e)
+                if request_id is not None:
+                    if self.pending_requests.pop(request_id, None) is None:
+                        # the connection's reader saw it fail first, and retries the request from there
+                        return
+                    # the reader fails the connection's other requests once it sees it closed
+                    connection.close()
+                if server is None or pending.attempts >= self.MAX_ATTEMPTS:
+                    if server is not None:
+                        self.LB_algorithm.release(server, pending.cost)
+                        self.wake_queued_requests()
+                    self.deliver(pending, Frame(MessageType.ERROR, 0, NO_REQUEST_ID, memoryview(b"No backend server available")))
+                    return
+                self.LB_algorithm.release(server, pending.cost)
+                self.eject_backend(server.host, server.port, "connection failed")
+                pending.attempts += 1
+
+    async def reserve_server(self, cost, key=None):
+        """
+        Picks a backend with room for one more request and charges the request to it.
+
+        When every backend is at MAX_IN_FLIGHT_PER_BACKEND, the request waits its turn
+        in the admission queue. It is shed instead if the queue is full, if the
+        expected wait is longer than MAX_QUEUE_WAIT, or if no slot frees up in time.
+
+        Args:
+            cost: The estimated number of tokens the request will take to serve.
+            key: The request's routing key.
+
+        Returns:
+            The selected BackendServer, or None if the request was shed.
+        """
+        # requests already queued go first
+        if not self.admission_queue:
+            server = self.LB_algorithm.get_available_server(cost, key)
+            if server is not None:
+                return server
+        if self.admission_queue.is_full() or self.estimate_queue_wait() > self.MAX_QUEUE_WAIT:
+            return None
+
+        deadline = time.monotonic() + self.MAX_QUEUE_WAIT
+        front = False
+        while (remaining := deadline - time.monotonic()) > 0:
+            if not await self.admission_queue.wait(remaining, front):
+                return None
+            server = self.LB_algorithm.get_available_server(cost, key)
+            if server is not None:
+                return server
+            # another request took the slot first: keep our place at the front
+            front = True
+        return None
+
+    def estimate_queue_wait(self):
+        """
+        Estimates how long a newly queued request would wait for a free backend slot.
+
+        Every backend finishes about MAX_IN_FLIGHT_PER_BACKEND requests per observed
+        request latency, so the queue drains at the sum of those rates.
+        """
+        if not self.backend_servers:
+            return 0.0
+        drain_rate = sum(self.MAX_IN_FLIGHT_PER_BACKEND / server.latency.get(self.DEFAULT_SERVICE_TIME)
+                         for server in self.backend_servers.values())
+        return (len(self.admission_queue) + 1) / drain_rate
+
+    def wake_queued_requests(self):
+        """
+        Lets queued requests retry for the backend slots that are free now.
+        """
+        if self.admission_queue:
+            self.admission_queue.wake(self.LB_algorithm.free_slots())
+
+    async def reap_pending_requests(self):
+        """
+        Periodically fails backend and peer requests that have had no reply for REQUEST_TIMEOUT seconds.
+
+        Their clients get an ERROR frame and the backend slot is freed, so a hung
+        backend or peer cannot hold requests, or the clients waiting on them, forever.
+        They are not retried, since the backend may still be generating them.
+        """
+        while True:
+            await asyncio.sleep(1)
+            now = time.monotonic()
+            for request_id, pending in list(self.pending_requests.items()):
+                if request_id in self.pending_requests and now - pending.updated_at > self.REQUEST_TIMEOUT:
+                    logger.warning("Request %s to port %s timed out", format_request_id(request_id), pending.server.port)
+                    self.eject_backend(pending.server.host, pending.server.port, "timed out")
+                    self.fail_request(request_id, "Backend timed out", retry=False)
+            for request_id, peer_request in list(self.peer_requests.items()):
+                if now - peer_request.updated_at > self.REQUEST_TIMEOUT:
+                    logger.warning("Request %s to cache peer timed out", format_request_id(request_id))
+                    self.finish_peer_request(request_id)
+                    waiter = peer_request.waiter
+                    if not waiter.client_writer.is_closing():
+                        write_frame(waiter.client_writer, MessageType.ERROR, waiter.client_request_id, "Cache peer timed out")
+                    self.observe_request(waiter, "error")
+
+    def observe_request(self, waiter, outcome):
+        """
+        Counts a client request as answered and records how long it took.
+        """
+        self.requests_total.inc(outcome=outcome)
+        self.request_seconds.observe(time.monotonic() - waiter.received_at, outcome=outcome)
+
+    def stats(self):
+        """
+        Returns this load balancer's cache and routing statistics, as answered to a STATS frame.
+        """
+        routed = {backend: count for (backend,), count in self.selections.values.items()}
+        return {
+            "cache": self.semantic_cache.hit_stats(),
+            "backends": {
+                f"{host}:{port}": {
+                    "routed": routed.get(f"{host}:{port}", 0),
+                    "in_flight": server.connection_count,
+                    "workers": server.capacity,
+                }
+                for (host, port), server in self.backend_servers.items()
+            },
+            "routed": routed,
+            "threshold_tuner": self.threshold_tuner.stats(),
+            "pending_requests": len(self.pending_requests),
+            "queued_requests": len(self.admission_queue),
+            "active_connections": self.active_connections,
+        }
+
+    def attach_to_inflight(self, request_msg, embedding, waiter):
+        """
+        Adds the waiter to an in-flight request with the same or a semantically similar prompt.
+
+        Returns:
+            True if the waiter was attached and will receive that request's response.
+        """
+        leader_id = self.coalescer.find(request_msg, embedding)
+        pending = self.leaders.get(leader_id) if leader_id is not None else None
+        if pending is None:
+            return False
+        self.attach(pending, waiter)
+        return True
+
+    def attach(self, pending, waiter):
+        """
+        Adds a waiter to an in-flight request, catching a streaming waiter up on the pieces it missed.
+        """
+        if self.CACHING_LOGS:
+            logger.debug("Coalescing request with in-flight request %s", format_request_id(pending.leader_id))
+        pending.waiters.append(waiter)
+        if waiter.stream and pending.chunks:
+            write_frame(waiter.client_writer, MessageType.CHUNK, waiter.client_request_id, b''.join(pending.chunks))
+
+    def lead(self, pending):
+        """
+        Registers a request with the coalescer, so matching requests attach to it until it is answered.
+        """
+        pending.leader_id = new_request_id()
+        self.leaders[pending.leader_id] = pending
+        self.coalescer.register(pending.leader_id, pending.request_msg)
+
+    def unlead(self, pending):
+        """
+        Stops matching requests from attaching to a request, once it has been answered.
+        """
+        if self.leaders.pop(pending.leader_id, None) is not None:
+            self.coalescer.unregister(pending.leader_id)
+
+    def answer_from_cache(self, pending, response, provisional=False):
+        """
+        Answers every client waiting on a request with a cached response.
+
+        The request keeps no waiters afterwards. Not drained here, like `deliver`.
+        """
+        flags = FLAG_CACHE_HIT | (FLAG_PROVISIONAL if provisional else 0)
+        for waiter in pending.waiters:
+            writer = waiter.client_writer
+            if writer.is_closing():
+                continue
+            if waiter.stream:
+                write_frame(writer, MessageType.CHUNK, waiter.client_request_id, response, flags)
+                write_frame(writer, MessageType.END, waiter.client_request_id, flags=flags)
+            else:
+                write_frame(writer, MessageType.RESPONSE, waiter.client_request_id, response, flags)
+            self.observe_request(waiter, "provisional" if provisional else "cache_hit")
+        pending.waiters = []
+
+    def finish_request(self, request_id):
+        """
+        Removes a request that will get no further frames and releases its server.
+
+        Returns:
+            The PendingRequest, or None if it was not pending.
+        """
+        pending = self.pending_requests.pop(request_id, None)
+        if pending is None:
+            return None
+        pending.connection.in_flight -= 1
+        self.LB_algorithm.release(pending.server, pending.cost)
+        self.wake_queued_requests()
+        return pending
+
+    def fail_request(self, request_id, reason, retry=True):
+        """
+        Ends a backend request that will get no reply, retrying it on another backend if that is safe.
+
+        A request is retried when `retry` is set, no part of its response has reached
+        a client, so the retry cannot duplicate output, and it has attempts left.
+        Otherwise its clients get an ERROR frame.
+        """
+        pending = self.finish_request(request_id)
+        if pending is None:
+            return
+        if retry and pending.can_retry() and pending.attempts < self.MAX_ATTEMPTS:
+            pending.attempts += 1
+            self.retries.inc()
+            logger.info("Retrying request %s on another backend: %s", format_request_id(request_id), reason)
+            self.run_in_background(self.dispatch(pending))
+        else:
+            self.deliver(pending, Frame(MessageType.ERROR, 0, request_id, memoryview(reason.encode())))
+
+    def deliver(self, pending, frame, response_text=None):
+        """
+        Writes a backend frame to every client waiting on the request, in the form each asked for.
+
+        Not drained here: one slow client must not hold up responses for the others.
+        A frame that completes the request is also counted in each waiter's latency,
+        and from then on new requests no longer attach to it.
+
+        Args:
+            pending: The PendingRequest the frame belongs to.
+            frame: The frame received from the backend.
+            response_text (str): The assembled response, needed for END frames.
+        """
+        for waiter in pending.waiters:
+            writer = waiter.client_writer
+            if writer.is_closing():
+                continue
+            request_id = waiter.client_request_id
+            if frame.msg_type == MessageType.CHUNK:
+                if waiter.stream:
+                    write_frame(writer, MessageType.CHUNK, request_id, frame.payload)
+            elif frame.msg_type == MessageType.END:
+                if waiter.stream:
+                    write_frame(writer, MessageType.END, request_id)
+                else:
+                    write_frame(writer, MessageType.RESPONSE, request_id, response_text)
+            elif frame.msg_type == MessageType.RESPONSE and waiter.stream:
+                write_frame(writer, MessageType.CHUNK, request_id, frame.payload)
+                write_frame(writer, MessageType.END, request_id)
+            else:
+                write_frame(writer, frame.msg_type, request_id, frame.payload, frame.flags)
+            if frame.msg_type == MessageType.ERROR:
+                self.observe_request(waiter, "error")
+            elif frame.msg_type == MessageType.OVERLOAD:
+                self.observe_request(waiter, "overloaded")
+            elif frame.msg_type != MessageType.CHUNK:
+                self.observe_request(waiter, "backend")
+        if frame.msg_type != MessageType.CHUNK:
+            self.unlead(pending)
+            
+    async def srv_to_cli_forward(self, server_frames, connection):
+        """
+        Forwards responses from a pooled backend connection back to the clients that asked for them.
+
+        Streamed CHUNK frames are relayed the moment they arrive; the full text is only
+        assembled once the END frame comes in, so it can be cached. Every client
+        coalesced onto the request gets the response, and the cache is filled once.
+
+        Args:
+            server_frames: FrameReader object that reads frames from the server.
+            connection: The BackendConnection the frames arrive on.
+        """
+        try:
+            async for frame in server_frames:
+                if frame.msg_type == MessageType.CHUNK:
+                    pending = self.pending_requests.get(frame.request_id)
+                    if pending is None:
+                        continue
+                    pending.chunks.append(bytes(frame.payload))
+                    pending.updated_at = time.monotonic()
+                else:
+                    pending = self.finish_request(frame.request_id)
+                    if pending is None:
+                        continue
+                self.record_latency(pending, frame)
+
+                if frame.msg_type == MessageType.RESPONSE:
+                    response_payload = frame.text()
+                elif frame.msg_type == MessageType.END:
+                    response_payload = pending.response_text()
+                else:
+                    response_payload = None
+
+                # Write the response back to the clients under their own request ids
+                self.deliver(pending, frame, response_payload)
+
+                # Cache the response in the background
+                if response_payload is None:
+                    continue
+                if self.CACHING_LOGS:
+                    logger.debug("Adding to cache: %s", response_payload)
+                generation_time = time.monotonic() - pending.sent_at
+                self.semantic_cache.add_nowait(pending.request_msg, response_payload, pending.embedding, generation_time)
+                if pending.provisional is not None:
+                    self.run_in_background(self.verify_provisional(pending, response_payload))
+        except Exception as e:
+            logger.warning("Exception occurred: %s", e)
+        finally:
+            connection.close()
+            # requests stranded on this connection will never be answered: retry them elsewhere
+            self.eject_backend(connection.host, connection.port, "connection lost")
+            for request_id, pending in list(self.pending_requests.items()):
+                if pending.connection is connection:
+                    self.fail_request(request_id, "Backend connection lost")
+
+    async def verify_provisional(self, pending, response_text):
+        """
+        Checks a provisional answer against the real response and tunes the cache's threshold.
+
+        The two agree if their embeddings are at least as similar as the untuned
+        threshold requires of a cache hit.
+
+        Args:
+            pending: The PendingRequest that generated the real response.
+            response_text (str): The real response.
+        """
+        provisional_response, similarity = pending.provisional
+        try:
+            agreement = await self.semantic_cache.similarity(provisional_response, response_text)
+        except Exception as e:
+            logger.warning("Could not verify provisional answer: %s", e)
+            return
+        if agreement is None:
+            return # the cache is saturated or still loading its model; the sample is skipped
+        agreed = agreement >= self.threshold_tuner.base_threshold
+        self.verifications.inc(result="agreed" if agreed else "disagreed")
+        threshold = self.threshold_tuner.record(similarity, agreed)
+        if threshold != self.semantic_cache.cache.similarity_threshold:
+            logger.info("Cache similarity threshold tuned to %.4f", threshold)
+            # a request similar enough to hit the cache is similar enough to share a leader's response
+            self.semantic_cache.cache.similarity_threshold = threshold
+            self.coalescer.similarity_threshold = threshold
 
     async def handle_connection(self, reader, writer):
         """
@@ -188,126 +1071,208 @@ class LoadBalancer:
             client_writer: StreamWriter object that writes data to the client.
         """
         addr = writer.get_extra_info('peername')
-        print(f"Load balancer received connection on port {addr[1]}")
+        logger.debug("Load balancer received connection on port %s", addr[1])
+        frames = FrameReader(reader)
         try:
-            data = await asyncio.wait_for(reader.read(self.MAX_DATA_SIZE), timeout=5)
-            if not data:
-                print("No data received from client.")
+            frame = await asyncio.wait_for(frames.read_frame(), timeout=5)
+            if frame is None:
+                logger.warning("No data received from client.")
                 writer.close()
                 await writer.wait_closed()
                 return
 
-            message = data.decode().strip()
-            if message.startswith("REGISTER|"):
-                parts = message.split("|")
-                if len(parts) == 3:
-                    server_host = parts[1]
-                    server_port = int(parts[2])
-                    self.LB_algorithm.add_server(server_host, server_port)
+            if frame.msg_type == MessageType.REGISTER:
+                registration = self.parse_registration(frame.text())
+                if registration is not None:
+                    server_host, server_port, warming, capacity = registration
+                    if warming:
+                        # health-checked from now on, routed to once it sends READY
+                        self.warming_backends[(server_host, server_port)] = capacity
+                    else:
+                        self.add_backend(server_host, server_port, capacity)
                     
-                    writer.write(b"REGISTERED")
+                    write_frame(writer, MessageType.REGISTERED)
                     await writer.drain()
-                    print(f"Server registered: {server_host}:{server_port}")
+                    logger.info("Server registered: %s:%s with %d worker(s)%s", server_host, server_port, capacity, " (warming)" if warming else "")
                     
-                    await self.check_heartbeat(writer, reader, server_host, server_port)
+                    await self.check_heartbeat(writer, frames, server_host, server_port)
                 else:
-                    print("Invalid register message format.")
-                    writer.write(b"INVALID REGISTER MESSAGE")
+                    logger.warning("Invalid register message format.")
+                    write_frame(writer, MessageType.ERROR, payload="INVALID REGISTER MESSAGE")
                     await writer.drain()
                     
                     writer.close()
                     await writer.wait_closed()
-            else:
+            elif frame.msg_type == MessageType.HELLO:
                 # Is a client connection
-                print(f"Load balancer knows that this is a client")
-                await self.handle_client(reader, writer)
+                logger.debug("Load balancer knows that this is a client")
+                await self.handle_client(frames, writer)
+            else:
+                logger.warning("Unexpected %s handshake.", frame.msg_type.name)
+                writer.close()
+                await writer.wait_closed()
         except asyncio.TimeoutError:
-            print("Timeout waiting for data from connection.")
+            logger.warning("Timeout waiting for data from connection.")
             writer.close()
             await writer.wait_closed()
         
-    async def handle_client(self, client_reader, client_writer):
+    @staticmethod
+    def parse_registration(payload):
         """
-        Handles a client connection by forwarding data to the appropriate backend server.
+        Parses a REGISTER payload, "<host>|<port>" optionally followed by "|warming"
+        and "|workers=<n>".
+
+        Returns:
+            (host, port, warming, capacity), or None if the payload is malformed.
+        """
+        parts = payload.split("|")
+        if len(parts) < 2:
+            return None
+        host, port, *options = parts
+        warming, capacity = False, 1
+        try:
+            port = int(port)
+            for option in options:
+                if option == "warming":
+                    warming = True
+                elif option.startswith("workers="):
+                    capacity = int(option[len("workers="):])
+                else:
+                    return None
+        except ValueError:
+            return None
+        if capacity < 1:
+            return None
+        return host, port, warming, capacity
+
+    async def handle_client(self, client_frames, client_writer):
+        """
+        Handles a client connection by forwarding its requests to the backend servers.
 
         Args:
-            client_reader: StreamReader object that reads data from the client.
+            client_frames: FrameReader object that reads frames from the client.
             client_writer: StreamWriter object that writes data to the client.
         """
         addr = client_writer.get_extra_info('peername')
-        print(f"Load balancer received client on port {addr[1]}")
-                
-        server_writer = None
-        server_reader = None
-        index = None
-           
-        try:
-            server = self.LB_algorithm.get_server()
-            backend_port = server.port
-            server_host = server.host
-            server_reader, server_writer = await asyncio.open_connection(server_host, backend_port)
-            print(f"Load balancer connected to backend server on port {backend_port}")
+        logger.debug("Load balancer received client on port %s", addr[1])
 
-            async with self.lock:
-                self.active_connections += 1
-                print(f"Total active connections: {self.active_connections}")
-            
-            # Forward data in both directions
-            await asyncio.gather(
-                self.cli_to_srv_forward(client_reader, server_writer, client_writer),
-                self.srv_to_cli_forward(server_reader, client_writer)
-            )
-        except Exception as e:
-            print("Error connecting to backend server:", e)
+        async with self.lock:
+            self.active_connections += 1
+            logger.debug("Total active connections: %d", self.active_connections)
+
+        try:
+            await self.cli_to_srv_forward(client_frames, client_writer)
         finally:
             async with self.lock:
-                server.connection_count -= 1
-                if self.algorithm_type == AlgorithmType.LEAST_CONNECTIONS:
-                    heapq.heapify(self.LB_algorithm.servers)
                 self.active_connections -= 1
-                print(f"Load balancer closed connection with client on port {addr[1]}")
-                print(f"Server on port {backend_port} has {server.connection_count} connections")
-                print(f"Total active connections: {self.active_connections}")
+                logger.debug("Load balancer closed connection with client on port %s", addr[1])
+                logger.debug("Total active connections: %d", self.active_connections)
             client_writer.close()
-            if server_writer:
-                server_writer.close()
-                await server_writer.wait_closed()
 
     async def load_balancer(self):
         """
         Creates the load balancer server and starts listening for client connections.
         
         Args:
-            From command line: algorithm_type (r for round robin, c for least connections).
+            From command line: algorithm_type (r for round robin, c for least connections,
+            t for least outstanding tokens, p for power of two choices, e for peak EWMA,
+            k for consistent hashing).
         """
 
         # load the designated load balancing algorithm
         self.load_lb_algorithm()
         
-        # start server processes
-        self.start_servers()
-
-        # start the load balancer
+        # start the load balancer; workers share the port with SO_REUSEPORT and the
+        # kernel spreads incoming connections across them
         load_balancer = await asyncio.start_server(
             self.handle_connection,
             self.LB_HOST,
-            self.LB_PORT
+            self.LB_PORT,
+            reuse_port=self.shared_backends is not None
         )
 
-        print(f"Load Balancer on port {self.LB_PORT} running on {self.LB_HOST}")
+        logger.info("Load Balancer on port %s running on %s", self.LB_PORT, self.LB_HOST)
+
+        # the embedding model loads in the background; exact cache hits and routing
+        # are served from the start, semantic hits once it is ready
+        self.semantic_cache.start()
+
+        tasks = [
+            load_balancer.serve_forever(),
+            self.reap_pending_requests(),
+            serve_metrics(self.metrics, self.LB_HOST, self.METRICS_PORT + self.worker_id),
+        ]
+        # start server processes; in multi-process mode only the first worker does
+        if self.worker_id == 0:
+            tasks.append(self.start_servers())
+        # workers all map the same snapshot, and only the first one writes it
+        saves_snapshots = self.SNAPSHOT_DIR and not self.SNAPSHOT_READONLY and self.worker_id == 0
+        if saves_snapshots:
+            tasks.append(self.snapshot_cache())
+        if self.shared_backends is not None:
+            tasks.append(self.sync_shared_backends())
 
         try:
             async with load_balancer:
-                await asyncio.gather(
-                    load_balancer.serve_forever()
-                )
+                await asyncio.gather(*tasks)
         except asyncio.CancelledError:
             self.stop_servers()
-            print("\nLoad balancer shutting down.")
+            if saves_snapshots:
+                self.semantic_cache.cache.save_snapshot()
+            if self.CACHING_LOGS:
+                # hit rate against backend seconds saved, to compare eviction policies
+                logger.info("Cache stats: %s", self.semantic_cache.hit_stats())
+            self.semantic_cache.close()
+            logger.info("Load balancer shutting down.")
 
-if __name__ == '__main__':
+def run_worker(worker_id, shared_backends):
+    """
+    Runs one worker of a multi-process load balancer.
+    """
+    configure_logging()
     try:
         lb = LoadBalancer()
+        lb.worker_id = worker_id
+        lb.shared_backends = shared_backends
         asyncio.run(lb.load_balancer())
     except KeyboardInterrupt:
-        print("\nInterrupted by user.")
+        pass
+
+def run_supervisor(num_workers):
+    """
+    Forks `num_workers` load balancer workers that all accept on LB_PORT.
+
+    The shared backend table is created before forking, so every worker maps it.
+    """
+    shared_backends = SharedBackendTable(num_workers)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=run_worker, args=(worker_id, shared_backends), daemon=True)
+               for worker_id in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    logger.info("Supervisor started %d load balancer workers", num_workers)
+    # turn SIGTERM into SystemExit so the workers are stopped on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user.")
+        for worker in workers:
+            worker.join(timeout=5)
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+if __name__ == '__main__':
+    configure_logging()
+    num_workers = int(os.environ.get("LB_WORKERS", "1"))
+    if num_workers > 1:
+        run_supervisor(num_workers)
+    else:
+        try:
+            lb = LoadBalancer()
+            asyncio.run(lb.load_balancer())
+        except KeyboardInterrupt:
+            logger.info("Interrupted by user.")
@@ -0,0 +1,60 @@
+"""Leveled, rate-limited logging shared by the load balancer and the servers.
+
+Modules log through `logging.getLogger(__name__)`. Per-request messages are
+logged at DEBUG, lifecycle events at INFO and failures at WARNING or above, so
+the default INFO level keeps the hot path quiet. The level comes from the
+LOG_LEVEL environment variable; LOG_LEVEL=OFF switches logging off entirely.
+
+Each distinct message is rate-limited on its own, so a flood of identical
+warnings (a dead backend, a saturated cache) cannot stall the event loop on
+stderr; the next message that gets through reports how many were suppressed.
+"""
+import logging
+import os
+import time
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+RATE_LIMIT_PER_SECOND = 10.0
+RATE_LIMIT_BURST = 20
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per (logger, message template) that drops messages over the rate."""
+    def __init__(self, rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {} # (logger name, template) -> [tokens, last refill, suppressed]
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now, 0]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.msg = f"{record.msg} ({bucket[2]} similar messages suppressed)"
+            bucket[2] = 0
+        return True
+
+def configure_logging(level=None):
+    """Sets up the root logger for a load balancer or server process.
+
+    Args:
+        level (str): A logging level name, or "OFF". Defaults to $LOG_LEVEL, then INFO.
+    """
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    if level == "OFF":
+        logging.disable(logging.CRITICAL)
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(RateLimitFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
@@ -0,0 +1,186 @@
+"""Prometheus-style metrics for the load balancer and the servers.
+
+A MetricsRegistry holds counters, gauges and histograms, each optionally split
+by label values, and renders them in the Prometheus text exposition format.
+`serve_metrics` answers `GET /metrics` with that text from a tiny asyncio HTTP
+server, so any Prometheus scraper (or curl) can read it.
+
+Updating a metric is a dict lookup and an addition, cheap enough for the hot
+path. Values that already live elsewhere, like the cache size or the number of
+pending requests, are read at scrape time through `set_function` instead.
+"""
+import asyncio
+import bisect
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# seconds, from a cache hit to a slow generation
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values = {} # label values -> value
+        self.function = None
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def set_function(self, function):
+        """Reads the metric's value(s) at scrape time from `function`.
+
+        The function returns a number, or for a labelled metric a dict of
+        label-value tuples to numbers.
+        """
+        self.function = function
+
+    def samples(self):
+        """Yields (suffix, label pairs, value) for every sample of the metric."""
+        values = self.values
+        if self.function is not None:
+            result = self.function()
+            values = result if isinstance(result, dict) else {(): result}
+        for key, value in values.items():
+            yield "", tuple(zip(self.label_names, key)), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels):
+        self.values.pop(self.key(labels), None)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        state = self.values.get(key)
+        if state is None:
+            # per-bucket counts (not cumulative), then the sum and count of all observations
+            state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self.values.items():
+            labels = tuple(zip(self.label_names, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield "_bucket", labels + (("le", format_value(bound)),), cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+class MetricsRegistry:
+    """Holds a process's metrics. Asking for an existing name returns the existing metric."""
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram, name, documentation, labels, buckets=buckets)
+
+    def register(self, metric_class, name, documentation, labels, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = metric_class(name, documentation, labels, **kwargs)
+        elif not isinstance(metric, metric_class):
+            raise ValueError(f"metric {name} is already registered as a {metric.kind}")
+        return metric
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+async def serve_metrics(registry, host, port):
+    """Serves `GET /metrics` over HTTP until cancelled.
+
+    Args:
+        registry (MetricsRegistry): The metrics to expose.
+        host (str): Interface to listen on.
+        port (int): Port to listen on.
+    """
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # skip the headers
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    async with server:
+        await server.serve_forever()
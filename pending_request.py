@@ -0,0 +1,87 @@
+import time
+
+class Waiter:
+    """A client waiting for the response to a pending request.
+
+    Args:
+        client_writer: StreamWriter object of the client.
+        client_request_id (bytes): The id the client tagged its request with.
+        stream (bool): Whether the client asked for a streamed response.
+    """
+    def __init__(self, client_writer, client_request_id, stream=False):
+        self.client_writer = client_writer
+        self.client_request_id = client_request_id
+        self.stream = stream
+        self.received_at = time.monotonic()
+
+class PendingRequest:
+    """A request on its way to a backend, waiting for the response.
+
+    The client that caused the backend call is the first waiter; clients with the
+    same or a semantically matching prompt that arrive while it is still being
+    looked up in the cache or is in flight are added as further waiters and receive
+    the same response. If its backend fails before any of the response has gone
+    out, the request is sent again to another backend.
+
+    A request whose clients were already given a provisional answer from the cache,
+    or a cache hit sampled for verification, is sent on without them, to verify that
+    answer and cache the real response.
+
+    Args:
+        waiter (Waiter): The client that sent the request, or None.
+        request_msg (str): The prompt, kept so the response can be cached.
+        payload (memoryview): The prompt as received, sent on to the backend as is.
+        stream (bool): Whether the response comes back as CHUNK frames.
+        cost (int): The estimated token cost charged to the server for this request.
+        embedding (np.ndarray): The prompt's embedding, reused when caching the response.
+        key (str): The routing key, for algorithms with key affinity.
+        provisional (tuple): The (response, similarity) of the provisional answer or
+            sampled hit the client was given, if it is to be verified.
+    """
+    def __init__(self, waiter, request_msg, payload, stream=False, cost=1, embedding=None, key=None, provisional=None):
+        self.waiters = [waiter] if waiter is not None else []
+        self.request_msg = request_msg
+        self.payload = payload
+        self.stream = stream
+        self.cost = cost
+        self.embedding = embedding
+        self.key = key
+        self.provisional = provisional
+        self.attempts = 1 # backends tried so far
+        self.leader_id = None # id other requests attach to it by in the RequestCoalescer
+        self.server = None # the BackendServer the request was routed to
+        self.connection = None # the BackendConnection the request was sent on
+        self.sent_at = None
+        self.updated_at = None # last time the backend sent anything for this request
+        self.first_byte_at = None
+        self.chunks = [] # streamed pieces, joined once the END frame arrives
+
+    def dispatch(self, server, connection):
+        """Records that the request is being sent to `server` over `connection`."""
+        self.server = server
+        self.connection = connection
+        self.sent_at = self.updated_at = time.monotonic()
+
+    def can_retry(self):
+        """Returns whether the request can be sent again without repeating output to its clients."""
+        return self.first_byte_at is None and not self.chunks
+
+    def response_text(self):
+        """Returns the full streamed response assembled from its chunks."""
+        return b''.join(self.chunks).decode()
+
+class PeerRequest:
+    """A request forwarded to the load balancer that owns its cache shard.
+
+    Args:
+        waiter (Waiter): The client that sent the request.
+        frame (Frame): The client's REQUEST frame, kept so the request can be served
+            locally if the peer fails before answering.
+        connection: The BackendConnection to the peer the request was sent on.
+    """
+    def __init__(self, waiter, frame, connection):
+        self.waiter = waiter
+        self.frame = frame
+        self.connection = connection
+        self.answered = False # whether any of the peer's response reached the client
+        self.updated_at = time.monotonic() # last time the peer sent anything for this request
@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+
+class PrefixEntry:
+    """The cached attention keys and values of one tokenized prompt prefix."""
+    def __init__(self, value, length, size, keys):
+        self.value = value
+        self.length = length # tokens covered by the value
+        self.size = size # bytes held by the value
+        self.keys = keys # block keys of every prefix of the entry, shortest first
+
+class PrefixCache:
+    """LRU cache of per-prefix model state (past key values), bounded by a byte budget.
+
+    Prompts are split into blocks of `block_size` tokens and every block-aligned
+    prefix is identified by a chained hash of its blocks, so finding the longest
+    cached prefix of a prompt costs one dict lookup per block. An entry stores the
+    state of one prefix and also answers for every shorter block-aligned prefix of
+    it, which the caller serves by slicing the stored state. When the cache holds
+    more than `max_bytes`, least recently used entries are evicted.
+
+    The values are opaque to the cache; the caller supplies their size in bytes.
+    All methods are thread safe, since generation runs on worker threads.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024, block_size=16):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.entries = OrderedDict() # full-length block key -> PrefixEntry, least recently used first
+        self.index = {} # block key of any cached prefix -> most recently used PrefixEntry containing it
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.hit_tokens = 0 # prompt tokens whose prefill was skipped
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def block_keys(self, token_ids, blocks):
+        """Returns the keys of the first `blocks` block-aligned prefixes of `token_ids`."""
+        keys = []
+        key = None
+        for start in range(0, blocks * self.block_size, self.block_size):
+            key = hash((key, tuple(token_ids[start:start + self.block_size])))
+            keys.append(key)
+        return keys
+
+    def lookup(self, token_ids):
+        """Finds the longest cached prefix of a prompt.
+
+        At least the prompt's last token is always left uncovered, since the model
+        has to run on something to produce the next token's logits.
+
+        Args:
+            token_ids (list[int]): The tokenized prompt.
+
+        Returns:
+            (value, length): The entry holding the prefix and the prefix's length in
+            tokens, or (None, 0) on a miss. Only the first `length` tokens of the
+            value belong to the prompt.
+        """
+        keys = self.block_keys(token_ids, (len(token_ids) - 1) // self.block_size)
+        with self.lock:
+            for blocks in range(len(keys), 0, -1):
+                entry = self.index.get(keys[blocks - 1])
+                if entry is not None:
+                    self.entries.move_to_end(entry.keys[-1])
+                    for key in entry.keys:
+                        self.index[key] = entry
+                    length = blocks * self.block_size
+                    self.hits += 1
+                    self.hit_tokens += length
+                    return entry.value, length
+            self.misses += 1
+            return None, 0
+
+    def insert(self, token_ids, value, size):
+        """Caches the state of a block-aligned prefix.
+
+        Args:
+            token_ids (list[int]): The prefix; its length must be a multiple of block_size.
+            value: The model state for exactly these tokens.
+            size (int): Bytes held by the value.
+
+        Returns:
+            True if the prefix was stored, False if it was already cached or is
+            larger than the whole budget.
+        """
+        keys = self.block_keys(token_ids, len(token_ids) // self.block_size)
+        if not keys or size > self.max_bytes:
+            return False
+        with self.lock:
+            if keys[-1] in self.entries:
+                self.entries.move_to_end(keys[-1])
+                return False
+            entry = PrefixEntry(value, len(keys) * self.block_size, size, keys)
+            self.entries[keys[-1]] = entry
+            for key in keys:
+                self.index[key] = entry
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.evict()
+            return True
+
+    def evict(self):
+        _, entry = self.entries.popitem(last=False)
+        self.bytes -= entry.size
+        for key in entry.keys:
+            if self.index.get(key) is entry:
+                del self.index[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.index.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Returns the hit and miss counts, the prefill tokens saved and the bytes held."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "hit_tokens": self.hit_tokens,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+            }
@@ -0,0 +1,73 @@
+import numpy as np
+
+from embedding_index import normalize
+from semantic_cache import normalize_prompt
+
+class RequestCoalescer:
+    """Tracks in-flight backend requests so identical or similar prompts can share one.
+
+    A request that is being looked up in the cache or is waiting on a backend is a
+    "leader". A later request whose normalized text equals a leader's, or whose
+    embedding is at least `similarity_threshold` similar to a leader's, attaches to
+    it as a waiter instead of starting its own lookup and generation. Leaders are
+    registered before their embedding is known, and join the semantic matches
+    once `set_embedding` is called.
+    """
+    def __init__(self, similarity_threshold=0.95):
+        self.similarity_threshold = similarity_threshold
+        self.exact = {} # normalized prompt -> leader request id
+        self.leaders = {} # leader request id -> (normalized prompt, normalized embedding or None)
+        self.matrix = None # stacked embeddings of the leaders, rebuilt lazily
+        self.matrix_ids = []
+
+    def __len__(self):
+        return len(self.leaders)
+
+    def find(self, request_msg, embedding=None):
+        """Returns the request id of an in-flight leader matching this prompt, or None.
+
+        Args:
+            request_msg (str): The incoming prompt.
+            embedding (np.ndarray): The prompt's embedding, to also look for semantic matches.
+        """
+        leader = self.exact.get(normalize_prompt(request_msg))
+        if leader is not None or embedding is None:
+            return leader
+        return self.find_similar(embedding)
+
+    def find_similar(self, embedding):
+        """Returns the request id of an in-flight leader semantically matching this embedding, or None."""
+        if self.matrix is None:
+            self.matrix_ids = [request_id for request_id, (_, emb) in self.leaders.items() if emb is not None]
+            if not self.matrix_ids:
+                return None
+            self.matrix = np.stack([self.leaders[request_id][1] for request_id in self.matrix_ids])
+
+        scores = self.matrix @ normalize(embedding)
+        best = int(np.argmax(scores))
+        if scores[best] >= self.similarity_threshold:
+            return self.matrix_ids[best]
+        return None
+
+    def register(self, request_id, request_msg, embedding=None):
+        """Records a request as a leader, as soon as it arrives."""
+        key = normalize_prompt(request_msg)
+        self.exact.setdefault(key, request_id)
+        self.leaders[request_id] = (key, None if embedding is None else normalize(embedding))
+        self.matrix = None
+
+    def set_embedding(self, request_id, embedding):
+        """Adds a leader's embedding, once computed, so semantically similar requests match it."""
+        if request_id in self.leaders and embedding is not None:
+            self.leaders[request_id] = (self.leaders[request_id][0], normalize(embedding))
+            self.matrix = None
+
+    def unregister(self, request_id):
+        """Forgets a leader once its response has arrived or it has failed."""
+        entry = self.leaders.pop(request_id, None)
+        if entry is None:
+            return
+        key, _ = entry
+        if self.exact.get(key) == request_id:
+            del self.exact[key]
+        self.matrix = None
@@ -1,68 +1,505 @@
-from transformers import pipeline
 import numpy as np
-from collections import deque
+import hashlib
+import logging
+import threading
+import time
+
+from embedding_index import make_index, grow, FlatIndex, QuantizedIndex
+from cache_snapshot import CacheSnapshot
+from embedders import TransformerEmbedder
+from eviction_policies import make_policy
+
+logger = logging.getLogger(__name__)
+
+def normalize_prompt(msg):
+    """Case-folds a prompt and collapses its whitespace, so trivially different repeats compare equal."""
+    return " ".join(msg.casefold().split())
+
+def exact_key(msg):
+    """Hashes the normalized prompt into the key of the exact-match tier."""
+    return hashlib.blake2b(normalize_prompt(msg).encode(), digest_size=16).digest()
+
+# typical entry, used to size TinyLFU's frequency sketch from a byte budget: an int8
+# 768-d vector with its scale (772 bytes) plus a response of a few hundred bytes
+TYPICAL_ENTRY_BYTES = 1024
+
+# value offset of an entry whose value is being appended to the log by `save_snapshot`;
+# replacing the value sets the offset back to -1
+BEING_LOGGED = -2
 
 class SemanticCache:
     """Cache for storing semantic embeddings and their corresponding values.
 
-    The cache is formatted as a dictionary of embedding, value.
+    The cache has two tiers over the same entries. The exact tier maps a hash of the
+    normalized prompt to its entry, so a repeat is answered without running the
+    embedding model. Only on an exact miss does the semantic tier embed the prompt.
+    An entry can be inserted before its embedding is computed; until then it is
+    only in the exact tier.
+    Both tiers share one eviction policy and one size limit, and keep separate hit counters.
+
+    Embeddings live in a pre-normalized index that grows with the entries and values
+    in a parallel slot table, so a lookup is one matrix-vector product instead of a scan
+    over the entries. Pass index='ivf' for an approximate index that scales to very
+    large caches, or index='quantized' to store vectors as int8 (or float16) and
+    re-rank the best candidates at full precision.
+
+    The cache holds at most `max_cache_size` entries and, with `max_cache_bytes`,
+    at most that many bytes of stored vectors (with their re-rank rows) and values.
+    When only a byte budget is given the number of entries is not limited, and the
+    slot table and index grow until the budget is used. Which entries are evicted to stay
+    under the limits is up to `eviction_policy` (see eviction_policies.py): 'lru',
+    'tinylfu' (LRU with frequency-based admission) or 'greedydual' (cost-aware,
+    keeping the responses that were slowest to generate). With `ttl`, entries
+    also expire that many seconds after they were stored.
+
+    With a `snapshot_dir` the cache warm-starts from the snapshot saved there: the
+    embedding matrix is memory-mapped rather than read, and each value is only read
+    from the value log when its entry is first hit. `save_snapshot` writes the
+    current entries back, appending only values that are not logged yet.
     The cache uses cosine similarity to determine if a new message is similar to any existing messages in the cache.
     """
-    def __init__(self, similarity_threshold=0.95, CACHE_LOGS=True):
-        self.cache = {} # dict of (embedding, value)
-        self.ordering = deque()
-        self.max_cache_size = 2
-        self.semantic_pipeline = pipeline("feature-extraction", model="distilbert-base-uncased")
+    def __init__(self, similarity_threshold=0.95, CACHE_LOGS=True, max_cache_size=None, index='flat', index_options=None, embedder=None, snapshot_dir=None, max_cache_bytes=None, eviction_policy='lru', ttl=None):
+        if max_cache_size is None and max_cache_bytes is None:
+            max_cache_size = 4096
+        # the slot table starts empty and grows on demand, up to `max_cache_size` slots
+        self.values = [] # slot -> value, None until read from the snapshot
+        self.value_offsets = np.full(0, -1, dtype=np.int64) # slot -> offset in the value log, -1 if not logged
+        self.exact = {} # exact key -> slot
+        self.slot_keys = [] # slot -> exact key
+        self.indexed = np.zeros(0, dtype=bool) # slot -> whether its embedding is in the index
+        self.key_rows = np.zeros((0, 16), dtype=np.uint8) # slot -> exact key bytes, zero if none, for snapshots
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "provisional_hits": 0, "expired": 0, "rejected": 0, "cost_saved": 0.0}
+        self.policy = make_policy(eviction_policy, max_cache_size or max(1, max_cache_bytes // TYPICAL_ENTRY_BYTES))
+        self.free_slots = []
+        self.max_cache_size = max_cache_size
+        self.max_cache_bytes = max_cache_bytes
+        self.entry_bytes = np.zeros(0, dtype=np.int64) # slot -> vector, re-rank row and value bytes
+        self.cache_bytes = 0
+        self.entry_costs = np.ones(0) # slot -> seconds it took to generate the value
+        self.ttl = ttl
+        self.expires_at = np.full(0, np.inf) # slot -> wall-clock expiry time
+        self.index_type = index
+        self.index_options = index_options or {}
+        self.index = None # built on the first add, once the embedding size is known
+        self.embedder = embedder or TransformerEmbedder("distilbert-base-uncased")
         self.similarity_threshold = similarity_threshold
         self.CACHE_LOGS = CACHE_LOGS
-    
+        # the index is guarded by `lock`, held during searches and snapshot exports; the
+        # slot table, exact tier, eviction policy and counters by `exact_lock`, which is only
+        # held for table reads and updates, so exact lookups never wait on a search.
+        # Writers take `lock`, then `exact_lock`; embedding runs outside both
+        self.lock = threading.Lock()
+        self.exact_lock = threading.Lock()
+        self.SNAPSHOT_COMPACT_RATIO = 4 # rewrite the value log once it is this many times the live data
+
+        self.snapshot = CacheSnapshot(snapshot_dir) if snapshot_dir else None
+        if self.snapshot is not None and self.snapshot.exists():
+            self.load_snapshot()
+
     def get(self, msg):
-        """Iterates through the cache checking for semantic similarity to the given message.
+        """Looks up the given message in the exact tier, then the semantic tier.
+
+        Args:
+            msg (str): The message to be checked against the cache.
+        """
+        value = self.get_exact(msg)
+        if value is not None:
+            return value
+        if len(self) == 0:
+            if self.CACHE_LOGS:
+                logger.debug("Cache miss - cache is empty!")
+            with self.exact_lock:
+                self.stats["misses"] += 1
+            return None
+        return self.lookup(self.semantic_key(msg))
+
+    def get_exact(self, msg):
+        """Returns the cached value for a prompt that normalizes to a cached one, or None.
+
+        A miss here is not counted; the caller falls through to the semantic tier.
+        Only `exact_lock` is taken, so this is cheap enough to call on the event loop.
+        An expired entry is a miss here and is evicted by the next write.
 
         Args:
             msg (str): The message to be checked against the cache.
         """
-        query_embedding = self.semantic_key(msg)
+        key = exact_key(msg)
+        with self.exact_lock:
+            self.policy.record(key)
+            slot = self.exact.get(key)
+            if slot is None or self.expires_at[slot] <= time.time():
+                return None
+            if self.CACHE_LOGS:
+                logger.debug("Got an exact cache hit!")
+            return self.hit(slot, "exact_hits")
+
+    def lookup(self, query_embedding):
+        """Returns the cached value for an already computed embedding, or None on a miss.
+
+        Args:
+            query_embedding (np.ndarray): The embedding of the message being looked up.
+        """
+        value, _, _ = self.match(query_embedding)
+        return value
+
+    def match(self, query_embedding, provisional_threshold=None):
+        """Looks up an already computed embedding, optionally accepting a near miss.
+
+        A near miss still counts as a miss, since the caller has to generate the
+        real response anyway; it is also counted as a provisional hit.
+
+        Args:
+            query_embedding (np.ndarray): The embedding of the message being looked up.
+            provisional_threshold (float): If given, a miss whose best candidate scores
+                at least this similarity returns that candidate as a provisional answer.
+
+        Returns:
+            (value, similarity, provisional): The cached value or None, the similarity
+            of the best candidate (-1.0 if there is none), and whether the value is
+            only a provisional answer.
+        """
+        similarity = -1.0
+        with self.lock:
+            slot = None
+            if self.index is not None:
+                slot, similarity = self.index.search(query_embedding)
+            with self.exact_lock:
+                return self.matched(slot, similarity, provisional_threshold)
 
-        for cached_key, value in self.cache.items():
-            cached_embedding = np.array(cached_key)
-            similarity = self.cosine_similarity(query_embedding, cached_embedding)
-            if similarity >= self.similarity_threshold:
-            
+    def matched(self, slot, similarity, provisional_threshold):
+        """Counts the outcome of a semantic search and returns it as `match` does."""
+        if slot is not None and similarity >= self.similarity_threshold:
+            if self.expires_at[slot] > time.time():
                 if self.CACHE_LOGS:
-                    print("Got a cache hit! Simliarity: ", similarity)
-                    
-                # make it the most recent entry in the cache
-                self.ordering.remove(cached_key)
-                self.ordering.append(cached_key)
-                return str(value)
-            
+                    logger.debug("Got a cache hit! Similarity: %.4f", similarity)
+                return self.hit(slot, "semantic_hits"), similarity, False
+            self.evict(slot)
+            self.stats["expired"] += 1
+        elif slot is not None and provisional_threshold is not None and similarity >= provisional_threshold \
+                and self.expires_at[slot] > time.time():
+            self.stats["misses"] += 1
+            self.stats["provisional_hits"] += 1
+            if self.CACHE_LOGS:
+                logger.debug("Got a provisional cache hit! Similarity: %.4f", similarity)
+            return str(self.value(slot)), similarity, True
+        self.stats["misses"] += 1
+
         if self.CACHE_LOGS:
-            print("Cache miss - no semantic similarity!")
-            
-        return None
-    
-    def add(self, msg, value):
-        if len(self.cache) >= self.max_cache_size:
-            oldest_entry = self.ordering.popleft()
-            del self.cache[oldest_entry]            
+            logger.debug("Cache miss - no semantic similarity!")
+
+        return None, similarity, False
+
+    def hit(self, slot, tier):
+        """Counts a hit on a live slot and returns its value."""
+        self.policy.touch(slot)
+        self.stats[tier] += 1
+        self.stats["cost_saved"] += self.entry_costs[slot]
+        return str(self.value(slot))
+
+    def add(self, msg, value, cost=1.0):
+        self.insert(self.semantic_key(msg), value, msg, cost)
+
+    def insert(self, emb_vec, value, msg=None, cost=1.0, ttl=None):
+        """Stores a value under an already computed embedding, evicting entries if full.
+
+        Without an embedding the entry only goes into the exact tier, and joins the
+        semantic tier once `add_embedding` is called for it.
+
+        Args:
+            emb_vec (np.ndarray): The embedding of the request message, or None.
+            value (str): The response to cache.
+            msg (str): The request message, to also index it in the exact tier.
+                Required when there is no embedding.
+            cost (float): What it took to generate the value, in backend seconds.
+            ttl (float): Seconds until the entry expires, overriding the cache's ttl.
+        """
+        if emb_vec is None and msg is None:
+            raise ValueError("an entry needs an embedding or a message")
+        key = exact_key(msg) if msg is not None else None
+        with self.lock:
+            ttl = ttl if ttl is not None else self.ttl
+            expires_at = time.time() + ttl if ttl is not None else np.inf
+            with self.exact_lock:
+                slot = self.store(key, value, cost, expires_at)
+            if slot is not None and emb_vec is not None and not self.indexed[slot]:
+                self.attach(slot, emb_vec)
+
+    def add_embedding(self, msg, emb_vec):
+        """Adds the embedding of an entry inserted without one to the semantic tier.
+
+        Does nothing if the entry has been evicted in the meantime or is already indexed.
+        """
+        key = exact_key(msg)
+        with self.lock:
+            with self.exact_lock:
+                slot = self.exact.get(key)
+            if slot is not None and not self.indexed[slot]:
+                self.attach(slot, emb_vec)
+
+    def store(self, key, value, cost, expires_at):
+        """Stores a value in the slot table, evicting entries if full.
+
+        Called with both locks held. The entry's size includes its vector, whether or
+        not it is indexed yet, once the index exists and the vector size is known.
+
+        Returns:
+            The entry's slot, or None if the value was not cached.
+        """
+        vector_bytes = self.index.bytes_per_vector if self.index is not None else 0
+        size = vector_bytes + len(value.encode())
+
+        if key in self.exact:
+            # same prompt again: refresh the existing entry instead of duplicating it
+            slot = self.exact[key]
+            self.values[slot] = value
+            self.value_offsets[slot] = -1
+            self.cache_bytes += size - self.entry_bytes[slot]
+            self.entry_bytes[slot] = size
+            self.entry_costs[slot] = cost
+            self.expires_at[slot] = expires_at
+            self.policy.insert(slot, key, cost, size)
+            self.shrink()
+            return slot
+
+        if self.max_cache_bytes is not None and size > self.max_cache_bytes:
+            if self.CACHE_LOGS:
+                logger.warning("Response is larger than the cache budget! Not caching it.")
+            return None
+        if not self.free_slots:
+            self.grow_slots(len(self.values) + 1)
+        if self.is_full(size) and not self.policy.admit(key):
+            self.stats["rejected"] += 1
+            return None
+        self.shrink(size)
+
+        slot = self.free_slots.pop()
+        self.values[slot] = value
+        self.value_offsets[slot] = -1
+        self.entry_bytes[slot] = size
+        self.cache_bytes += size
+        self.entry_costs[slot] = cost
+        self.expires_at[slot] = expires_at
+        if key is not None:
+            self.exact[key] = slot
+            self.slot_keys[slot] = key
+            self.key_rows[slot] = np.frombuffer(key, dtype=np.uint8)
+        self.policy.insert(slot, key, cost, size)
+        return slot
+
+    def grow_slots(self, slots):
+        """Grows the slot table to at least `slots` slots, up to `max_cache_size`. Called with `exact_lock` held."""
+        old = len(self.values)
+        self.value_offsets = grow(self.value_offsets, slots, self.max_cache_size, fill=-1)
+        new = len(self.value_offsets)
+        if new == old:
+            return
+        self.indexed = grow(self.indexed, slots, self.max_cache_size)
+        self.key_rows = grow(self.key_rows, slots, self.max_cache_size)
+        self.entry_bytes = grow(self.entry_bytes, slots, self.max_cache_size)
+        self.entry_costs = grow(self.entry_costs, slots, self.max_cache_size, fill=1.0)
+        self.expires_at = grow(self.expires_at, slots, self.max_cache_size, fill=np.inf)
+        self.values.extend([None] * (new - old))
+        self.slot_keys.extend([None] * (new - old))
+        # new slots go under the free ones, so the lowest free slot is still used first
+        self.free_slots[:0] = range(new - 1, old - 1, -1)
+
+    def attach(self, slot, emb_vec):
+        """Adds a stored entry's embedding to the index. Called with `lock` held."""
+        if self.index is None:
+            self.index = make_index(self.index_type, len(emb_vec), self.max_cache_size, **self.index_options)
+        self.index.add(slot, emb_vec)
+        with self.exact_lock:
+            self.indexed[slot] = True
+            # entries stored before the index existed did not count their vector yet
+            size = self.index.bytes_per_vector + len(self.value(slot).encode())
+            if size != self.entry_bytes[slot]:
+                self.cache_bytes += size - self.entry_bytes[slot]
+                self.entry_bytes[slot] = size
+                self.policy.insert(slot, self.slot_keys[slot], self.entry_costs[slot], size)
+                self.shrink()
+
+    def is_full(self, incoming=0):
+        """Returns whether entries must be evicted before `incoming` more bytes fit.
+
+        With the default of 0 it only checks the byte budget, and never counts the
+        only remaining entry as over it. The slot table is grown before this is
+        asked, so having no free slot means `max_cache_size` has been reached.
+        """
+        if not self.policy:
+            return False
+        if incoming and not self.free_slots:
+            return True
+        return self.max_cache_bytes is not None and self.cache_bytes + incoming > self.max_cache_bytes \
+            and (incoming or len(self.policy) > 1)
+
+    def shrink(self, incoming=0):
+        """Evicts entries chosen by the eviction policy until `incoming` more bytes and one more entry fit."""
+        if self.ttl is not None and self.is_full(incoming):
+            self.purge_expired()
+        while self.is_full(incoming):
+            self.evict(self.policy.victim())
             if self.CACHE_LOGS:
-                print("Max cache size reached! Removing oldest entry.")
-        emb_vec = self.semantic_key(msg)
-        emb_key = tuple(emb_vec)
-        self.cache[emb_key] = value
-        self.ordering.append(emb_key)
-    
+                logger.debug("Max cache size reached! Removing an entry.")
+
+    def purge_expired(self):
+        """Evicts every entry whose ttl has passed."""
+        for slot in np.flatnonzero(self.expires_at <= time.time()):
+            self.evict(int(slot))
+            self.stats["expired"] += 1
+
+    def evict(self, slot):
+        self.policy.remove(slot)
+        if self.indexed[slot]:
+            self.index.remove(slot)
+            self.indexed[slot] = False
+        self.values[slot] = None
+        self.value_offsets[slot] = -1
+        self.cache_bytes -= self.entry_bytes[slot]
+        self.entry_bytes[slot] = 0
+        self.expires_at[slot] = np.inf
+        key = self.slot_keys[slot]
+        if key is not None:
+            del self.exact[key]
+            self.slot_keys[slot] = None
+            self.key_rows[slot] = 0
+        self.free_slots.append(slot)
+
     def clear(self):
-        self.cache.clear()
-        self.ordering.clear()
-        
+        with self.lock, self.exact_lock:
+            if self.index is not None:
+                self.index.clear()
+            self.clear_slots()
+
+    def clear_slots(self):
+        self.values = [None] * len(self.values)
+        self.value_offsets[:] = -1
+        self.entry_bytes[:] = 0
+        self.indexed[:] = False
+        self.cache_bytes = 0
+        self.entry_costs[:] = 1.0
+        self.expires_at[:] = np.inf
+        self.exact.clear()
+        self.slot_keys = [None] * len(self.values)
+        self.key_rows[:] = 0
+        self.policy.clear()
+        self.free_slots = list(range(len(self.values) - 1, -1, -1))
+
+    def __len__(self):
+        return len(self.policy)
+
+    def value(self, slot):
+        """Returns the value in a slot, reading it from the snapshot's value log on first use."""
+        value = self.values[slot]
+        if value is None:
+            value = self.snapshot.read_value(int(self.value_offsets[slot]))
+            self.values[slot] = value
+        return value
+
+    def load_snapshot(self):
+        """Replaces the cache's entries with those of the snapshot in `snapshot_dir`.
+
+        The most recently used entries that fit are loaded into slots 0..n-1. A
+        flat index runs directly on the memory-mapped matrix and nothing is copied
+        until the index grows past it; a quantized index quantizes the mapped rows
+        and re-ranks against the map. Other indexes add the rows one by one.
+        """
+        snapshot = self.snapshot.load()
+        first = max(0, len(snapshot["matrix"]) - self.max_cache_size) if self.max_cache_size is not None else 0
+        dim, matrix = snapshot["dim"], snapshot["matrix"][first:]
+        with self.lock, self.exact_lock:
+            self.clear_slots()
+            self.grow_slots(len(matrix))
+            if self.index_type == 'flat':
+                self.index = FlatIndex(dim, self.max_cache_size, matrix=matrix)
+            elif self.index_type == 'quantized':
+                self.index = QuantizedIndex(dim, self.max_cache_size, full=matrix, **self.index_options)
+            else:
+                self.index = make_index(self.index_type, dim, self.max_cache_size, **self.index_options)
+                for slot, vector in enumerate(matrix):
+                    self.index.add(slot, vector)
+
+            for slot in range(len(matrix)):
+                row = first + slot
+                self.value_offsets[slot] = snapshot["offsets"][row]
+                self.entry_bytes[slot] = self.index.bytes_per_vector + self.snapshot.value_size(self.value_offsets[slot])
+                self.cache_bytes += self.entry_bytes[slot]
+                self.entry_costs[slot] = snapshot["costs"][row]
+                self.expires_at[slot] = snapshot["expires_at"][row]
+                key = snapshot["keys"][row]
+                if key.any():
+                    key = key.tobytes()
+                    self.exact[key] = slot
+                    self.slot_keys[slot] = key
+                    self.key_rows[slot] = snapshot["keys"][row]
+                self.policy.insert(slot, self.slot_keys[slot], self.entry_costs[slot], self.entry_bytes[slot])
+            self.indexed[:len(matrix)] = True
+            self.free_slots = list(range(len(self.values) - 1, len(matrix) - 1, -1))
+            self.shrink()
+
+        if self.CACHE_LOGS:
+            logger.info("Loaded %d cache entries from snapshot %s", len(self), self.snapshot.directory)
+
+    def save_snapshot(self):
+        """Writes the cache's entries to `snapshot_dir`.
+
+        Only the occupied slots are exported, in eviction order. They are copied
+        under the locks and written outside them, so lookups keep being served while
+        the snapshot is written; exact lookups are only held up while the slot table
+        is copied, not while the embedding rows are. Only values inserted since the
+        last snapshot are appended to the value log; the log is compacted once it
+        grows past `SNAPSHOT_COMPACT_RATIO` times the size of the live values.
+        """
+        if self.snapshot is None:
+            raise ValueError("the cache has no snapshot_dir to save to")
+        with self.lock:
+            if self.index is None:
+                return
+            with self.exact_lock:
+                slots = np.fromiter(self.policy, dtype=np.int64, count=len(self.policy)) # row -> slot
+                slots = slots[self.indexed[slots]] # entries still waiting for their embedding go out next time
+                keys = self.key_rows[slots]
+                offsets = self.value_offsets[slots]
+                values = list(self.values)
+                self.value_offsets[slots[offsets < 0]] = BEING_LOGGED
+                costs = self.entry_costs[slots]
+                expires_at = self.expires_at[slots]
+            matrix = self.index.export(slots)
+        new_records = [(row, keys[row].tobytes(), values[slots[row]])
+                       for row in np.flatnonzero(offsets < 0).tolist()]
+
+        new_offsets = self.snapshot.save(matrix, keys, offsets, new_records, costs, expires_at,
+                                         compact_ratio=self.SNAPSHOT_COMPACT_RATIO)
+
+        with self.lock, self.exact_lock:
+            # entries replaced while the snapshot was written keep offset -1 and go out next time
+            current = self.value_offsets[slots]
+            unchanged = ((current == offsets) & (offsets >= 0)) | (current == BEING_LOGGED)
+            self.value_offsets[slots[unchanged]] = new_offsets[unchanged]
+            self.snapshot.open_log()
+
+        if self.CACHE_LOGS:
+            logger.info("Saved %d cache entries to snapshot %s", len(slots), self.snapshot.directory)
+
+    def cluster_id(self, emb_vec):
+        """Returns the index cluster an embedding falls in, or None if the index has no clusters."""
+        cell = getattr(self.index, "cell", None)
+        return cell(emb_vec) if cell is not None else None
+
+    def hit_stats(self):
+        """Returns the hit counters of each tier, plus the share of hits that skipped embedding."""
+        with self.exact_lock:
+            stats = dict(self.stats)
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["size"] = len(self)
+        stats["bytes"] = int(self.cache_bytes)
+        stats["cost_saved"] = float(stats["cost_saved"])
+        stats["hit_ratio"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        stats["embeddings_saved"] = stats["exact_hits"]
+        return stats
+
     def semantic_key(self, data):
-        # (1, num_tokens, 768)
-        embedding = self.semantic_pipeline(data)
-        mean_embedding = np.mean(embedding[0], axis=0)
-        return mean_embedding
+        # (1, 768) -> (768,)
+        return self.embedder.embed([data])[0]
 
     def cosine_similarity(self, a, b):
         return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
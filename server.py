@@ -1,13 +1,21 @@
 import asyncio
+import logging
+import os
 import sys
-from llm_module import get_llm_response
+import time
+from generation_scheduler import GenerationScheduler
+from generation_workers import GenerationWorkerPool
+from framing import FrameReader, MessageType, write_frame, format_request_id, FLAG_STREAM
+from logs import configure_logging
+from metrics import MetricsRegistry, serve_metrics
+
+logger = logging.getLogger(__name__)
 
-MAX_DATA_SIZE = 1024
 SERVER_HOST = 'localhost'
 SERVER_LOGS = True
 
 LB_HOST = 'localhost'
-LB_PORT = 1234
+LB_PORT = int(os.environ.get("LB_PORT", "1234"))
 
 MAX_RETRIES = 5
 RETRY_DELAY = 5 # seconds
@@ -15,29 +23,58 @@ RETRY_DELAY = 5 # seconds
 heartbeat_count = 0
 heartbeat_interval = 5 # seconds
 
-async def connect_to_load_balancer(lb_host, lb_port, server_port):
-    """Connects to the load balancer and returns the reader and writer objects."""
+MAX_BATCH_SIZE = 8
+MAX_QUEUE_DELAY_MS = 20
+# streamed requests generate one at a time each, on their own threads, at most this many at once
+MAX_CONCURRENT_STREAMS = 4
+
+# generation processes forked from one loaded model; they share its weights and
+# the server registers as one backend with that many workers
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "1"))
+if SERVER_WORKERS > 1:
+    # CUDA does not survive a fork, so pre-forked workers run on the CPU
+    os.environ.setdefault("LLM_DEVICE", "cpu")
+
+# each server exposes GET /metrics on its own port plus this offset
+METRICS_PORT_OFFSET = 10000
+
+metrics = MetricsRegistry()
+requests_total = metrics.counter("server_requests_total", "Requests answered, by mode and outcome", ("mode", "outcome"))
+request_seconds = metrics.histogram("server_request_seconds", "Time from receiving a request to its last frame", ("mode",))
+requests_in_flight = metrics.gauge("server_requests_in_flight", "Requests received and not yet answered")
+requests_in_flight.set(0)
+
+async def connect_to_load_balancer(lb_host, lb_port, server_port, warming=False, workers=1):
+    """Connects to the load balancer and returns a FrameReader and writer for the connection.
+
+    A server registered as `warming` gets no requests until it sends READY, and one
+    with several `workers` gets as much load as that many single-worker servers.
+    """
     for attempt in range(1, MAX_RETRIES + 1):
         try:
             lb_reader, lb_writer = await asyncio.open_connection(lb_host, lb_port)
-            registar = f"REGISTER|{SERVER_HOST}|{server_port}"
-            lb_writer.write(registar.encode())
+            registar = f"{SERVER_HOST}|{server_port}"
+            if warming:
+                registar += "|warming"
+            if workers > 1:
+                registar += f"|workers={workers}"
+            write_frame(lb_writer, MessageType.REGISTER, payload=registar)
             await lb_writer.drain()
 
-            data = await lb_reader.read(MAX_DATA_SIZE)
-            data = data.decode().strip()
-            if data and data == "REGISTERED":
+            lb_frames = FrameReader(lb_reader)
+            frame = await lb_frames.read_frame()
+            if frame and frame.msg_type == MessageType.REGISTERED:
                 if SERVER_LOGS:
-                    print(f"Server on port {server_port} registered with load balancer on {lb_host}:{lb_port}")
-                return lb_reader, lb_writer
+                    logger.info("Server on port %s registered with load balancer on %s:%s", server_port, lb_host, lb_port)
+                return lb_frames, lb_writer
             else:
                 raise ConnectionError("Unexpected response from load balancer.")
         except Exception as e:
-            print(f"[Attempt {attempt}] Error connecting to load balancer: {e}")
+            logger.warning("[Attempt %d] Error connecting to load balancer: %s", attempt, e)
             if attempt < MAX_RETRIES:
                 await asyncio.sleep(RETRY_DELAY)
             else:
-                print("Max retries reached. Exiting.")
+                logger.error("Max retries reached. Exiting.")
                 sys.exit(1)
                 
 async def heartbeat(lb_writer):
@@ -46,103 +83,233 @@ async def heartbeat(lb_writer):
     while True:
         heartbeat_message = f"HEARTBEAT {heartbeat_count}"
 
-        lb_writer.write(heartbeat_message.encode())
+        write_frame(lb_writer, MessageType.HEARTBEAT, payload=heartbeat_message)
         if SERVER_LOGS:
-            print(f"Server on port {SERVER_HOST} sending heartbeat to load balancer: {heartbeat_message}")
+            logger.debug("Server on %s sending heartbeat to load balancer: %s", SERVER_HOST, heartbeat_message)
             
         await lb_writer.drain()
         heartbeat_count += 1
         await asyncio.sleep(heartbeat_interval)  # Send heartbeat every 5 seconds
         
-async def handle_client(reader, writer, port):
+async def answer_health_checks(lb_frames, lb_writer):
+    """Answers the load balancer's PING health checks on the registration connection."""
+    async for frame in lb_frames:
+        if frame.msg_type == MessageType.PING:
+            write_frame(lb_writer, MessageType.PONG, frame.request_id)
+            await lb_writer.drain()
+
+async def handle_client(reader, writer, port, scheduler):
     """Handles incoming client connections and processes requests using the LLM.
     
+    Each request is handed to the generation scheduler as its own task, so several
+    requests on one connection can be batched together.
+
     Args:
         reader: StreamReader object that reads data from the client.
         writer: StreamWriter object that writes data to the client.
         port: The port number on which the server is running.
+        scheduler: The GenerationScheduler that batches requests for the LLM.
         
-    Expected message format: <uid>|<payload>
+    Expected message format: REQUEST frames tagged with a request id.
+    Requests flagged FLAG_STREAM are answered with CHUNK frames and a final END frame.
     """
     addr = writer.get_extra_info('peername')
     if SERVER_LOGS:
-        print(f"Server on port {port} accepted connection on port {addr[1]}")
+        logger.info("Server on port %s accepted connection on port %s", port, addr[1])
         
+    tasks = set()
     try: 
-        while True:
-            data = await reader.read(MAX_DATA_SIZE)
-            if not data:
-                break
-            
-            data = data.decode().strip()
-            
-            print(f"Server on port {port} received from port {addr[1]}: {data}")
-
-            request_id, request_payload = data.split('|', 1)
+        async for frame in FrameReader(reader):
+            if frame.msg_type != MessageType.REQUEST:
+                continue
+            request_id = frame.request_id
+            request_payload = frame.text()
             
             if SERVER_LOGS:
-                print(f"Server on port {port} received from port {addr[1]}: {data}")
-                print(f"LLM receiving: {request_payload}")
-            
-            # Process the data (e.g., convert to uppercase)
-            response_payload = get_llm_response(str(request_payload))
-            
-            # adding the request ID
-            data = f"{request_id}|{response_payload}"
+                logger.debug("Server on port %s received %s from port %s", port, format_request_id(request_id), addr[1])
+                logger.debug("LLM receiving: %s", request_payload)
             
-            if SERVER_LOGS:
-                print(f"LLM Response: {response_payload}")
-                print(f"Server on port {port} sending back data to port {addr[1]}: {data}")
-
-            writer.write(data.encode())
-            await writer.drain()
+            if frame.flags & FLAG_STREAM:
+                task = asyncio.create_task(respond_stream(writer, port, addr, scheduler, request_id, request_payload))
+            else:
+                task = asyncio.create_task(respond(writer, port, addr, scheduler, request_id, request_payload))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
     except Exception as e:
         if SERVER_LOGS:
-            print(f"Error with client {addr}: {e}")
+            logger.warning("Error with client %s: %s", addr, e)
     finally:
+        for task in tasks:
+            task.cancel()
         if SERVER_LOGS:
-            print(f"Server on port {port} closed connection with {addr[1]}")
+            logger.info("Server on port %s closed connection with %s", port, addr[1])
         writer.close()
         await writer.wait_closed()
 
+async def respond(writer, port, addr, scheduler, request_id, request_payload):
+    """Waits for the scheduler to generate a response and sends it back tagged with its request ID."""
+    received_at = time.perf_counter()
+    requests_in_flight.inc()
+    try:
+        response_payload = await scheduler.submit(request_id, request_payload)
+    except Exception as e:
+        if SERVER_LOGS:
+            logger.warning("Error generating response for %s: %s", format_request_id(request_id), e)
+        requests_total.inc(mode="batch", outcome="error")
+        write_frame(writer, MessageType.ERROR, request_id, str(e))
+        await writer.drain()
+        return
+    finally:
+        requests_in_flight.dec()
+    
+    if SERVER_LOGS:
+        logger.debug("LLM Response: %s", response_payload)
+        logger.debug("Server on port %s sending back %s to port %s", port, format_request_id(request_id), addr[1])
+
+    write_frame(writer, MessageType.RESPONSE, request_id, response_payload)
+    await writer.drain()
+    requests_total.inc(mode="batch", outcome="ok")
+    request_seconds.observe(time.perf_counter() - received_at, mode="batch")
+
+async def respond_stream(writer, port, addr, scheduler, request_id, request_payload):
+    """Sends each piece of the response as a CHUNK frame as soon as it is generated, then an END frame."""
+    received_at = time.perf_counter()
+    requests_in_flight.inc()
+    try:
+        async for piece in scheduler.submit_stream(format_request_id(request_id), request_payload):
+            write_frame(writer, MessageType.CHUNK, request_id, piece)
+            await writer.drain()
+    except Exception as e:
+        if SERVER_LOGS:
+            logger.warning("Error streaming response for %s: %s", format_request_id(request_id), e)
+        requests_total.inc(mode="stream", outcome="error")
+        write_frame(writer, MessageType.ERROR, request_id, str(e))
+        await writer.drain()
+        return
+    finally:
+        requests_in_flight.dec()
+
+    if SERVER_LOGS:
+        logger.debug("Server on port %s finished streaming %s to port %s", port, format_request_id(request_id), addr[1])
+
+    write_frame(writer, MessageType.END, request_id)
+    await writer.drain()
+    requests_total.inc(mode="stream", outcome="ok")
+    request_seconds.observe(time.perf_counter() - received_at, mode="stream")
+
+def load_generator(stub):
+    """Imports and loads the LLM, or the stub backend, and returns its generation functions.
+
+    Runs on a worker thread while the server registers with the load balancer, so
+    the import and model load do not hold up startup. With SERVER_WORKERS above 1
+    the model is loaded by the GenerationWorkerPool's loader process instead of
+    here, and the functions returned hand the work to its workers.
+
+    Returns:
+        (generate_batch, generate_stream, workers), with workers None unless
+        SERVER_WORKERS is above 1.
+    """
+    if stub:
+        import stub_llm as llm
+    else:
+        import llm_module as llm
+    if SERVER_WORKERS > 1:
+        workers = GenerationWorkerPool(llm.get_llm_responses, llm.stream_llm_response, SERVER_WORKERS,
+                                       llm.load_model, llm.configure_worker, llm.configure_loader)
+        return workers.generate_batch, workers.generate_stream, workers
+    if not stub:
+        register_prefix_cache_metrics(llm.prefix_cache)
+    llm.load_model()
+    return llm.get_llm_responses, llm.stream_llm_response, None
+
+def register_prefix_cache_metrics(prefix_cache):
+    """Exposes the model's prefix (KV) cache counters, read at scrape time."""
+    metrics.counter("server_prefix_cache_hits_total", "Prompts that resumed from a cached prefix").set_function(
+        lambda: prefix_cache.stats()["hits"])
+    metrics.counter("server_prefix_cache_misses_total", "Prompts with no cached prefix").set_function(
+        lambda: prefix_cache.stats()["misses"])
+    metrics.counter("server_prefix_cache_hit_tokens_total", "Prompt tokens whose prefill was skipped").set_function(
+        lambda: prefix_cache.stats()["hit_tokens"])
+    metrics.gauge("server_prefix_cache_bytes", "Bytes of past key values held by the prefix cache").set_function(
+        lambda: prefix_cache.stats()["bytes"])
+
 async def server_program():
     """
     Creates the server and starts listening for incoming connections.
     
     Args:
-        From command line: port number to connect to.
+        From command line: port number to connect to, and optionally --stub to
+        answer with the model-free stub backend instead of GPT-2.
+        From the environment: SERVER_WORKERS, the number of generation processes
+        to fork from the loaded model.
     """
-    if(len(sys.argv) != 2):
-        print("Usage: python server.py <port_number>")
+    if len(sys.argv) not in (2, 3) or (len(sys.argv) == 3 and sys.argv[2] != "--stub"):
+        print("Usage: python server.py <port_number> [--stub]")
         sys.exit(1)
 
     port = int(sys.argv[1])
+    if SERVER_WORKERS > 1 and os.environ["LLM_DEVICE"] != "cpu":
+        logger.error("SERVER_WORKERS needs the model on the CPU, not %s", os.environ["LLM_DEVICE"])
+        sys.exit(1)
+    # the model loads in the background while the server registers as warming and
+    # answers health checks; the load balancer routes to it once it sends READY
+    loading = asyncio.get_running_loop().run_in_executor(None, load_generator, len(sys.argv) == 3)
     
-    print(f"Server on port {port} connecting to the load balancer")
-    load_balancer_reader, load_balancer_writer = await connect_to_load_balancer(LB_HOST, LB_PORT, port)
+    logger.info("Server on port %s connecting to the load balancer", port)
+    load_balancer_frames, load_balancer_writer = await connect_to_load_balancer(LB_HOST, LB_PORT, port, warming=True, workers=SERVER_WORKERS)
+    background = [
+        asyncio.create_task(heartbeat(load_balancer_writer)),
+        asyncio.create_task(answer_health_checks(load_balancer_frames, load_balancer_writer)),
+        asyncio.create_task(serve_metrics(metrics, SERVER_HOST, port + METRICS_PORT_OFFSET)),
+    ]
+    try:
+        get_llm_responses, stream_llm_response, workers = await loading
+    except Exception as e:
+        logger.error("Server on port %s failed to load the model: %s", port, e)
+        sys.exit(1)
 
-    print(f"Server on port {port} serving clients")
+    scheduler = GenerationScheduler(
+        get_llm_responses,
+        stream_llm_response,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_queue_delay_ms=MAX_QUEUE_DELAY_MS,
+        SCHEDULER_LOGS=SERVER_LOGS,
+        metrics=metrics,
+        max_concurrent_batches=SERVER_WORKERS,
+        max_concurrent_streams=MAX_CONCURRENT_STREAMS,
+    )
+
+    logger.info("Server on port %s serving clients", port)
     server = await asyncio.start_server(
-        lambda r, w: handle_client(r, w, port), 
+        lambda r, w: handle_client(r, w, port, scheduler), 
         SERVER_HOST, 
         port)
     
     if SERVER_LOGS:
-        print(f"Server on port {port} running on {SERVER_HOST}")
+        logger.info("Server on port %s running on %s", port, SERVER_HOST)
+
+    write_frame(load_balancer_writer, MessageType.READY)
+    await load_balancer_writer.drain()
+    logger.info("Server on port %s ready; clients may now connect", port)
     
     try:
         async with server:
             await asyncio.gather(
                 server.serve_forever(),
-                heartbeat(load_balancer_writer),
+                scheduler.run(),
+                *background,
             )
     except asyncio.CancelledError:
+        scheduler.close()
+        if workers is not None:
+            workers.close()
         if SERVER_LOGS:
-            print(f"Server on port {port} shutting down.")
+            logger.info("Server on port %s shutting down.", port)
 
 if __name__ == '__main__':
+    configure_logging()
     try:
         asyncio.run(server_program())
     except KeyboardInterrupt:  
         if SERVER_LOGS:
-            print("\nInterrupted by user.")
\ No newline at end of file
+            logger.info("Interrupted by user.")
\ No newline at end of file
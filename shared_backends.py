@@ -0,0 +1,89 @@
+import multiprocessing
+import time
+
+import numpy as np
+
+MAX_HOST_LENGTH = 64
+
+class SharedBackendTable:
+    """Backend registry and per-worker load shared by the workers of a multi-process load balancer.
+
+    The table lives in anonymous shared memory created before the workers are
+    forked, so every worker maps the same pages. Each row is one registered
+    backend. Registering and unregistering take a process-shared lock and bump
+    `version`, which workers poll to notice membership changes. Load counts are
+    kept per (backend, worker) and each worker only ever writes its own column,
+    so publishing load needs no lock.
+    """
+    def __init__(self, num_workers, max_backends=64):
+        self.num_workers = num_workers
+        self.max_backends = max_backends
+        self.lock = multiprocessing.Lock()
+        self.version = multiprocessing.RawValue('q', 0)
+
+        self.hosts = self.shared((max_backends,), f'S{MAX_HOST_LENGTH}')
+        self.ports = self.shared((max_backends,), np.int32) # 0 marks a free row
+        self.capacities = self.shared((max_backends,), np.int32) # generation workers behind each backend
+        self.heartbeats = self.shared((max_backends,), np.float64) # wall-clock time of the last heartbeat
+        self.connections = self.shared((max_backends, num_workers), np.int64)
+        self.tokens = self.shared((max_backends, num_workers), np.int64)
+
+    @staticmethod
+    def shared(shape, dtype):
+        dtype = np.dtype(dtype)
+        buffer = multiprocessing.RawArray('b', int(np.prod(shape)) * dtype.itemsize)
+        return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+    def register(self, host, port, capacity=1):
+        """Adds a backend, or refreshes it if it is already registered.
+
+        Returns:
+            The backend's row.
+        """
+        encoded = host.encode()[:MAX_HOST_LENGTH]
+        with self.lock:
+            row = self.find(encoded, port)
+            if row is None:
+                free = np.flatnonzero(self.ports == 0)
+                if len(free) == 0:
+                    raise RuntimeError(f"shared backend table is full ({self.max_backends} backends)")
+                row = int(free[0])
+                self.connections[row] = 0
+                self.tokens[row] = 0
+                self.hosts[row] = encoded
+                self.capacities[row] = capacity
+                self.ports[row] = port
+                self.version.value += 1
+            self.heartbeats[row] = time.time()
+            return row
+
+    def unregister(self, host, port):
+        with self.lock:
+            row = self.find(host.encode()[:MAX_HOST_LENGTH], port)
+            if row is not None:
+                self.ports[row] = 0
+                self.version.value += 1
+
+    def find(self, encoded_host, port):
+        rows = np.flatnonzero((self.ports == port) & (self.hosts == encoded_host))
+        return int(rows[0]) if len(rows) else None
+
+    def backends(self):
+        """Returns the registered backends as a dict of (host, port) -> row."""
+        with self.lock:
+            rows = np.flatnonzero(self.ports != 0)
+            return {(self.hosts[row].decode(), int(self.ports[row])): int(row) for row in rows}
+
+    def heartbeat(self, row):
+        self.heartbeats[row] = time.time()
+
+    def publish(self, worker, row, connections, tokens):
+        """Records how many requests and tokens this worker has in flight on a backend."""
+        self.connections[row, worker] = connections
+        self.tokens[row, worker] = tokens
+
+    def remote_load(self, worker):
+        """Returns the (connections, tokens) that all other workers have on each row."""
+        connections = self.connections.sum(axis=1) - self.connections[:, worker]
+        tokens = self.tokens.sum(axis=1) - self.tokens[:, worker]
+        return connections, tokens
@@ -0,0 +1,60 @@
+"""Drop-in stand-in for llm_module that needs no model, for benchmarks and CPU-only boxes.
+
+Responses are deterministic for a given prompt, and generating one takes
+PREFILL_SECONDS plus SECONDS_PER_TOKEN for every token produced, so runs are
+reproducible and a backend's service time scales with output length the way a
+real decoder's does. Start a server with `python server.py <port> --stub` to use it.
+"""
+import hashlib
+import random
+import time
+
+PREFILL_SECONDS = 0.01
+SECONDS_PER_TOKEN = 0.004
+MIN_RESPONSE_TOKENS = 10
+MAX_RESPONSE_TOKENS = 50
+
+VOCABULARY = (
+    "the a once upon time there was king queen dragon castle forest river village "
+    "who lived far away and one day found an old map that led to hidden treasure "
+    "but danger waited in dark mountains so brave friends set out together"
+).split()
+
+def stub_tokens(prompt):
+    """Returns the tokens of the deterministic response to a prompt."""
+    seed = int.from_bytes(hashlib.blake2b(prompt.encode(), digest_size=8).digest(), 'little')
+    rng = random.Random(seed)
+    length = rng.randint(MIN_RESPONSE_TOKENS, MAX_RESPONSE_TOKENS)
+    return [rng.choice(VOCABULARY) for _ in range(length)]
+
+# the stub only sleeps, so it never needs anything but the CPU
+device = 'cpu'
+
+def load_model():
+    """Nothing to load; the stub is ready as soon as it is imported."""
+    pass
+
+def configure_loader(num_workers):
+    """Nothing to configure; see llm_module.configure_loader."""
+    pass
+
+def configure_worker(num_workers):
+    """Nothing to configure; see llm_module.configure_worker."""
+    pass
+
+def get_llm_response(prompt):
+    return get_llm_responses([prompt])[0]
+
+def get_llm_responses(prompts):
+    """Generates a batch; like a real decoder, the batch runs until its longest response is done."""
+    responses = [stub_tokens(prompt) for prompt in prompts]
+    time.sleep(PREFILL_SECONDS + SECONDS_PER_TOKEN * max(len(tokens) for tokens in responses))
+    return [prompt + " " + " ".join(tokens) for prompt, tokens in zip(prompts, responses)]
+
+def stream_llm_response(prompt):
+    """Yields the response one token at a time, sleeping SECONDS_PER_TOKEN per token."""
+    time.sleep(PREFILL_SECONDS)
+    yield prompt
+    for token in stub_tokens(prompt):
+        time.sleep(SECONDS_PER_TOKEN)
+        yield " " + token
@@ -0,0 +1,141 @@
+import asyncio
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+# the modules live at the top of the repository, next to load_balancer.py and server.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from framing import FrameReader, MessageType, write_frame, new_request_id, FLAG_CACHE_HIT
+from lb_algorithms.consistent_hash import ConsistentHash
+from lb_algorithms.least_connections import LeastConnections
+from lb_algorithms.least_outstanding_tokens import LeastOutstandingTokens
+from lb_algorithms.peak_ewma import PeakEWMA
+from lb_algorithms.power_of_two_choices import PowerOfTwoChoices
+from lb_algorithms.round_robin import RoundRobin
+
+# every routing algorithm, for the tests that hold for all of them
+ALGORITHMS = [RoundRobin, LeastConnections, LeastOutstandingTokens, PowerOfTwoChoices, PeakEWMA, ConsistentHash]
+
+STARTUP_TIMEOUT = 30 # seconds
+
+def free_port(offset=0):
+    """Returns a free port whose neighbour `offset` above is free too, for the servers' metrics."""
+    while True:
+        with socket.socket() as probe:
+            probe.bind(("localhost", 0))
+            port = probe.getsockname()[1]
+        if port + offset > 65535:
+            continue
+        with socket.socket() as probe:
+            try:
+                probe.bind(("localhost", port + offset))
+            except OSError:
+                continue
+        return port
+
+def backends_ready(metrics_port, ports):
+    try:
+        with urllib.request.urlopen(f"http://localhost:{metrics_port}/metrics", timeout=1) as response:
+            body = response.read().decode()
+    except OSError:
+        return False
+    return all(f'lb_backend_admission_share{{backend="localhost:{port}"}}' in body for port in ports)
+
+@contextlib.contextmanager
+def run_cluster(logs, algorithm="-c", servers=2, lb_port=None, **env):
+    """Runs a load balancer and `servers` stub servers as processes until the block exits.
+
+    The load balancer embeds prompts with the HashingEmbedder (EMBEDDER=hashing) and
+    the servers answer with stub_llm, so nothing is downloaded. Extra keyword
+    arguments are set in the processes' environment.
+
+    Yields:
+        The load balancer's port.
+    """
+    lb_port, metrics_port = lb_port or free_port(), free_port()
+    server_ports = [free_port(offset=10000) for _ in range(servers)]
+    env = {**os.environ, "EMBEDDER": "hashing", "LB_PORT": str(lb_port), "LB_METRICS_PORT": str(metrics_port),
+           "LOG_LEVEL": "INFO", "PYTHONUNBUFFERED": "1", **env}
+    processes = []
+    try:
+        with open(logs / f"lb-{lb_port}.log", "w") as log:
+            processes.append(subprocess.Popen([sys.executable, "load_balancer.py", algorithm], cwd=ROOT, env=env,
+                                              stdout=log, stderr=subprocess.STDOUT))
+        for port in server_ports:
+            with open(logs / f"server-{port}.log", "w") as log:
+                processes.append(subprocess.Popen([sys.executable, "server.py", str(port), "--stub"], cwd=ROOT, env=env,
+                                                  stdout=log, stderr=subprocess.STDOUT))
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not backends_ready(metrics_port, server_ports):
+            if time.monotonic() > deadline or any(process.poll() is not None for process in processes):
+                pytest.fail(f"load balancer and servers did not start; logs are in {logs}")
+            time.sleep(0.1)
+        yield lb_port
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+@pytest.fixture(scope="module")
+def load_balancer(tmp_path_factory):
+    """A load balancer with two stub servers, shared by the tests of a module."""
+    with run_cluster(tmp_path_factory.mktemp("logs")) as port:
+        yield port
+
+@pytest.fixture
+def make_load_balancer(monkeypatch):
+    """Builds in-process LoadBalancers with the given algorithm flag and the HashingEmbedder, nothing started."""
+    import load_balancer
+    balancers = []
+
+    def make(algorithm="-c"):
+        monkeypatch.setenv("EMBEDDER", "hashing")
+        monkeypatch.setattr(sys, "argv", ["load_balancer.py", algorithm])
+        balancers.append(load_balancer.LoadBalancer())
+        return balancers[-1]
+
+    yield make
+    for lb in balancers:
+        lb.semantic_cache.close()
+
+async def request(port, prompt, flags=0):
+    """Sends one request and returns (message type, flags, text) of its response."""
+    reader, writer = await asyncio.open_connection("localhost", port)
+    frames = FrameReader(reader)
+    try:
+        write_frame(writer, MessageType.HELLO)
+        request_id = new_request_id()
+        write_frame(writer, MessageType.REQUEST, request_id, prompt, flags)
+        await writer.drain()
+        pieces = []
+        async for frame in frames:
+            if frame.request_id != request_id:
+                continue
+            if frame.msg_type == MessageType.CHUNK:
+                pieces.append(frame.text())
+                continue
+            if frame.msg_type == MessageType.END:
+                return frame.msg_type, frame.flags, "".join(pieces)
+            return frame.msg_type, frame.flags, frame.text()
+        raise ConnectionError("the load balancer closed the connection")
+    finally:
+        writer.close()
+
+async def request_until_cached(port, prompt, timeout=5):
+    """Repeats a request until the cache answers it; responses are cached in the background."""
+    deadline = time.monotonic() + timeout
+    while True:
+        msg_type, flags, text = await request(port, prompt)
+        if flags & FLAG_CACHE_HIT or time.monotonic() > deadline:
+            return msg_type, flags, text
+        await asyncio.sleep(0.05)
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from admission_queue import AdmissionQueue
+from framing import MessageType
+from pending_request import PendingRequest
+from conftest import ALGORITHMS
+
+def test_waiters_are_woken_in_arrival_order():
+    async def scenario():
+        queue = AdmissionQueue(max_size=3)
+        woken = []
+
+        async def waiter(name, front=False):
+            if await queue.wait(1, front):
+                woken.append(name)
+
+        tasks = [asyncio.create_task(waiter(name)) for name in ("first", "second")]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(waiter("requeued", front=True)))
+        await asyncio.sleep(0)
+        assert len(queue) == 3 and queue.is_full()
+        queue.wake(2)
+        await asyncio.sleep(0.01)
+        assert woken == ["requeued", "first"]
+        queue.wake(5)
+        await asyncio.gather(*tasks)
+        return woken, len(queue)
+
+    assert asyncio.run(scenario()) == (["requeued", "first", "second"], 0)
+
+def test_timed_out_waiters_leave_the_queue():
+    async def scenario():
+        queue = AdmissionQueue()
+        woken = await queue.wait(0.01)
+        return woken, len(queue)
+
+    assert asyncio.run(scenario()) == (False, 0)
+
+def test_queued_request_gets_the_next_free_slot(make_load_balancer):
+    lb = make_load_balancer()
+    lb.LB_algorithm.max_in_flight = 1
+    lb.add_backend("localhost", 1235)
+
+    async def scenario():
+        held = await lb.reserve_server(1)
+        queued = asyncio.create_task(lb.reserve_server(1))
+        await asyncio.sleep(0.01)
+        assert not queued.done() and len(lb.admission_queue) == 1
+        lb.LB_algorithm.release(held)
+        lb.wake_queued_requests()
+        return held, await asyncio.wait_for(queued, 1)
+
+    held, queued = asyncio.run(scenario())
+    assert queued is held and held.connection_count == 1
+
+def shed(lb):
+    """Dispatches a request to backends that are all full and returns the frames its client got."""
+    frames = []
+    lb.deliver = lambda pending, frame, response_text=None: frames.append((frame.msg_type, frame.text()))
+    asyncio.run(lb.dispatch(PendingRequest(None, "a prompt", memoryview(b"a prompt"))))
+    return frames
+
+def test_full_queue_sheds_with_overload(make_load_balancer):
+    lb = make_load_balancer()
+    lb.LB_algorithm.max_in_flight = 1
+    lb.add_backend("localhost", 1235)
+    lb.LB_algorithm.get_available_server()
+    lb.admission_queue.max_size = 0
+    assert shed(lb) == [(MessageType.OVERLOAD, "All backends are busy, try again later")]
+
+def test_long_expected_wait_sheds_with_overload(make_load_balancer):
+    lb = make_load_balancer()
+    lb.LB_algorithm.max_in_flight = 1
+    lb.add_backend("localhost", 1235)
+    lb.LB_algorithm.get_available_server()
+    # each request takes so long that even the first one queued would wait too long
+    lb.DEFAULT_SERVICE_TIME = lb.MAX_QUEUE_WAIT * lb.MAX_IN_FLIGHT_PER_BACKEND * 2
+    assert [msg_type for msg_type, _ in shed(lb)] == [MessageType.OVERLOAD]
+    assert not lb.admission_queue
+
+def test_queue_wait_timeout_sheds_with_overload(make_load_balancer):
+    lb = make_load_balancer()
+    lb.LB_algorithm.max_in_flight = 1
+    lb.add_backend("localhost", 1235)
+    lb.LB_algorithm.get_available_server()
+    lb.MAX_QUEUE_WAIT = 0.05
+    lb.DEFAULT_SERVICE_TIME = 0.001
+    assert [msg_type for msg_type, _ in shed(lb)] == [MessageType.OVERLOAD]
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+def test_requests_spread_and_release(algorithm):
+    lb = algorithm()
+    lb.max_in_flight = 2
+    servers = [lb.add_server("localhost", port) for port in (1235, 1236, 1237)]
+    chosen = [lb.get_available_server(key=f"prompt {i}") for i in range(6)]
+    assert sorted(server.port for server in chosen) == [1235, 1235, 1236, 1236, 1237, 1237]
+    assert lb.get_available_server(key="one too many") is None
+    for server in chosen:
+        lb.release(server)
+    assert [server.connection_count for server in servers] == [0, 0, 0]
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from async_semantic_cache import AsyncSemanticCache
+from embedders import HashingEmbedder
+from semantic_cache import SemanticCache
+
+PROMPT = "Tell me a story about a dragon who guards a library"
+RESPONSE = "Once there was a dragon who read every book it guarded."
+
+def make_cache(max_pending=64):
+    cache = SemanticCache(embedder=HashingEmbedder(), CACHE_LOGS=False, max_cache_size=64)
+    return AsyncSemanticCache(cache, max_pending=max_pending, CACHE_LOGS=False)
+
+def test_async_cache():
+    async def scenario():
+        cache = make_cache()
+        try:
+            assert await cache.get(PROMPT) is None
+            await cache.add(PROMPT, RESPONSE)
+            hits = await asyncio.gather(*(cache.get(PROMPT + suffix) for suffix in ("", "?", "!", " ")))
+            return hits, await cache.get("An unrelated question about taxes")
+        finally:
+            cache.close()
+
+    hits, miss = asyncio.run(scenario())
+    assert hits == [RESPONSE] * 4
+    assert miss is None
+
+def test_saturated_cache_only_answers_exact_hits():
+    async def scenario():
+        cache = make_cache(max_pending=0)
+        try:
+            cache.cache.add(PROMPT, RESPONSE)
+            exact = await cache.get_with_embedding(PROMPT)
+            semantic = await cache.get_with_embedding(PROMPT + "?")
+            await cache.add("another prompt", "dropped")
+            return exact, semantic, len(cache.cache)
+        finally:
+            cache.close()
+
+    exact, semantic, size = asyncio.run(scenario())
+    assert exact == (RESPONSE, None)
+    assert semantic == (None, None) # shed rather than queued
+    assert size == 1
+
+def test_async_similarity_is_shed_when_saturated():
+    async def scenario(max_pending):
+        cache = make_cache(max_pending)
+        try:
+            return await cache.similarity(PROMPT, PROMPT + "?"), cache.pending
+        finally:
+            cache.close()
+
+    similarity, pending = asyncio.run(scenario(max_pending=64))
+    assert similarity == pytest.approx(1.0) and pending == 0
+    assert asyncio.run(scenario(max_pending=0)) == (None, 0)
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from embedders import HashingEmbedder
+from semantic_cache import SemanticCache
+
+PROMPT = "Tell me a story about a dragon who guards a library"
+RESPONSE = "Once there was a dragon who read every book it guarded."
+
+def make_cache(**options):
+    return SemanticCache(embedder=HashingEmbedder(), CACHE_LOGS=False, **options)
+
+@pytest.mark.parametrize("index", ["flat", "ivf", "quantized"])
+def test_snapshot_round_trip(tmp_path, index):
+    cache = make_cache(index=index, max_cache_size=64, snapshot_dir=str(tmp_path))
+    cache.add(PROMPT, RESPONSE)
+    cache.insert(None, "exact only", "a prompt not embedded yet")
+    cache.save_snapshot()
+
+    restored = make_cache(index=index, max_cache_size=64, snapshot_dir=str(tmp_path))
+    assert restored.get(PROMPT + "?") == RESPONSE
+    assert restored.get_exact(PROMPT.lower()) == RESPONSE
+    # entries still waiting for their embedding go out with the next snapshot
+    assert restored.get_exact("a prompt not embedded yet") is None
+
+def test_warm_start_keeps_most_recently_used(tmp_path):
+    cache = make_cache(max_cache_size=8, snapshot_dir=str(tmp_path))
+    for i in range(4):
+        cache.add(f"prompt number {i}", f"response {i}")
+    cache.get_exact("prompt number 0") # now the most recently used
+    cache.save_snapshot()
+
+    restored = make_cache(max_cache_size=2, snapshot_dir=str(tmp_path))
+    assert len(restored) == 2
+    assert restored.get_exact("prompt number 0") == "response 0"
+    assert restored.get_exact("prompt number 3") == "response 3"
+    assert restored.get_exact("prompt number 1") is None
+
+def test_only_new_values_are_appended(tmp_path):
+    cache = make_cache(max_cache_size=64, snapshot_dir=str(tmp_path))
+    cache.add(PROMPT, RESPONSE)
+    cache.save_snapshot()
+    log_size = os.path.getsize(tmp_path / "values.log")
+    cache.save_snapshot()
+    assert os.path.getsize(tmp_path / "values.log") == log_size
+
+    cache.add(PROMPT, "a newer response")
+    cache.save_snapshot()
+    assert os.path.getsize(tmp_path / "values.log") > log_size
+    restored = make_cache(max_cache_size=64, snapshot_dir=str(tmp_path))
+    # values stay in the log until their entry is first hit
+    assert restored.values[0] is None
+    assert restored.get_exact(PROMPT) == "a newer response"
+    assert restored.values[0] == "a newer response"
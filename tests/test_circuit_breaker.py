@@ -0,0 +1,47 @@
+import pytest
+
+from lb_algorithms.circuit_breaker import CircuitBreaker
+from conftest import ALGORITHMS
+
+def test_open_period_doubles_on_consecutive_trips():
+    breaker = CircuitBreaker(open_seconds=1.0, max_open_seconds=3.0)
+    assert breaker.trip(now=0) and not breaker.trip(now=0.5)
+    assert breaker.share(now=0.5) == 0.0
+    assert not breaker.recover(now=0.5) and breaker.recover(now=1.0)
+    breaker.trip(now=2.0)
+    assert not breaker.recover(now=3.5) and breaker.recover(now=4.0)
+    breaker.trip(now=5.0)
+    assert not breaker.recover(now=7.5) and breaker.recover(now=8.0) # capped at max_open_seconds
+
+def test_slow_start_ramps_share_up():
+    breaker = CircuitBreaker(slow_start_seconds=10.0, min_share=0.1)
+    breaker.start_slow_start(now=0)
+    assert breaker.share(now=0) == 0.1
+    assert breaker.share(now=5) == 0.55
+    assert breaker.share(now=10) == 1.0
+
+def test_share_is_pure_and_tick_ends_slow_start():
+    breaker = CircuitBreaker(open_seconds=1.0, slow_start_seconds=10.0)
+    breaker.trip(now=0)
+    breaker.recover(now=1)
+    assert breaker.share(now=20) == 1.0
+    assert breaker.slow_start_since == 1 and breaker.trips == 1
+    assert not breaker.tick(now=5)
+    assert breaker.tick(now=11) and not breaker.tick(now=12)
+    assert breaker.slow_start_since is None and breaker.trips == 0
+    # with the trips reset, the next open period is back to open_seconds
+    breaker.trip(now=20)
+    assert breaker.recover(now=21)
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+def test_ejected_server_gets_no_requests(algorithm):
+    lb = algorithm()
+    lb.max_in_flight = 4
+    ejected = lb.add_server("localhost", 1235)
+    healthy = lb.add_server("localhost", 1236)
+    ejected.breaker.trip()
+    lb.refresh(ejected)
+    chosen = [lb.get_available_server(key=f"prompt {i}") for i in range(4)]
+    assert chosen == [healthy] * 4
+    assert lb.get_available_server() is None
+    assert ejected.connection_count == 0
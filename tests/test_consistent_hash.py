@@ -0,0 +1,95 @@
+import asyncio
+import contextlib
+from collections import Counter
+
+from framing import MessageType, FLAG_CACHE_HIT
+from lb_algorithms.consistent_hash import ConsistentHash, HashRing
+from semantic_cache import normalize_prompt
+from conftest import free_port, run_cluster, request, request_until_cached
+
+KEYS = [f"prompt {i}" for i in range(2000)]
+
+def test_removing_a_node_only_moves_its_keys():
+    ring = HashRing()
+    for node in ("a", "b", "c", "d"):
+        ring.add(node)
+    before = {key: ring.lookup(key) for key in KEYS}
+    ring.remove("c")
+    after = {key: ring.lookup(key) for key in KEYS}
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved and all(before[key] == "c" for key in moved)
+    assert "c" not in after.values() and len(ring) == 3
+
+def test_weights_set_each_nodes_share():
+    ring = HashRing()
+    ring.add("single")
+    ring.add("double", weight=2)
+    shares = Counter(ring.lookup(key) for key in KEYS)
+    assert 1.5 < shares["double"] / shares["single"] < 2.7
+
+def test_walk_visits_every_node_once_from_the_owner():
+    ring = HashRing(vnodes=10)
+    assert list(ring.walk("key")) == [] and ring.lookup("key") is None
+    for node in ("a", "b", "c"):
+        ring.add(node)
+    walk = list(ring.walk("key"))
+    assert sorted(walk) == ["a", "b", "c"] and walk[0] == ring.lookup("key")
+
+def test_hot_key_spills_past_its_bounded_owner():
+    lb = ConsistentHash(load_factor=1.25)
+    for port in (1235, 1236, 1237):
+        lb.add_server("localhost", port)
+    owner = lb.get_server(key="a hot prompt")
+    chosen = [lb.get_server(key="a hot prompt") for _ in range(11)]
+    # the owner keeps taking the key until it holds 1.25 times the average
+    assert max(Counter(chosen + [owner]).values()) <= 5
+    assert chosen.count(owner) >= 2
+    assert lb.get_server() is min(lb.servers, key=lambda server: server.total_connections)
+
+def test_consistent_hash_keeps_load_totals():
+    lb = ConsistentHash()
+    servers = [lb.add_server("localhost", port, capacity) for port, capacity in ((1235, 1), (1236, 2), (1237, 1))]
+    held = [lb.get_server(key=f"prompt {i}") for i in range(10)]
+    lb.observe_remote_load(servers[0], 3, 30)
+    lb.release(held.pop())
+    lb.remove_server("localhost", 1237)
+    assert lb.in_flight == sum(server.total_connections for server in lb.servers)
+    assert lb.workers == 3
+    # a request that finishes after its server was removed no longer counts
+    for server in held:
+        lb.release(server)
+    assert lb.in_flight == servers[0].remote_connections
+
+def test_peers_share_one_sharded_cache(tmp_path):
+    ports = [free_port()]
+    while len(ports) < 2:
+        port = free_port()
+        if port not in ports:
+            ports.append(port)
+    peers = [f"localhost:{port}" for port in ports]
+    ring = HashRing()
+    for peer in peers:
+        ring.add(peer)
+    # one prompt from each load balancer's shard, keyed like LoadBalancer.prefix_key
+    prompts = {}
+    for i in range(100):
+        prompt = f"Write a short poem about the number {i}"
+        prompts.setdefault(ring.lookup(normalize_prompt(prompt)[:64]), prompt)
+    assert len(prompts) == 2
+
+    async def scenario():
+        asked = [await request(ports[0], prompt) for prompt in prompts.values()]
+        for prompt in prompts.values():
+            await request_until_cached(ports[0], prompt)
+        # without the shared shards the other load balancer would miss on its first try
+        cached = [await request(ports[1], prompt) for prompt in prompts.values()]
+        return asked, cached
+
+    with contextlib.ExitStack() as stack:
+        for port in ports:
+            stack.enter_context(run_cluster(tmp_path, lb_port=port, LB_CACHE_PEERS=",".join(peers)))
+        asked, cached = asyncio.run(scenario())
+
+    for (msg_type, flags, text), (_, cached_flags, cached_text) in zip(asked, cached):
+        assert msg_type == MessageType.RESPONSE and not flags & FLAG_CACHE_HIT
+        assert cached_flags & FLAG_CACHE_HIT and cached_text == text
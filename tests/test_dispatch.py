@@ -0,0 +1,94 @@
+"""Sends requests through LoadBalancer.dispatch with in-memory backend connections."""
+import asyncio
+
+from pending_request import PendingRequest
+
+class FakeConnection:
+    def __init__(self, host, port, fail):
+        self.host, self.port = host, port
+        self.fail = fail
+        self.writer = self
+        self.in_flight = 0
+        self.sent = []
+        self.closed = False
+
+    def send(self, msg_type, request_id, payload, flags=0):
+        self.sent.append(request_id)
+        self.in_flight += 1
+
+    async def drain(self):
+        if self.fail:
+            raise ConnectionResetError("connection reset by peer")
+
+    def close(self):
+        self.closed = True
+
+class FakePool:
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def acquire(self):
+        return self.connection
+
+def add_backends(lb, failing, ports=(1235, 1236)):
+    connections = {}
+    for port in ports:
+        lb.add_backend("localhost", port)
+        connections[port] = FakeConnection("localhost", port, port in failing)
+        lb.backend_pools[("localhost", port)] = FakePool(connections[port])
+    return connections
+
+def test_send_failure_retries_on_another_backend(make_load_balancer):
+    lb = make_load_balancer()
+    connections = add_backends(lb, failing=set())
+    # whichever backend is picked first fails while the request is written to it
+    first = lb.LB_algorithm.servers.peek().port
+    connections[first].fail = True
+    pending = PendingRequest(None, "a prompt", memoryview(b"a prompt"))
+    asyncio.run(lb.dispatch(pending))
+
+    failed, healthy = lb.backend_servers[("localhost", first)], pending.server
+    assert healthy is not failed and pending.attempts == 2
+    assert failed.breaker.is_open and failed.connection_count == 0
+    assert connections[first].closed
+    assert list(lb.pending_requests.values()) == [pending]
+    assert connections[healthy.port].sent == list(lb.pending_requests)
+
+def test_send_failure_on_every_backend_fails_the_request(make_load_balancer):
+    lb = make_load_balancer()
+    # one backend per attempt the request gets
+    ports = range(1235, 1235 + lb.MAX_ATTEMPTS)
+    add_backends(lb, failing=set(ports), ports=ports)
+    errors = []
+    lb.deliver = lambda pending, frame, response_text=None: errors.append(frame.text())
+    pending = PendingRequest(None, "a prompt", memoryview(b"a prompt"))
+    asyncio.run(lb.dispatch(pending))
+
+    assert errors == ["No backend server available"]
+    assert not lb.pending_requests
+    assert all(server.connection_count == 0 for server in lb.backend_servers.values())
+
+def test_lost_connection_retries_only_before_the_first_byte(make_load_balancer):
+    lb = make_load_balancer()
+    add_backends(lb, failing=set())
+    errors = []
+    lb.deliver = lambda pending, frame, response_text=None: errors.append(frame.text())
+
+    async def scenario():
+        untouched = PendingRequest(None, "a prompt", memoryview(b"a prompt"))
+        answering = PendingRequest(None, "another prompt", memoryview(b"another prompt"))
+        for pending in (untouched, answering):
+            await lb.dispatch(pending)
+        answering.first_byte_at = answering.sent_at
+        for request_id in list(lb.pending_requests):
+            lb.fail_request(request_id, "Backend connection lost")
+        await asyncio.gather(*lb.background_tasks)
+        return untouched
+
+    untouched = asyncio.run(scenario())
+    # the request that got nothing back yet is sent again; the other already has output
+    assert list(lb.pending_requests.values()) == [untouched]
+    assert untouched.attempts == 2 and lb.retries.get() == 1
+    assert errors == ["Backend connection lost"]
+    # only the retried request still holds a backend slot
+    assert sum(server.connection_count for server in lb.backend_servers.values()) == 1
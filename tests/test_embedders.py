@@ -0,0 +1,45 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from embedders import EmbeddingBatcher, HashingEmbedder, make_embedder, TransformerEmbedder
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def embed(self, texts):
+        self.batches.append(list(texts))
+        return super().embed(texts)
+
+def test_make_embedder():
+    assert isinstance(make_embedder("hashing"), HashingEmbedder)
+    # the transformer embedder loads its model lazily, so building one needs no download
+    assert isinstance(make_embedder("transformer"), TransformerEmbedder)
+    with pytest.raises(ValueError):
+        make_embedder("word2vec")
+
+def test_hashing_embedder_is_deterministic():
+    embedder = HashingEmbedder()
+    first, second, other = embedder.embed(["Once upon a time", "once upon a time!", "The dog barks"])
+    assert first.dtype == np.float32 and first.shape == (embedder.dim,)
+    np.testing.assert_array_equal(first, second)
+    assert not np.array_equal(first, other)
+
+def test_batcher_groups_concurrent_requests():
+    embedder = CountingEmbedder()
+    batcher = EmbeddingBatcher(embedder, max_batch_size=8, max_wait_ms=50)
+    prompts = [f"prompt number {i}" for i in range(8)]
+
+    async def embed_all():
+        return await asyncio.gather(*(batcher.embed(prompt) for prompt in prompts))
+
+    try:
+        embeddings = asyncio.run(embed_all())
+    finally:
+        batcher.close()
+    assert embedder.batches == [prompts]
+    for prompt, embedding in zip(prompts, embeddings):
+        np.testing.assert_array_equal(embedding, HashingEmbedder().embed([prompt])[0])
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from embedding_index import FlatIndex, IVFIndex, make_index, normalize
+
+DIM = 32
+
+def random_vectors(count, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32)
+
+def brute_force(vectors, slots, query):
+    scores = np.stack([normalize(vectors[slot]) for slot in slots]) @ normalize(query)
+    best = int(np.argmax(scores))
+    return slots[best], float(scores[best])
+
+# an IVF index that is trained after 64 vectors and probes every cell, so it is exact
+INDEXES = {
+    "flat": lambda: make_index("flat", DIM, None),
+    "ivf": lambda: make_index("ivf", DIM, None, nlist=4, nprobe=4, train_size=64),
+}
+
+@pytest.mark.parametrize("kind", INDEXES)
+def test_search_finds_the_most_similar_slot(kind):
+    index = INDEXES[kind]()
+    vectors = random_vectors(200)
+    for slot, vector in enumerate(vectors):
+        index.add(slot, vector)
+    for query in random_vectors(20, seed=1):
+        slot, similarity = index.search(query)
+        expected_slot, expected = brute_force(vectors, list(range(len(vectors))), query)
+        assert slot == expected_slot and similarity == pytest.approx(expected, abs=1e-5)
+
+@pytest.mark.parametrize("kind", INDEXES)
+def test_removed_slots_no_longer_match(kind):
+    index = INDEXES[kind]()
+    vectors = random_vectors(100)
+    for slot, vector in enumerate(vectors):
+        index.add(slot, vector)
+    for slot in range(0, 100, 2):
+        index.remove(slot)
+    assert index.size == 50
+    for slot in range(0, 100, 2):
+        found, _ = index.search(vectors[slot])
+        assert found % 2 == 1
+    assert index.search(vectors[1])[0] == 1
+
+@pytest.mark.parametrize("kind", INDEXES)
+def test_export_and_clear(kind):
+    index = INDEXES[kind]()
+    vectors = random_vectors(100)
+    for slot, vector in enumerate(vectors):
+        index.add(slot, vector)
+    slots = np.array([7, 3, 90])
+    np.testing.assert_allclose(index.export(slots), [normalize(vectors[slot]) for slot in slots], atol=1e-6)
+    index.clear()
+    assert index.size == 0 and index.search(vectors[0]) == (None, -1.0)
+
+def test_flat_index_grows_with_the_highest_slot():
+    index = FlatIndex(DIM, capacity=5000)
+    index.add(3, random_vectors(1)[0])
+    assert len(index.matrix) < 5000
+    index.add(4999, random_vectors(1)[0])
+    assert len(index.matrix) == 5000
+
+def test_flat_index_runs_on_a_given_matrix():
+    vectors = np.stack([normalize(vector) for vector in random_vectors(10)])
+    index = FlatIndex(DIM, None, matrix=vectors)
+    assert index.size == 10 and index.matrix is vectors
+    assert index.search(vectors[4])[0] == 4
+    index.add(10, random_vectors(1, seed=2)[0]) # past the given rows, so the matrix is copied
+    assert index.matrix is not vectors and index.search(vectors[4])[0] == 4
+
+def test_ivf_index_clusters_once_trained():
+    index = IVFIndex(DIM, None, nlist=4, nprobe=1, train_size=64)
+    vectors = random_vectors(64)
+    for slot, vector in enumerate(vectors[:63]):
+        index.add(slot, vector)
+    assert index.centroids is None
+    index.add(63, vectors[63])
+    assert len(index.cells) == 4 and sum(cell.count for cell in index.cells) == 64
+    # probing only the closest cell still finds a stored vector itself
+    assert all(index.search(vector)[0] == slot for slot, vector in enumerate(vectors))
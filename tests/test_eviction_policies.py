@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+import pytest
+
+import semantic_cache
+from embedders import HashingEmbedder
+from eviction_policies import GreedyDualPolicy, make_policy
+from semantic_cache import SemanticCache
+
+def make_cache(**options):
+    return SemanticCache(embedder=HashingEmbedder(), CACHE_LOGS=False, **options)
+
+def test_lru_eviction():
+    cache = make_cache(max_cache_size=2)
+    cache.add("the first prompt", "one")
+    cache.add("the second prompt", "two")
+    assert cache.get("the first prompt") == "one" # the second is now least recently used
+    cache.add("the third prompt", "three")
+
+    assert len(cache) == 2
+    assert cache.get_exact("the second prompt") is None
+    assert cache.get_exact("the first prompt") == "one"
+    assert cache.get_exact("the third prompt") == "three"
+
+def test_tinylfu_admits_only_more_popular_prompts():
+    cache = make_cache(max_cache_size=2, eviction_policy='tinylfu')
+    for prompt in ("the first prompt", "the second prompt"):
+        cache.add(prompt, prompt.upper())
+        for _ in range(3):
+            cache.get_exact(prompt)
+
+    cache.add("a one-off prompt", "once")
+    assert cache.get_exact("a one-off prompt") is None
+    assert cache.hit_stats()["rejected"] == 1
+
+    # asked for often enough, a new prompt outweighs the least recently used entry
+    for _ in range(5):
+        cache.get_exact("a popular new prompt")
+    cache.add("a popular new prompt", "popular")
+    assert cache.get_exact("a popular new prompt") == "popular"
+    assert cache.get_exact("the first prompt") is None
+    assert cache.get_exact("the second prompt") == "THE SECOND PROMPT"
+
+def test_greedydual_keeps_expensive_responses():
+    cache = make_cache(max_cache_size=2, eviction_policy='greedydual')
+    cache.add("a slow prompt", "slow", cost=10.0)
+    cache.add("a fast prompt", "fast", cost=0.1)
+    cache.add("another fast prompt", "fast too", cost=0.1)
+    assert cache.get_exact("a slow prompt") == "slow"
+    assert cache.get_exact("a fast prompt") is None
+
+def test_greedydual_ages_out_entries_that_are_not_hit():
+    policy = GreedyDualPolicy()
+    policy.insert(0, cost=4.0)
+    policy.insert(1, cost=1.0)
+    policy.remove(policy.victim())
+    assert policy.inflation == 1.0
+    # a newcomer that cost less than entry 0 still outranks it, since L has risen
+    policy.insert(2, cost=3.5)
+    assert policy.victim() == 0
+    policy.touch(0)
+    assert list(policy) == [2, 0]
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        make_policy('fifo', 8)
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache, "time", SimpleNamespace(time=lambda: now[0]))
+    cache = make_cache(max_cache_size=2, ttl=60)
+    cache.add("a stale prompt", "stale")
+    cache.insert(cache.semantic_key("a lasting prompt"), "lasting", "a lasting prompt", ttl=600)
+    now[0] += 61
+
+    assert cache.get_exact("a stale prompt") is None
+    assert cache.get("a stale prompt?") is None # the semantic tier evicts it
+    assert cache.hit_stats()["expired"] == 1 and len(cache) == 1
+    assert cache.get("a lasting prompt") == "lasting"
+
+def test_expired_entries_are_purged_before_live_ones_are_evicted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache, "time", SimpleNamespace(time=lambda: now[0]))
+    cache = make_cache(max_cache_size=2, ttl=60)
+    cache.insert(cache.semantic_key("the first prompt"), "one", "the first prompt", ttl=600)
+    cache.add("the second prompt", "two")
+    now[0] += 61
+    cache.add("the third prompt", "three")
+    # LRU alone would have evicted the first prompt
+    assert cache.get_exact("the first prompt") == "one"
+    assert cache.get_exact("the third prompt") == "three"
@@ -0,0 +1,53 @@
+import pytest
+
+from embedders import HashingEmbedder
+from semantic_cache import SemanticCache, exact_key
+
+PROMPT = "Tell me a story about a dragon who guards a library"
+RESPONSE = "Once there was a dragon who read every book it guarded."
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    def embed(self, texts):
+        self.texts.extend(texts)
+        return super().embed(texts)
+
+def make_cache(**options):
+    return SemanticCache(embedder=CountingEmbedder(), CACHE_LOGS=False, **options)
+
+def test_exact_key_normalizes_case_and_whitespace():
+    assert exact_key("Hello\t World ") == exact_key("hello world")
+    assert exact_key("hello world") != exact_key("hello world!")
+
+@pytest.mark.parametrize("index", ["flat", "ivf", "quantized"])
+def test_tiers(index):
+    cache = make_cache(index=index, max_cache_size=64)
+    cache.add(PROMPT, RESPONSE)
+
+    # case and whitespace normalize away, so the exact tier answers
+    assert cache.get("  tell me a STORY about a dragon who guards a library") == RESPONSE
+    # punctuation does not, but the prompt embeds the same, so the semantic tier does
+    assert cache.get(PROMPT + "?") == RESPONSE
+    assert cache.get("How do I sort a list in Python?") is None
+
+    stats = cache.hit_stats()
+    assert (stats["exact_hits"], stats["semantic_hits"], stats["misses"]) == (1, 1, 1)
+
+def test_exact_hits_skip_the_embedder():
+    cache = make_cache(max_cache_size=64)
+    cache.add(PROMPT, RESPONSE)
+    embedded = len(cache.embedder.texts)
+    assert cache.get(PROMPT.upper()) == RESPONSE
+    assert len(cache.embedder.texts) == embedded
+    assert cache.hit_stats()["embeddings_saved"] == 1
+
+def test_same_prompt_replaces_its_entry():
+    cache = make_cache(max_cache_size=64)
+    cache.add(PROMPT, RESPONSE)
+    cache.add(PROMPT.lower(), "a newer response")
+    assert len(cache) == 1
+    assert cache.get_exact(PROMPT) == "a newer response"
+    assert cache.get(PROMPT + "?") == "a newer response"
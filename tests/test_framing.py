@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from framing import (FrameReader, FrameError, MessageType, write_frame, encode_header, new_request_id,
+                     HEADER_SIZE, MAX_PAYLOAD_SIZE, FLAG_STREAM, FLAG_CACHE_HIT)
+from conftest import request
+
+class BufferWriter:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+def encode(*frames):
+    writer = BufferWriter()
+    for frame in frames:
+        write_frame(writer, *frame)
+    return bytes(writer.data)
+
+def read_all(data, piece_size=None, chunk_size=64 * 1024):
+    """Feeds `data` to a FrameReader, in pieces of `piece_size` bytes if given, and reads every frame."""
+    async def scenario():
+        stream = asyncio.StreamReader()
+        size = piece_size or max(1, len(data))
+        for start in range(0, len(data), size):
+            stream.feed_data(data[start:start + size])
+        stream.feed_eof()
+        return [(frame.msg_type, frame.request_id, frame.text(), frame.flags)
+                async for frame in FrameReader(stream, chunk_size=chunk_size)]
+    return asyncio.run(scenario())
+
+def test_payload_with_separators_round_trips():
+    request_id = new_request_id()
+    payload = "a|b||c|\n|héllo|"
+    assert read_all(encode((MessageType.REQUEST, request_id, payload, FLAG_STREAM))) == \
+        [(MessageType.REQUEST, request_id, payload, FLAG_STREAM)]
+
+@pytest.mark.parametrize("piece_size", [None, 1, 7, 1000])
+def test_pipelined_frames_split_anywhere(piece_size):
+    frames = [(MessageType.CHUNK, new_request_id(), f"piece {i} | " * i, i % 4) for i in range(50)]
+    frames.append((MessageType.END, frames[0][1], "", FLAG_CACHE_HIT))
+    assert read_all(encode(*frames), piece_size) == frames
+
+@pytest.mark.parametrize("size", [1025, 64 * 1024, 300 * 1024])
+def test_large_payloads(size):
+    payload = ("x|" * size)[:size]
+    frames = [(MessageType.RESPONSE, new_request_id(), payload, 0), (MessageType.PONG, new_request_id(), "", 0)]
+    # a small read chunk makes the reader fetch the rest of a big frame in one go
+    assert read_all(encode(*frames), piece_size=4096, chunk_size=256) == frames
+
+def test_clean_close_ends_the_stream():
+    assert read_all(b"") == []
+
+def test_truncated_frame_is_an_error():
+    data = encode((MessageType.RESPONSE, new_request_id(), "cut short", 0))
+    with pytest.raises(FrameError):
+        read_all(data[:-1])
+    with pytest.raises(FrameError):
+        read_all(data[:HEADER_SIZE - 1])
+
+def test_unknown_type_and_oversized_payload_are_errors():
+    with pytest.raises(FrameError):
+        read_all(encode_header(200, new_request_id(), 0))
+    with pytest.raises(FrameError):
+        read_all(bytes([0xff] * 4) + bytes(HEADER_SIZE - 4)) # a length past MAX_PAYLOAD_SIZE
+    with pytest.raises(FrameError):
+        encode_header(MessageType.REQUEST, new_request_id(), MAX_PAYLOAD_SIZE + 1)
+
+def test_long_prompt_with_separators_through_the_load_balancer(load_balancer):
+    prompt = "key|value " * 200 # 2000 bytes
+    msg_type, _, text = asyncio.run(request(load_balancer, prompt))
+    assert msg_type == MessageType.RESPONSE and text.startswith(prompt)
@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from lb_algorithms.indexed_heap import IndexedHeap
+from lb_algorithms.least_connections import LeastConnections
+from lb_algorithms.least_outstanding_tokens import LeastOutstandingTokens
+
+def test_indexed_heap_matches_sorting():
+    rng = random.Random(0)
+    heap, priorities = IndexedHeap(), {}
+    for step in range(500):
+        key = rng.randrange(20)
+        if key in heap and step % 3 == 0:
+            assert heap.remove(key) == f"item {key}"
+            del priorities[key]
+        elif key in heap:
+            priorities[key] = rng.random()
+            heap.update(key, priorities[key])
+        else:
+            priorities[key] = rng.random()
+            heap.push(key, f"item {key}", priorities[key])
+        if priorities:
+            assert heap.peek() == f"item {min(priorities, key=priorities.get)}"
+    assert len(heap) == len(priorities)
+
+def test_least_connections_weighs_workers():
+    lb = LeastConnections()
+    single = lb.add_server("localhost", 1235)
+    double = lb.add_server("localhost", 1236, capacity=2)
+    chosen = [lb.get_server() for _ in range(6)]
+    # the two-worker server takes two requests for each one the other takes
+    assert chosen.count(double) == 4 and chosen.count(single) == 2
+    lb.release(double)
+    lb.release(double)
+    assert lb.get_server() is double
+    lb.remove_server("localhost", 1236)
+    assert lb.get_server() is single
+
+def test_least_outstanding_tokens_follows_cost():
+    lb = LeastOutstandingTokens()
+    long = lb.add_server("localhost", 1235)
+    short = lb.add_server("localhost", 1236)
+    assert lb.get_server(cost=100) is long
+    # one long request outweighs several short ones
+    assert [lb.get_server(cost=10) for _ in range(5)] == [short] * 5
+    lb.release(long, cost=100)
+    assert lb.get_server(cost=10) is long
+
+@pytest.mark.parametrize("algorithm", [LeastConnections, LeastOutstandingTokens])
+def test_least_connections_sorts_ejected_server_last(algorithm):
+    lb = algorithm()
+    ejected = lb.add_server("localhost", 1235)
+    lb.add_server("localhost", 1236)
+    ejected.breaker.trip()
+    lb.refresh(ejected)
+    assert lb.servers.peek() is not ejected
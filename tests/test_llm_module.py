@@ -0,0 +1,73 @@
+"""Checks prefix-cache resumption and streaming against a tiny model.
+
+Runs a tiny randomly initialized GPT-2 with a character tokenizer, so nothing is
+downloaded; skipped where torch or transformers are not installed.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+llm_module = pytest.importorskip("llm_module")
+
+from prefix_cache import PrefixCache
+
+ALPHABET = "\0 abcdefghijklmnopqrstuvwxyz,.!?'"
+
+class CharTokenizer:
+    """One token per character; token 0 pads and ends sequences."""
+    pad_token_id = eos_token_id = 0
+
+    def __call__(self, text, truncation=True):
+        return {"input_ids": [ALPHABET.index(char) for char in text]}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(ALPHABET[int(i)] for i in ids if not (skip_special_tokens and int(i) == self.eos_token_id))
+
+@pytest.fixture
+def tiny_model(monkeypatch):
+    torch.manual_seed(0)
+    # large initial weights, so the next token depends on the whole context rather
+    # than mostly repeating the last one
+    config = transformers.GPT2Config(vocab_size=len(ALPHABET), n_positions=256, n_embd=32, n_layer=2, n_head=2,
+                                     initializer_range=1.0)
+    # float64 keeps the cached and uncached logits from tying differently on rounding alone
+    model = transformers.GPT2LMHeadModel(config).double().eval()
+    generate = model.generate
+    # greedy decoding, so both runs must pick the same tokens
+    monkeypatch.setattr(model, "generate", lambda **kwargs: generate(**{**kwargs, "do_sample": False}))
+    monkeypatch.setattr(llm_module, "generator", SimpleNamespace(tokenizer=CharTokenizer(), model=model))
+    monkeypatch.setattr(llm_module, "prefix_cache", PrefixCache(block_size=llm_module.PREFIX_BLOCK_TOKENS))
+    return model
+
+def test_cached_prefix_matches_full_prefill(tiny_model):
+    shared = "once upon a time, in a far land " # two blocks of 16 tokens
+    # different lengths, so the batches are laid out as [prefix][padding][rest]; the
+    # shorter prompt comes first, so the prefix cached is the one cut around its padding
+    prompts = [shared + "rain", shared + "a king"]
+
+    uncached = llm_module.generate(prompts)
+    assert len(llm_module.prefix_cache) == 1
+    hits = llm_module.prefix_cache.stats()["hits"]
+    cached = llm_module.generate(prompts)
+
+    assert llm_module.prefix_cache.stats()["hits"] == hits + len(prompts)
+    assert cached == uncached
+    assert all(len(response) > len(prompt) for prompt, response in zip(prompts, cached))
+
+def test_closing_a_stream_stops_its_generation(tiny_model, monkeypatch):
+    monkeypatch.setattr(llm_module, "MAX_RESPONSE", 200)
+    generated = []
+    generate = llm_module.generate
+    monkeypatch.setattr(llm_module, "generate", lambda *args, **kwargs: generated.append(generate(*args, **kwargs)))
+    prompt = "once upon a time "
+
+    full = "".join(llm_module.stream_llm_response(prompt))
+    stream = llm_module.stream_llm_response(prompt)
+    first = next(stream)
+    stream.close() # joins the generation thread
+
+    assert full.startswith(first)
+    assert len(generated) == 2
+    assert len(generated[1][0]) < len(generated[0][0])
@@ -0,0 +1,20 @@
+"""Talks to a load balancer and two stub servers, run as processes, over the framing protocol."""
+import asyncio
+
+from framing import MessageType, FLAG_CACHE_HIT
+from conftest import request, request_until_cached
+
+def test_miss_then_exact_and_semantic_hits(load_balancer):
+    async def scenario():
+        prompt = "Tell me a story about a lighthouse keeper"
+        first = await request(load_balancer, prompt)
+        exact = await request_until_cached(load_balancer, "tell me a story  about a LIGHTHOUSE keeper")
+        semantic = await request_until_cached(load_balancer, prompt + "?")
+        return prompt, first, exact, semantic
+
+    prompt, first, exact, semantic = asyncio.run(scenario())
+    msg_type, flags, text = first
+    assert msg_type == MessageType.RESPONSE and not flags & FLAG_CACHE_HIT
+    assert text.startswith(prompt)
+    assert exact == (MessageType.RESPONSE, exact[1], text) and exact[1] & FLAG_CACHE_HIT
+    assert semantic == (MessageType.RESPONSE, semantic[1], text) and semantic[1] & FLAG_CACHE_HIT
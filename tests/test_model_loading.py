@@ -0,0 +1,86 @@
+import asyncio
+import threading
+
+from async_semantic_cache import AsyncSemanticCache
+from embedders import HashingEmbedder
+from framing import FrameReader, MessageType, write_frame
+from semantic_cache import SemanticCache
+
+PROMPT = "Tell me a story about a dragon who guards a library"
+RESPONSE = "Once there was a dragon who read every book it guarded."
+
+class LoadingEmbedder(HashingEmbedder):
+    """A HashingEmbedder whose "model" is only ready once `loaded` is set; embed waits for it."""
+    def __init__(self):
+        super().__init__()
+        self.loaded = threading.Event()
+        self.calls = 0
+
+    def is_ready(self):
+        return self.loaded.is_set()
+
+    def embed(self, texts):
+        self.calls += 1
+        self.loaded.wait(5)
+        return super().embed(texts)
+
+def make_cache(**options):
+    return SemanticCache(embedder=HashingEmbedder(), CACHE_LOGS=False, **options)
+
+def test_entry_without_embedding_joins_semantic_tier_later():
+    cache = make_cache(max_cache_size=64)
+    cache.insert(None, RESPONSE, PROMPT)
+    assert cache.get_exact(PROMPT) == RESPONSE
+    assert cache.lookup(cache.semantic_key(PROMPT + "?")) is None
+
+    cache.add_embedding(PROMPT, cache.semantic_key(PROMPT))
+    assert cache.lookup(cache.semantic_key(PROMPT + "?")) == RESPONSE
+
+def test_exact_tier_serves_while_the_embedder_loads():
+    embedder = LoadingEmbedder()
+
+    async def scenario():
+        cache = AsyncSemanticCache(SemanticCache(embedder=embedder, CACHE_LOGS=False, max_cache_size=64), CACHE_LOGS=False)
+        try:
+            insert = cache.add_nowait(PROMPT, RESPONSE)
+            await asyncio.sleep(0.05)
+            loading = (await cache.match(PROMPT.lower()), await cache.match(PROMPT + "?"))
+            lookups_embedded = embedder.calls
+            embedder.loaded.set()
+            await insert
+            return loading, lookups_embedded, await cache.get(PROMPT + "?")
+        finally:
+            cache.close()
+
+    (exact, semantic), lookups_embedded, later = asyncio.run(scenario())
+    assert exact.value == RESPONSE
+    # the semantic lookup misses at once instead of waiting for the model
+    assert semantic.value is None and semantic.embedding is None
+    assert lookups_embedded == 1 # only the insert waited to be embedded
+    assert later == RESPONSE
+
+def test_warming_backend_is_routed_to_after_ready(make_load_balancer):
+    lb = make_load_balancer()
+
+    async def scenario():
+        server = await asyncio.start_server(lb.handle_connection, "localhost", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("localhost", port)
+        try:
+            write_frame(writer, MessageType.REGISTER, payload="localhost|1235|warming|workers=2")
+            await writer.drain()
+            registered = await FrameReader(reader).read_frame()
+            warming = (dict(lb.warming_backends), dict(lb.backend_servers))
+            write_frame(writer, MessageType.READY)
+            await writer.drain()
+            await asyncio.sleep(0.05)
+            ready = (dict(lb.warming_backends), lb.backend_servers.get(("localhost", 1235)))
+            return registered.msg_type, warming, ready
+        finally:
+            writer.close()
+            server.close()
+
+    registered, (warming, routed), (still_warming, ready) = asyncio.run(scenario())
+    assert registered == MessageType.REGISTERED
+    assert warming == {("localhost", 1235): 2} and not routed
+    assert not still_warming and ready.capacity == 2
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from embedders import HashingEmbedder
+from embedding_index import QuantizedIndex, normalize
+from semantic_cache import SemanticCache
+
+DIM = 32
+
+def random_vectors(count, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32)
+
+def best_match(vectors, query):
+    scores = np.stack([normalize(vector) for vector in vectors]) @ normalize(query)
+    best = int(np.argmax(scores))
+    return best, float(scores[best])
+
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+@pytest.mark.parametrize("rerank", ["memmap", "memory"])
+def test_reranked_search_matches_full_precision(dtype, rerank):
+    index = QuantizedIndex(DIM, None, dtype=dtype, rerank=rerank, chunk_size=64)
+    vectors = random_vectors(300)
+    for slot, vector in enumerate(vectors):
+        index.add(slot, vector)
+    for query in random_vectors(20, seed=1):
+        slot, similarity = index.search(query)
+        expected_slot, expected = best_match(vectors, query)
+        assert slot == expected_slot and similarity == pytest.approx(expected, abs=1e-5)
+
+def test_quantized_scores_without_rerank_are_close():
+    index = QuantizedIndex(DIM, None, rerank=None)
+    vectors = random_vectors(50)
+    for slot, vector in enumerate(vectors):
+        index.add(slot, vector)
+    for slot in (0, 17, 49):
+        found, similarity = index.search(vectors[slot])
+        assert found == slot and similarity == pytest.approx(1.0, abs=0.01)
+    assert index.bytes_per_vector == DIM + 4
+
+def test_cells_probe_a_subset_and_track_removals():
+    vectors = random_vectors(200)
+    index = QuantizedIndex(DIM, None, rerank='memory', nlist=4, nprobe=4, train_size=64)
+    for slot, vector in enumerate(vectors):
+        index.add(slot, vector)
+    assert len(index.cells) == 4 and sum(cell.count for cell in index.cells) == 200
+    for slot in range(0, 200, 2):
+        index.remove(slot)
+    assert sum(cell.count for cell in index.cells) == index.size == 100
+    # probing every cell is exact
+    for query in random_vectors(10, seed=1):
+        assert index.search(query)[0] == 2 * best_match(vectors[1::2], query)[0] + 1
+
+def test_quantizes_a_given_matrix_in_place():
+    vectors = np.stack([normalize(vector) for vector in random_vectors(40)])
+    index = QuantizedIndex(DIM, None, full=vectors, chunk_size=16)
+    assert index.size == 40 and index.full is vectors
+    assert index.search(vectors[25])[0] == 25
+    np.testing.assert_allclose(index.export(np.array([3, 9])), vectors[[3, 9]])
+
+@pytest.mark.parametrize("index, options", [("flat", None), ("quantized", {"rerank": None})])
+def test_byte_budget_fills_before_evicting(index, options):
+    # an int8 entry without re-rank rows is about 300 bytes, so far more than
+    # max_cache_bytes // 1024 of them fit
+    cache = SemanticCache(embedder=HashingEmbedder(), CACHE_LOGS=False, index=index, index_options=options,
+                          max_cache_bytes=4000)
+    entries = [(f"prompt number {i} about something else", "x" * 40) for i in range(100)]
+    for i, (prompt, response) in enumerate(entries):
+        cache.add(prompt, response)
+        assert cache.cache_bytes <= cache.max_cache_bytes
+        if len(cache) <= i:
+            break
+    entry = cache.index.bytes_per_vector + len(entries[0][1])
+    # only the bytes count: the cache holds as many entries as fit, then evicts the oldest
+    assert len(cache) == cache.max_cache_bytes // entry
+    assert cache.get_exact(entries[0][0]) is None
+    assert cache.get_exact(entries[len(cache)][0]) == entries[len(cache)][1]
@@ -0,0 +1,39 @@
+import asyncio
+
+import numpy as np
+
+from framing import MessageType
+from request_coalescer import RequestCoalescer
+from conftest import request
+
+def test_exact_match_ignores_case_and_spacing():
+    coalescer = RequestCoalescer()
+    coalescer.register("a", "Tell me a joke")
+    coalescer.register("b", "tell me  a JOKE") # a duplicate leader keeps the first one
+    assert coalescer.find("  tell me a joke ") == "a"
+    assert coalescer.find("tell me a riddle") is None
+    coalescer.unregister("a")
+    assert coalescer.find("tell me a joke") is None
+    coalescer.unregister("a") # unknown leaders are ignored
+    assert len(coalescer) == 1
+
+def test_semantic_match_joins_after_embedding():
+    coalescer = RequestCoalescer(similarity_threshold=0.9)
+    coalescer.register("a", "first prompt")
+    assert coalescer.find("second prompt", np.array([1.0, 0.0])) is None
+    coalescer.set_embedding("a", np.array([2.0, 0.0]))
+    assert coalescer.find("second prompt", np.array([1.0, 0.1])) == "a"
+    assert coalescer.find("second prompt", np.array([1.0, 1.0])) is None
+    coalescer.similarity_threshold = 0.7
+    assert coalescer.find("second prompt", np.array([1.0, 1.0])) == "a"
+    coalescer.unregister("a")
+    assert coalescer.find_similar(np.array([1.0, 0.0])) is None
+
+def test_concurrent_identical_requests_share_one_response(load_balancer):
+    async def scenario():
+        prompt = "List three uses for a paperclip"
+        return await asyncio.gather(*(request(load_balancer, prompt) for _ in range(8)))
+
+    responses = asyncio.run(scenario())
+    assert {msg_type for msg_type, _, _ in responses} == {MessageType.RESPONSE}
+    assert len({text for _, _, text in responses}) == 1
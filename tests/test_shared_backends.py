@@ -0,0 +1,79 @@
+import asyncio
+import multiprocessing
+
+import pytest
+
+from shared_backends import SharedBackendTable
+from conftest import ALGORITHMS
+
+def test_register_and_unregister_bump_the_version():
+    table = SharedBackendTable(num_workers=2, max_backends=2)
+    first = table.register("localhost", 1235, capacity=2)
+    assert table.register("localhost", 1235) == first # a re-registration only refreshes it
+    second = table.register("localhost", 1236)
+    assert table.version.value == 2
+    assert table.backends() == {("localhost", 1235): first, ("localhost", 1236): second}
+    assert table.capacities[first] == 2
+    with pytest.raises(RuntimeError):
+        table.register("localhost", 1237)
+
+    table.unregister("localhost", 1235)
+    table.unregister("localhost", 1235)
+    assert table.version.value == 3
+    assert table.register("localhost", 1237) == first # the freed row is reused
+
+def publish_from_worker(table, row):
+    table.publish(1, row, 3, 30)
+    table.register("localhost", 1236)
+
+def test_load_is_seen_by_the_other_workers():
+    table = SharedBackendTable(num_workers=3)
+    row = table.register("localhost", 1235)
+    table.publish(0, row, 1, 10)
+    worker = multiprocessing.get_context("fork").Process(target=publish_from_worker, args=(table, row))
+    worker.start()
+    worker.join(10)
+
+    assert ("localhost", 1236) in table.backends()
+    connections, tokens = table.remote_load(0)
+    assert (connections[row], tokens[row]) == (3, 30)
+    connections, tokens = table.remote_load(2)
+    assert (connections[row], tokens[row]) == (4, 40)
+
+def test_workers_follow_the_shared_table(make_load_balancer):
+    table = SharedBackendTable(num_workers=2)
+    workers = [make_load_balancer("-c") for _ in range(2)]
+    for worker_id, lb in enumerate(workers):
+        lb.worker_id = worker_id
+        lb.shared_backends = table
+        lb.SHARED_SYNC_INTERVAL = 0.01
+
+    async def sync(lb):
+        try:
+            await asyncio.wait_for(lb.sync_shared_backends(), 0.05)
+        except asyncio.TimeoutError:
+            pass
+
+    async def scenario():
+        workers[0].add_backend("localhost", 1235, capacity=2)
+        server = workers[0].backend_servers[("localhost", 1235)]
+        workers[0].LB_algorithm.acquire(server)
+        await sync(workers[0])
+        await sync(workers[1])
+        added = workers[1].backend_servers.get(("localhost", 1235))
+        workers[0].remove_backend("localhost", 1235)
+        await sync(workers[1])
+        return added
+
+    added = asyncio.run(scenario())
+    assert added is not None and added.capacity == 2
+    assert added.remote_connections == 1
+    assert ("localhost", 1235) not in workers[1].backend_servers
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+def test_add_server_returns_existing(algorithm):
+    lb = algorithm()
+    first = lb.add_server("localhost", 1235)
+    lb.add_server("localhost", 1236)
+    assert lb.add_server("localhost", 1235) is first
+    assert len(lb.servers) == 2
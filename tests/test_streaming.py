@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+from framing import FrameReader, MessageType, write_frame, new_request_id, FLAG_CACHE_HIT, FLAG_STREAM
+from generation_scheduler import GenerationScheduler
+from conftest import request, request_until_cached
+
+def test_streamed_response_is_cached(load_balancer):
+    async def scenario():
+        prompt = "Describe the sound of rain on a tin roof"
+        streamed = await request(load_balancer, prompt, FLAG_STREAM)
+        cached = await request_until_cached(load_balancer, prompt)
+        return prompt, streamed, cached
+
+    prompt, streamed, cached = asyncio.run(scenario())
+    msg_type, flags, text = streamed
+    assert msg_type == MessageType.END and text.startswith(prompt)
+    # the stub streams "<prompt> <token> <token> ..." one word at a time
+    assert cached[1] & FLAG_CACHE_HIT and cached[2].split() == text.split()
+
+def test_stream_arrives_in_pieces(load_balancer):
+    async def scenario():
+        reader, writer = await asyncio.open_connection("localhost", load_balancer)
+        try:
+            write_frame(writer, MessageType.HELLO)
+            write_frame(writer, MessageType.REQUEST, new_request_id(), "Name the planets one by one", FLAG_STREAM)
+            await writer.drain()
+            types = []
+            async for frame in FrameReader(reader):
+                types.append(frame.msg_type)
+                if frame.msg_type != MessageType.CHUNK:
+                    return types
+        finally:
+            writer.close()
+
+    types = asyncio.run(scenario())
+    assert types[-1] == MessageType.END
+    assert len(types) > 2 and set(types[:-1]) == {MessageType.CHUNK}
+
+def test_scheduler_stops_a_stream_nobody_reads():
+    produced = []
+    finished = threading.Event()
+
+    def generate_stream(prompt):
+        try:
+            for i in range(1000):
+                produced.append(i)
+                yield f"{i} "
+        finally:
+            finished.set()
+
+    async def scenario():
+        scheduler = GenerationScheduler(None, generate_stream, SCHEDULER_LOGS=False)
+        stream = scheduler.submit_stream("request", "a prompt")
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(scenario()) == "0 "
+    assert finished.wait(5)
+    assert len(produced) < 1000
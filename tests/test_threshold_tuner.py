@@ -0,0 +1,64 @@
+import asyncio
+
+from framing import MessageType, FLAG_CACHE_HIT, FLAG_PROVISIONAL
+from threshold_tuner import ThresholdTuner
+from conftest import request, request_until_cached
+
+def test_threshold_drops_through_agreeing_bins():
+    tuner = ThresholdTuner(0.95, band=0.02, bin_width=0.005, min_samples=5)
+    for _ in range(5):
+        tuner.record(0.948, True)
+    assert tuner.threshold == 0.945
+    # the next bin disagrees, so the threshold stops above it
+    for _ in range(5):
+        tuner.record(0.943, False)
+    assert tuner.threshold == 0.945
+    # similarities outside the band are ignored
+    assert tuner.record(0.9, True) == 0.945
+    assert tuner.record(0.96, False) == 0.945
+
+def test_threshold_never_drops_below_band():
+    tuner = ThresholdTuner(0.95, band=0.01, bin_width=0.005, min_samples=1)
+    for similarity in (0.949, 0.944, 0.94):
+        tuner.record(similarity, True)
+    assert tuner.threshold == tuner.floor == 0.94
+
+def test_threshold_rises_when_accepted_bin_stops_agreeing():
+    tuner = ThresholdTuner(0.95, band=0.01, bin_width=0.005, min_samples=5, window=20)
+    for _ in range(19):
+        tuner.record(0.948, True)
+    assert tuner.threshold == 0.945
+    # old outcomes are halved away, so a run of disagreements outweighs them
+    for _ in range(10):
+        tuner.record(0.948, False)
+    assert tuner.threshold == 0.95
+
+def test_only_hits_in_accepted_bins_are_sampled():
+    tuner = ThresholdTuner(0.95, band=0.01, bin_width=0.005, min_samples=1, verify_rate=1.0)
+    assert not tuner.should_verify(0.948) # below the threshold: a miss, not a hit
+    tuner.record(0.948, True)
+    assert tuner.should_verify(0.948)
+    assert not tuner.should_verify(0.97) # hits above the base threshold need no check
+    assert not tuner.should_verify(None) # exact hits have no similarity
+    tuner.verify_rate = 0.0
+    assert not tuner.should_verify(0.948)
+
+def test_near_miss_gets_a_provisional_answer(load_balancer):
+    # the HashingEmbedder scores each variant about 0.94 against the cached prompt:
+    # under the 0.95 threshold, inside the 0.05 provisional band
+    cached_prompt = "Tell me a story about a lighthouse keeper and the storm that came at night"
+    provisional_prompt = "Tell me a story about a lighthouse keeper and the gale that came at night"
+    plain_prompt = "Tell me a story about a lighthouse keeper and the storm that came at dusk"
+
+    async def scenario():
+        cached = await request_until_cached(load_balancer, cached_prompt)
+        provisional = await request(load_balancer, provisional_prompt, FLAG_PROVISIONAL)
+        plain = await request(load_balancer, plain_prompt)
+        # the real response was generated behind the provisional answer and cached
+        real = await request_until_cached(load_balancer, provisional_prompt)
+        return cached, provisional, plain, real
+
+    cached, provisional, plain, real = asyncio.run(scenario())
+    assert provisional == (MessageType.RESPONSE, FLAG_CACHE_HIT | FLAG_PROVISIONAL, cached[2])
+    assert not plain[1] & FLAG_CACHE_HIT and plain[2].startswith(plain_prompt)
+    assert real[1] == FLAG_CACHE_HIT and real[2].startswith(provisional_prompt)
@@ -0,0 +1,89 @@
+import math
+import random
+import threading
+
+class ThresholdTuner:
+    """Tunes the cache's similarity threshold from verified provisional answers.
+
+    A request whose best cache candidate scores within `band` below the threshold
+    can be answered with that candidate provisionally; the real response is still
+    generated, and `record` is told whether the two agreed. Outcomes are counted in
+    similarity bins of `bin_width`. Walking down from the base threshold, every bin
+    that has at least `min_samples` outcomes and an agreement rate of at least
+    `target_agreement` is accepted, and the threshold becomes the lower edge of the
+    last accepted bin, so near misses that reliably agree become real hits. The
+    threshold never drops below the band.
+
+    Accepted bins are answered as real hits rather than provisionally, so
+    `should_verify` picks a `verify_rate` fraction of those hits to be verified
+    as well. Once a bin has `window` outcomes its counts are halved, so recent
+    outcomes outweigh old ones and the threshold goes back up when a bin's
+    agreement drops below the target.
+    """
+    def __init__(self, threshold, band=0.05, bin_width=0.005, target_agreement=0.9, min_samples=20,
+                 verify_rate=0.05, window=200):
+        self.base_threshold = threshold
+        self.threshold = threshold
+        self.band = band
+        self.bin_width = bin_width
+        self.target_agreement = target_agreement
+        self.min_samples = min_samples
+        self.verify_rate = verify_rate
+        self.window = max(window, 2 * min_samples) # halving must leave an accepted bin at min_samples
+        self.num_bins = max(1, math.ceil(band / bin_width - 1e-9))
+        self.samples = [0] * self.num_bins # bin -> verified answers, bin 0 just below the base threshold
+        self.agreed = [0] * self.num_bins
+        self.lock = threading.Lock()
+
+    @property
+    def floor(self):
+        """The lowest similarity that may be answered provisionally."""
+        return self.base_threshold - self.band
+
+    def should_verify(self, similarity):
+        """Returns whether a cache hit with this similarity should be verified like a provisional answer.
+
+        Only hits that the tuned threshold let through are sampled, `verify_rate` of them.
+        """
+        if similarity is None or similarity >= self.base_threshold or similarity < self.threshold:
+            return False
+        return random.random() < self.verify_rate
+
+    def record(self, similarity, agreed):
+        """Records whether a provisional answer with this similarity agreed with the real response.
+
+        Returns:
+            The threshold after the update.
+        """
+        offset = self.base_threshold - similarity
+        if offset <= 0 or offset > self.band:
+            return self.threshold
+        position = min(self.num_bins - 1, int(offset / self.bin_width))
+        with self.lock:
+            self.samples[position] += 1
+            self.agreed[position] += bool(agreed)
+            if self.samples[position] >= self.window:
+                self.samples[position] //= 2
+                self.agreed[position] //= 2
+            threshold = self.base_threshold
+            for position in range(self.num_bins):
+                samples = self.samples[position]
+                if samples < self.min_samples or self.agreed[position] / samples < self.target_agreement:
+                    break
+                threshold = max(self.floor, self.base_threshold - (position + 1) * self.bin_width)
+            self.threshold = threshold
+            return threshold
+
+    def stats(self):
+        """Returns the current threshold and the recent agreement counts per similarity bin."""
+        with self.lock:
+            return {
+                "threshold": self.threshold,
+                "verified": sum(self.samples),
+                "agreed": sum(self.agreed),
+                "bins": [
+                    {"similarity": round(self.base_threshold - (position + 1) * self.bin_width, 6),
+                     "samples": self.samples[position], "agreed": self.agreed[position]}
+                    for position in range(self.num_bins)
+                ],
+            }